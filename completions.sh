@@ -35,11 +35,12 @@ _tbot()
     done
 
     if [[ "$cur" == -* ]]; then
-        COMPREPLY=( $( compgen -W '-h -b -l -T -t -f -v -q -s -i
+        COMPREPLY=( $( compgen -W '-h -b -l -T -t -f -v -q -s -i -j
             --help
             --board
             --lab
             --version
+            --jobs
             --list-testcases
             --list-labs
             --list-boards
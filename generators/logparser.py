@@ -14,6 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
+import gzip
+import io
+import itertools
+import sys
 import typing
 import json
 
@@ -36,31 +41,213 @@ class LogEvent:
 READ_SIZE = 8192
 
 
-def logfile(filename: str) -> typing.Generator[LogEvent, None, None]:
-    """Parse a logfile."""
-    with open(filename, "r") as f:
-        buf = f.read(READ_SIZE)
-
-        decoder = json.JSONDecoder()
-        while True:
-            try:
-                raw_ev, idx = decoder.raw_decode(buf)
-            except json.JSONDecodeError:
-                new = f.read(READ_SIZE)
-                if new == "":
-                    return
+def _ndjson(f: typing.Iterable[str]) -> typing.Generator[LogEvent, None, None]:
+    for line in f:
+        if not line.endswith("\n"):
+            # tbot did not finish writing the last event
+            return
+        if line.strip() != "":
+            yield LogEvent(json.loads(line))
+
+
+def _json(f: typing.TextIO, buf: str) -> typing.Generator[LogEvent, None, None]:
+    decoder = json.JSONDecoder()
+    while True:
+        try:
+            raw_ev, idx = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            new = f.read(READ_SIZE)
+            if new == "":
+                return
+            else:
+                buf += new
+                buf = buf.lstrip()
+            continue
+
+        yield LogEvent(raw_ev)
+
+        buf = buf[idx:].lstrip()
+
+
+def _open(filename: str) -> typing.TextIO:
+    """Open a logfile for reading, decompressing it on the fly if necessary."""
+    f = open(filename, "rb")
+    magic = f.peek(4)[:4]
+    if magic[:2] == b"\x1f\x8b":
+        f.close()
+        return gzip.open(filename, "rt", encoding="utf-8", newline="\n")
+    elif magic == b"\x28\xb5\x2f\xfd":
+        try:
+            import zstandard
+        except ImportError:
+            f.close()
+            raise Exception(f"{filename} is zstd compressed, install 'zstandard'")
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        return io.TextIOWrapper(reader, encoding="utf-8", newline="\n")
+    return io.TextIOWrapper(f, encoding="utf-8", newline="\n")
+
+
+def _skip(f: typing.TextIO, pos: int, offset: int) -> None:
+    # Logs are pure ASCII, so byte offsets are also character offsets
+    if f.seekable():
+        f.seek(offset)
+        return
+
+    # Compressed streams can't seek, read up to the offset instead
+    remaining = offset - pos
+    while remaining > 0:
+        skipped = len(f.read(min(remaining, 1024 * 1024)))
+        if skipped == 0:
+            return
+        remaining -= skipped
+
+
+def logfile(filename: str, offset: int = 0) -> typing.Generator[LogEvent, None, None]:
+    """
+    Parse a logfile.
+
+    Both the indented json format and the compact one written with
+    ``--log-format ndjson`` are supported.  The format is detected from the
+    first line.  Logs compressed with gzip or zstd (``--log-compress``) are
+    decompressed while reading.
+
+    :param str filename: Path to the logfile
+    :param int offset: Byte offset of the first event to read, as found in the
+        log's index.  Compressed logs are decompressed up to this offset.
+    """
+    with _open(filename) as f:
+        try:
+            first = f.readline()
+            if first == "":
+                return
+            # Indented json, events span multiple lines
+            indented = first.strip() == "{"
+
+            if offset > 0:
+                _skip(f, len(first), offset)
+                first = ""
+
+            if indented:
+                yield from _json(f, first)
+            else:
+                yield from _ndjson(itertools.chain([first] if first else [], f))
+        except EOFError:
+            # The compressed stream was not finished, tbot did not exit cleanly
+            return
+
+
+class LogIndex:
+    """
+    Index of a logfile.
+
+    tbot writes the index next to the log, as ``<logfile>.idx``, if it is run
+    with ``--log-index``.  It contains
+    the offsets of all testcase and exception events, of every 1000th event,
+    and the span of each testcase.
+    """
+
+    def __init__(self, filename: str) -> None:
+        """Read the index of the logfile ``filename``."""
+        self.events: typing.List[typing.Tuple[int, int]] = []
+        self.testcases: typing.List[typing.Dict[str, typing.Any]] = []
+
+        with open(filename + ".idx", "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # tbot did not finish writing the index
+                    break
+                entry = json.loads(line)
+                if "testcase" in entry:
+                    self.testcases.append(entry)
                 else:
-                    buf += new
-                    buf = buf.lstrip()
-                continue
-
-            yield LogEvent(raw_ev)
-
-            buf = buf[idx:].lstrip()
+                    self.events.append((entry["event"], entry["offset"]))
+
+        # Spans are written when a testcase ends, order them by their start
+        self.testcases.sort(key=lambda tc: int(tc["first"]))
+
+    def seek(self, num: int) -> typing.Tuple[int, int]:
+        """
+        Find the closest indexed event at or before event ``num``.
+
+        :returns: Number and offset of the indexed event.
+        """
+        i = bisect.bisect_right(self.events, (num, sys.maxsize))
+        return self.events[i - 1] if i > 0 else (0, 0)
+
+    def testcase(self, name: str, nth: int = 0) -> typing.Dict[str, typing.Any]:
+        """
+        Find the span of the ``nth`` run of testcase ``name``.
+
+        :raises KeyError: If the index does not contain this testcase run.
+        """
+        runs = [tc for tc in self.testcases if tc["testcase"] == name]
+        if len(runs) <= nth:
+            raise KeyError(name)
+        return runs[nth]
+
+
+def _index(filename: str) -> typing.Optional[LogIndex]:
+    try:
+        return LogIndex(filename)
+    except FileNotFoundError:
+        return None
+
+
+def events(filename: str, start: int) -> typing.Generator[LogEvent, None, None]:
+    """
+    Parse a logfile, starting at event number ``start`` (counting from 0).
+
+    Uses the log's index to skip most of the events before ``start`` without
+    parsing them.
+    """
+    index = _index(filename)
+    num, offset = index.seek(start) if index is not None else (0, 0)
+    yield from itertools.islice(logfile(filename, offset), start - num, None)
+
+
+def testcase(
+    filename: str, name: str, nth: int = 0
+) -> typing.Generator[LogEvent, None, None]:
+    """
+    Parse the events of one testcase run.
+
+    Yields everything from the ``nth`` ``tc begin`` event of testcase ``name``
+    up to and including the matching ``tc end`` event.  Uses the log's index
+    if there is one, otherwise the whole log is searched.
+    """
+    index = _index(filename)
+    if index is not None:
+        try:
+            span = index.testcase(name, nth)
+        except KeyError:
+            pass
+        else:
+            count = span["last"] - span["first"] + 1
+            yield from itertools.islice(logfile(filename, span["begin"]), count)
+            return
+
+    depth = None
+    for ev in logfile(filename):
+        if depth is None:
+            if ev.type == ["tc", "begin"] and ev.data["name"] == name:
+                if nth == 0:
+                    depth = 0
+                else:
+                    nth -= 1
+        if depth is not None:
+            yield ev
+            if ev.type == ["tc", "begin"]:
+                depth += 1
+            elif ev.type == ["tc", "end"]:
+                depth -= 1
+                if depth == 0:
+                    return
 
 
 if __name__ == "__main__":
-    import sys
-
-    for ev in logfile(sys.argv[1]):
+    if len(sys.argv) > 2:
+        evs = testcase(sys.argv[1], sys.argv[2])
+    else:
+        evs = logfile(sys.argv[1])
+    for ev in evs:
         print(repr(ev))
@@ -5,6 +5,8 @@ from . import config
 
 class Channel:
     def exec_command(self, command: str) -> None: ...
+    def set_combine_stderr(self, combine: bool) -> bool: ...
+    def shutdown_write(self) -> None: ...
     def recv(self, nbytes: int) -> bytes: ...
     def recv_ready(self) -> bool: ...
     def recv_exit_status(self) -> int: ...
@@ -38,6 +40,8 @@ class Transport:
         max_packet_size: typing.Optional[int] = None,
         timeout: typing.Optional[float] = None,
     ) -> Channel: ...
+    def is_active(self) -> bool: ...
+    def send_ignore(self, byte_count: typing.Optional[int] = None) -> None: ...
 
 
 class SSHClient:
@@ -68,3 +72,41 @@ class SSHClient:
     ) -> None: ...
     def get_transport(self) -> Transport: ...
     def close(self) -> None: ...
+
+
+class SFTPAttributes:
+    st_size: int
+    st_mode: int
+    st_mtime: int
+
+
+class SFTPFile:
+    def __enter__(self) -> "SFTPFile": ...
+    def __exit__(self, *args: typing.Any) -> None: ...
+    def read(self, size: typing.Optional[int] = None) -> bytes: ...
+    def write(self, data: bytes) -> None: ...
+    def seek(self, offset: int, whence: int = 0) -> None: ...
+    def stat(self) -> SFTPAttributes: ...
+    def set_pipelined(self, pipelined: bool = True) -> None: ...
+    def readv(
+        self,
+        chunks: typing.List[typing.Tuple[int, int]],
+        max_concurrent_prefetch_requests: typing.Optional[int] = None,
+    ) -> typing.Iterator[bytes]: ...
+    def close(self) -> None: ...
+
+
+class SFTPClient:
+    @classmethod
+    def from_transport(
+        cls,
+        t: Transport,
+        window_size: typing.Optional[int] = None,
+        max_packet_size: typing.Optional[int] = None,
+    ) -> "SFTPClient": ...
+    def open(self, filename: str, mode: str = "r", bufsize: int = -1) -> SFTPFile: ...
+    def stat(self, path: str) -> SFTPAttributes: ...
+    def remove(self, path: str) -> None: ...
+    def rename(self, oldpath: str, newpath: str) -> None: ...
+    def posix_rename(self, oldpath: str, newpath: str) -> None: ...
+    def close(self) -> None: ...
@@ -0,0 +1,13 @@
+import typing
+
+class ZstdCompressor:
+    def __init__(self, level: int = 3) -> None: ...
+    def stream_writer(
+        self, writer: typing.BinaryIO, *, closefd: bool = True
+    ) -> typing.BinaryIO: ...
+
+class ZstdDecompressor:
+    def __init__(self) -> None: ...
+    def stream_reader(
+        self, source: typing.BinaryIO, *, closefd: bool = True
+    ) -> typing.BinaryIO: ...
@@ -14,11 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import atexit
 import enum
 import io
 import itertools
 import json
+import queue
 import sys
+import tempfile
+import threading
 import time
 import typing
 from termcolor2 import c
@@ -56,11 +60,284 @@ NESTING = 0
 INTERACTIVE = False
 VERBOSITY = Verbosity.INFO
 LOGFILE: typing.Optional[typing.TextIO] = None
+LOGINDEX: typing.Optional[typing.TextIO] = None
+NDJSON = False
 START_TIME = time.monotonic()
 
+_LOCAL = threading.local()
+_FLUSH_LOCK = threading.Lock()
+
+
+class BufferedLog:
+    """
+    Hold back all log output of the current thread.
+
+    Used to run testcases concurrently: Each thread buffers its log output,
+    which is then flushed as one block, so the output of different threads
+    is not interleaved.  Nesting continues from where it was when the buffer
+    was created.  Buffers can be nested, the output of an inner buffer is
+    flushed into the outer one.
+
+    **Example**::
+
+        with tbot.log.BufferedLog() as buf:
+            my_testcase()
+        buf.flush()
+    """
+
+    def __init__(self) -> None:
+        """Create a new log buffer."""
+        buf = _buffer()
+        self.nesting: int = buf.nesting if buf is not None else NESTING
+        self.lines: typing.List[typing.Union[str, typing.Dict[str, typing.Any]]] = []
+        self.previous: typing.Optional[BufferedLog] = None
+
+    def __enter__(self) -> "BufferedLog":
+        self.previous = _buffer()
+        _LOCAL.buffer = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        # An enclosing buffer collects output again
+        _LOCAL.buffer = self.previous
+        self.previous = None
+
+    def flush(self) -> None:
+        """
+        Write everything that was buffered to stdout and the logfile.
+
+        If another buffer is active in this thread, the output is moved to
+        that one instead.
+        """
+        buf = _buffer()
+        if buf is not None and buf is not self:
+            buf.lines.extend(self.lines)
+            self.lines = []
+            return
+
+        with _FLUSH_LOCK:
+            for line in self.lines:
+                if isinstance(line, str):
+                    print(line)
+                elif LOGFILE is not None:
+                    _write_event(line)
+            self.lines = []
+
+
+def _buffer() -> typing.Optional[BufferedLog]:
+    return typing.cast(typing.Optional[BufferedLog], getattr(_LOCAL, "buffer", None))
+
+
+def _nest(delta: int) -> None:
+    global NESTING
+
+    buf = _buffer()
+    if buf is not None:
+        buf.nesting += delta
+    else:
+        NESTING += delta
+
+
+def _print(line: str) -> None:
+    buf = _buffer()
+    if buf is not None:
+        buf.lines.append(line)
+    else:
+        print(line)
+
+
+class _LogWriter(threading.Thread):
+    """
+    Write log events to a file in the background.
+
+    Events are queued as compact json lines and the file is only flushed
+    every :attr:`~tbot.log._LogWriter.flush_interval` seconds, instead of after
+    each event.  If the queue is full, adding an event blocks until the writer
+    caught up, so no events are lost.
+    """
+
+    queue_size = 4096
+    """Maximum number of events waiting to be written."""
+
+    flush_interval = 1.0
+    """Maximum time in seconds between writing an event and flushing the file."""
+
+    def __init__(self, f: typing.TextIO) -> None:
+        super().__init__(name="tbot-log-writer", daemon=True)
+        self.file = f
+        self.queue: "queue.Queue[typing.Optional[str]]" = queue.Queue(self.queue_size)
+        self.error: typing.Optional[Exception] = None
+
+    def put(self, line: str) -> None:
+        if self.error is not None:
+            raise self.error
+        self.queue.put(line)
+
+    def run(self) -> None:
+        last_flush = time.monotonic()
+        dirty = False
+        while True:
+            try:
+                line = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                line = ""
+
+            if line is None:
+                try:
+                    self.file.flush()
+                except Exception as e:
+                    self.error = e
+                return
+
+            try:
+                if line != "":
+                    self.file.write(line)
+                    dirty = True
+                if dirty and time.monotonic() - last_flush >= self.flush_interval:
+                    self.file.flush()
+                    last_flush = time.monotonic()
+                    dirty = False
+            except Exception as e:
+                # Keep draining the queue so no one blocks on it forever
+                self.error = e
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+_WRITER: typing.Optional[_LogWriter] = None
+_WRITER_LOCK = threading.Lock()
+
+
+class _LogIndex:
+    """
+    Sidecar index of a logfile.
+
+    Records the byte offsets of testcase and exception events, a checkpoint
+    every :attr:`~tbot.log._LogIndex.checkpoint` events, and the span of each
+    testcase, one json object per line.  This allows reading parts of a log
+    without parsing everything before them.
+    """
+
+    checkpoint = 1000
+    """Number of events between two checkpoints."""
+
+    def __init__(self, f: typing.TextIO, log: typing.TextIO) -> None:
+        self.file = f
+        self.log = log
+        self.offset = 0
+        self.count = 0
+        self.testcases: typing.List[typing.Tuple[str, int, int]] = []
+
+    def _entry(self, entry: typing.Dict[str, typing.Any]) -> None:
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def add(self, ev: typing.Dict[str, typing.Any], length: int) -> None:
+        ty = ev["type"]
+        if ty in (["tc", "begin"], ["tc", "end"], ["exception"]):
+            self._entry(
+                {
+                    "event": self.count,
+                    "offset": self.offset,
+                    "type": ty,
+                    "name": ev["data"]["name"],
+                }
+            )
+        elif self.count % self.checkpoint == 0:
+            self._entry({"event": self.count, "offset": self.offset})
+
+        if ty == ["tc", "begin"]:
+            self.testcases.append((ev["data"]["name"], self.offset, self.count))
+        elif ty == ["tc", "end"] and self.testcases != []:
+            name, begin, first = self.testcases.pop()
+            self._entry(
+                {
+                    "testcase": name,
+                    "begin": begin,
+                    "end": self.offset + length,
+                    "first": first,
+                    "last": self.count,
+                    "success": ev["data"]["success"],
+                }
+            )
+
+        self.offset += length
+        self.count += 1
+
+
+_INDEX: typing.Optional[_LogIndex] = None
+
+
+def flush_logfile() -> None:
+    """
+    Wait until all log events were written to the logfile.
+
+    Events are written in the background if :data:`~tbot.log.NDJSON` is set.
+    The index (:data:`~tbot.log.LOGINDEX`) is always flushed.
+    """
+    global _WRITER
+
+    with _WRITER_LOCK:
+        writer, _WRITER = _WRITER, None
+        if LOGINDEX is not None and not LOGINDEX.closed:
+            LOGINDEX.flush()
+    if writer is not None:
+        writer.close()
+
+
+atexit.register(flush_logfile)
+
+
+def _write_event(ev: typing.Dict[str, typing.Any]) -> None:
+    global _WRITER, _INDEX
+
+    assert LOGFILE is not None
+    with _WRITER_LOCK:
+        # json.dumps escapes all non-ASCII characters, so the length of the
+        # text is also its size in bytes
+        if NDJSON:
+            # Encode right away, so later changes to the data don't end up in
+            # the log
+            line = json.dumps(ev, separators=(",", ":")) + "\n"
+            if _WRITER is not None and _WRITER.file is not LOGFILE:
+                # The logfile was replaced, finish the old one first
+                _WRITER.close()
+                _WRITER = None
+            if _WRITER is None:
+                _WRITER = _LogWriter(LOGFILE)
+                _WRITER.start()
+            _WRITER.put(line)
+        else:
+            line = json.dumps(ev, indent=2) + "\n"
+            LOGFILE.write(line)
+            LOGFILE.flush()
+
+        if LOGINDEX is not None:
+            if _INDEX is None or _INDEX.file is not LOGINDEX:
+                _INDEX = _LogIndex(LOGINDEX, LOGFILE)
+            # Events written to a different logfile don't belong in the index
+            if _INDEX.log is LOGFILE:
+                _INDEX.add(ev, len(line))
+
 
 class EventIO(io.StringIO):
-    """Stream for a log event."""
+    """
+    Stream for a log event.
+
+    Text written to the event is printed line by line and stored in the
+    underlying :class:`io.StringIO`.  Once the text exceeds
+    :attr:`~tbot.log.EventIO.spool_size` characters, it is moved to a
+    temporary file instead of being kept in memory.
+    """
+
+    spool_size = 1024 * 1024
+    """Number of characters kept in memory before spilling to a file."""
+
+    max_line = 16 * 1024
+    """Maximum length of an incomplete line held back for printing."""
 
     def __init__(
         self,
@@ -74,14 +351,13 @@ class EventIO(io.StringIO):
         """
         Create a log event.
 
-        A log event is a :class:`io.StringIO` and everything written to
-        the stram will be added to the log event.
+        A log event is a text stream and everything written to the stream will
+        be added to the log event.
 
         :param str initial: Optional first line of the log event
         """
         super().__init__("")
 
-        self.cursor = 0
         self.first = True
         self.prefix: typing.Optional[str] = None
         self.nest_first = nest_first or u("├─", "+-")
@@ -89,6 +365,10 @@ class EventIO(io.StringIO):
         self.ty = ty
         self.data = kwargs
 
+        # Text which was not printed yet, because it does not end in a newline
+        self._pending = ""
+        self._spill: typing.Optional[typing.TextIO] = None
+
         if initial:
             self.writeln(str(initial))
 
@@ -96,27 +376,51 @@ class EventIO(io.StringIO):
         after = self.nest_first if self.first else u("│ ", "| ")
         self.first = False
         prefix: str = self.prefix or ""
+        buf = _buffer()
+        nesting = buf.nesting if buf is not None else NESTING
         return (
-            str(c("".join(itertools.repeat(u("│   ", "|   "), NESTING)) + after).dark)
+            str(c("".join(itertools.repeat(u("│   ", "|   "), nesting)) + after).dark)
             + prefix
         )
 
-    def _print_lines(self, last: bool = False) -> None:
-        buf = self.getvalue()[self.cursor :]
-
+    def _print_lines(self, s: str = "", last: bool = False) -> None:
         if self.verbosity > VERBOSITY:
+            self._pending = ""
             return
 
-        while "\n" in buf:
-            line = buf.split("\n", maxsplit=1)[0]
-            print(self._prefix() + c(line))
-            length = len(line) + 1
-            self.cursor += length
-            buf = buf[length:]
-            self.first = False
+        # Only the new text has to be searched for newlines
+        end = s.rfind("\n")
+        if end == -1:
+            self._pending += s
+        else:
+            lines = (self._pending + s[:end]).split("\n")
+            self._pending = s[end + 1 :]
+            for line in lines:
+                _print(self._prefix() + c(line))
+
+        if len(self._pending) > self.max_line:
+            # Don't hold back output which never contains a newline forever
+            _print(self._prefix() + self._pending)
+            self._pending = ""
+
+        if last and self._pending != "":
+            _print(self._prefix() + self._pending)
+            self._pending = ""
+
+    def _store(self, s: str) -> None:
+        if self._spill is not None:
+            self._spill.write(s)
+            return
 
-        if last and buf != "":
-            print(self._prefix() + buf)
+        super().write(s)
+        if self.tell() > self.spool_size:
+            self._spill = typing.cast(
+                typing.TextIO,
+                tempfile.TemporaryFile("w+", encoding="utf-8", newline=""),
+            )
+            self._spill.write(super().getvalue())
+            self.seek(0)
+            self.truncate()
 
     def writeln(self, s: typing.Union[str, c]) -> int:
         """Add a line to this log event."""
@@ -129,6 +433,8 @@ class EventIO(io.StringIO):
         Printing to stdout will only occur once a newline ``"\n"`` is
         written.
         """
+        if self.closed:
+            raise ValueError("I/O operation on closed log event")
 
         s = (
             s.replace("\x1B[H", "")
@@ -139,11 +445,23 @@ class EventIO(io.StringIO):
             .replace("\x08", "")
         )
 
-        res = super().write(s)
+        self._store(s)
+        self._print_lines(s)
+
+        return len(s)
 
-        self._print_lines()
+    def getvalue(self) -> str:
+        """Return all text that was written to this log event."""
+        if self.closed:
+            raise ValueError("I/O operation on closed log event")
 
-        return res
+        if self._spill is not None:
+            self._spill.seek(0)
+            value = self._spill.read()
+            self._spill.seek(0, io.SEEK_END)
+            return value
+
+        return super().getvalue()
 
     def __enter__(self) -> "EventIO":
         return self
@@ -155,6 +473,9 @@ class EventIO(io.StringIO):
         No more text can be added to this log event after
         closing it.
         """
+        if self.closed:
+            return
+
         self._print_lines(last=True)
 
         if LOGFILE is not None:
@@ -164,9 +485,15 @@ class EventIO(io.StringIO):
                 "data": self.data,
             }
 
-            json.dump(ev, LOGFILE, indent=2)
-            LOGFILE.write("\n")
-            LOGFILE.flush()
+            buf = _buffer()
+            if buf is not None:
+                buf.lines.append(ev)
+            else:
+                _write_event(ev)
+
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
 
         super().close()
 
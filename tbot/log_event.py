@@ -33,7 +33,7 @@ def testcase_begin(name: str) -> None:
         verbosity=log.Verbosity.QUIET,
         name=name,
     )
-    log.NESTING += 1
+    log._nest(1)
 
 
 def testcase_end(name: str, duration: float, success: bool = True) -> None:
@@ -57,7 +57,7 @@ def testcase_end(name: str, duration: float, success: bool = True) -> None:
         duration=duration,
         success=success,
     )
-    log.NESTING -= 1
+    log._nest(-1)
 
 
 def command(mach: str, cmd: str) -> log.EventIO:
@@ -96,8 +96,10 @@ def tbot_end(success: bool) -> None:
         ).dark
     )
 
-    if log.LOGFILE is not None:
-        log.message(f"Log written to {log.LOGFILE.name!r}")
+    # Compressing writers don't know the name of their file
+    name = getattr(log.LOGFILE, "name", None)
+    if name is not None:
+        log.message(f"Log written to {name!r}")
 
     msg = log.c("SUCCESS").green.bold if success else log.c("FAILURE").red.bold
     duration = time.monotonic() - log.START_TIME
@@ -108,4 +110,5 @@ def tbot_end(success: bool) -> None:
         verbosity=log.Verbosity.QUIET,
         success=success,
         duration=duration,
-    )
+    ).close()
+    log.flush_logfile()
@@ -1,9 +1,10 @@
 from .machine import Machine, InteractiveMachine
-from .error import CommandFailedException, WrongHostException
+from .error import BootException, CommandFailedException, WrongHostException
 
 __all__ = (
     "Machine",
     "InteractiveMachine",
+    "BootException",
     "CommandFailedException",
     "WrongHostException",
 )
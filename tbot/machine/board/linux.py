@@ -32,6 +32,18 @@ class LinuxMachine(linux.LinuxMachine, board.BoardMachine[B]):
     login_prompt = "login: "
     """Prompt that indicates tbot should send the username."""
 
+    boot_errors: typing.List[typing.Union[str, typing.Pattern[str]]] = [
+        "Kernel panic - not syncing"
+    ]
+    """
+    Messages which show that booting Linux failed.
+
+    Each is either a literal string or a compiled regular expression.  If one of
+    them shows up before the login prompt, a
+    :class:`~tbot.machine.BootException` is raised right away instead of
+    waiting for a timeout.
+    """
+
     @property
     @abc.abstractmethod
     def shell(self) -> typing.Type[linux.shell.Shell]:
@@ -71,18 +83,24 @@ class LinuxMachine(linux.LinuxMachine, board.BoardMachine[B]):
 
         super().__init__(b.board if isinstance(b, board.UBootMachine) else b)
 
+    def _expect_boot(
+        self, chan: channel.Channel, prompt: str, stream: typing.TextIO, output: str
+    ) -> str:
+        m = chan.expect([prompt, *self.boot_errors], stream=stream)
+        if m.i != 0:
+            raise tbot.machine.BootException(self, m.text, output + m.before)
+        return m.before
+
     def boot_to_shell(self, stream: typing.TextIO) -> str:
         """Wait for the login prompt."""
         chan = self._obtain_channel()
         output = ""
 
-        output += chan.read_until_prompt(
-            self.login_prompt, stream=stream, must_end=False
-        )
+        output += self._expect_boot(chan, self.login_prompt, stream, output)
 
         chan.send(self.username + "\n")
         if self.password is not None:
-            chan.read_until_prompt("word: ", stream=stream, must_end=False)
+            self._expect_boot(chan, "word: ", stream, output)
             chan.send(self.password + "\n")
             stream.write("****\n")
             output += "Password: ****\n"
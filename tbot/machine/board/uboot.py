@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
 import typing
 import shlex
 import tbot
@@ -65,6 +66,17 @@ class UBootMachine(board.BoardMachine[B], machine.InteractiveMachine):
     U-Prompt that was configured when building U-Boot
     """
 
+    boot_errors: typing.List[typing.Union[str, typing.Pattern[str]]] = [
+        "### ERROR ### Please RESET the board ###"
+    ]
+    """
+    Messages which show that booting U-Boot failed.
+
+    Each is either a literal string or a compiled regular expression.  If one of
+    them shows up before the prompt, a
+    :class:`~tbot.machine.BootException` is raised right away.
+    """
+
     @property
     def name(self) -> str:
         """Name of this U-Boot machine."""
@@ -87,18 +99,24 @@ class UBootMachine(board.BoardMachine[B], machine.InteractiveMachine):
             boot_ev.verbosity = tbot.log.Verbosity.STDOUT
             boot_ev.prefix = "   <> "
             if self.autoboot_prompt is not None:
-                boot_log = self.channel.read_until_prompt(
-                    self.autoboot_prompt, regex=True, stream=boot_ev
+                boot_log = self._expect_boot(
+                    re.compile(self.autoboot_prompt + "$"), boot_ev
                 )
 
                 boot_ev.data["output"] = boot_log
                 self.channel.send(self.autoboot_keys)
                 self.channel.read_until_prompt(self.prompt)
             else:
-                self.channel.read_until_prompt(self.prompt, stream=boot_ev)
+                self._expect_boot(re.compile(re.escape(self.prompt) + "$"), boot_ev)
 
             self.bootlog = boot_ev.getvalue().split("\n", 1)[1]
 
+    def _expect_boot(self, prompt: typing.Pattern[str], stream: typing.TextIO) -> str:
+        m = self.channel.expect([prompt, *self.boot_errors], stream=stream)
+        if m.i != 0:
+            raise machine.BootException(self, m.text, m.before)
+        return m.before
+
     def destroy(self) -> None:
         """Destroy this U-Boot machine."""
         self.channel.close()
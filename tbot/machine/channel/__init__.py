@@ -1,12 +1,25 @@
-from .channel import Channel, ChannelClosedException, SkipStream, TBOT_PROMPT
+from .channel import (
+    Channel,
+    ChannelClosedException,
+    ExpectMatch,
+    SkipStream,
+    TBOT_PROMPT,
+    TBOT_RETVAL,
+)
 from .paramiko import ParamikoChannel
 from .subprocess import SubprocessChannel
+from .aio import AsyncChannel, AsyncParamikoChannel, AsyncSubprocessChannel
 
 __all__ = (
+    "AsyncChannel",
+    "AsyncParamikoChannel",
+    "AsyncSubprocessChannel",
     "Channel",
     "ChannelClosedException",
+    "ExpectMatch",
     "SkipStream",
     "ParamikoChannel",
     "SubprocessChannel",
     "TBOT_PROMPT",
+    "TBOT_RETVAL",
 )
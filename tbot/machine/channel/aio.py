@@ -0,0 +1,537 @@
+# tbot, Embedded Automation Tool
+# Copyright (C) 2018  Harald Seiler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import abc
+import asyncio
+import codecs
+import os
+import re
+import secrets
+import socket
+import time
+import typing
+import paramiko
+import tbot
+from tbot.machine.linux import shell
+from . import channel
+from .channel import TBOT_PROMPT
+from .subprocess import _read_available, _spawn_shell
+
+AC = typing.TypeVar("AC", bound="AsyncChannel")
+
+
+async def _wait_readable(fd: int, timeout: typing.Optional[float]) -> None:
+    """Wait until ``fd`` is readable, using the running event loop."""
+    loop = asyncio.get_event_loop()
+    fut = loop.create_future()
+
+    def ready() -> None:
+        if not fut.done():
+            fut.set_result(None)
+
+    loop.add_reader(fd, ready)
+    try:
+        await asyncio.wait_for(fut, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError()
+    finally:
+        loop.remove_reader(fd)
+
+
+class AsyncChannel(abc.ABC):
+    """
+    Generic asyncio based channel.
+
+    The asyncio counterpart of :class:`~tbot.machine.channel.Channel`.  Many
+    channels can be driven concurrently from a single event loop, eg. to watch
+    the consoles of a lot of boards at once.  Prompt detection, decoding and
+    exit code handling are shared with the blocking channels.
+
+    **Example**::
+
+        async def uptime() -> str:
+            ch = await AsyncSubprocessChannel.create()
+            try:
+                return await ch.raw_command("uptime")
+            finally:
+                ch.close()
+    """
+
+    recv_size = channel.Channel.recv_size
+    """Size of the buffer incoming data is read into."""
+
+    decode_errors = channel.Channel.decode_errors
+    """Error policy for decoding received data as UTF-8."""
+
+    interrupt_on_timeout = channel.Channel.interrupt_on_timeout
+    """Whether to interrupt a command that timed out."""
+
+    interrupt_timeout = channel.Channel.interrupt_timeout
+    """Time in seconds to wait for the prompt after each interrupt."""
+
+    interrupt_retries = channel.Channel.interrupt_retries
+    """Number of interrupts sent before giving up on the channel."""
+
+    @abc.abstractmethod
+    async def send(self, data: typing.Union[bytes, str]) -> None:
+        """
+        Send some data to this channel.
+
+        :param bytes, str data: Data to be sent. It data is a :class:`str` it will
+            be encoded using ``utf-8``.
+        :raises ChannelClosedException: If the cannel is no longer open.
+        """
+        pass
+
+    @abc.abstractmethod
+    async def recv_into(
+        self,
+        buf: typing.Union[bytearray, memoryview],
+        timeout: typing.Optional[float] = None,
+    ) -> int:
+        """
+        Receive some data from this channel into a writable buffer.
+
+        Waits until at least one byte is available or the timeout is reached.
+
+        :param buf: Buffer to write the received data to.
+        :param float timeout: Optional timeout.
+        :raises ChannelClosedException: If the channel is no longer open.
+        :raises TimeoutError: If the timeout was reached before data got available.
+        :rtype: int
+        :returns: Number of bytes written to ``buf``.
+        """
+        pass
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Close this channel."""
+        pass
+
+    @abc.abstractmethod
+    def isopen(self) -> bool:
+        """
+        Return whether this channel is still open.
+
+        :rtype: bool
+        """
+        pass
+
+    def __init__(self) -> None:
+        """
+        Create a new asyncio based channel.
+
+        The channel is not usable until it was initialized, which is why
+        channels should be created using
+        :meth:`~tbot.machine.channel.AsyncChannel.create`.
+        """
+        self._prompt_retval = False
+        self._recv_buffer = bytearray(self.recv_size)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(self.decode_errors)
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def create(cls: typing.Type[AC], *args: typing.Any) -> AC:
+        """
+        Create and initialize a new channel.
+
+        :param args: Arguments for the channel's constructor.
+        """
+        ch = cls(*args)
+        await ch.initialize()
+        return ch
+
+    async def initialize(self, *, sh: typing.Type[shell.Shell] = shell.Bash) -> None:
+        """
+        Initialize this channel so it is ready to receive commands.
+
+        See :meth:`tbot.machine.channel.Channel.initialize`.
+
+        :param tbot.machine.linux.shell.Shell sh: Type of the Shell this channel
+            is connected to.
+        """
+        cmd, prompt_retval = channel._initialize_commands(sh)
+
+        # The new prompt is the first one we will see after the command
+        self._prompt_retval = prompt_retval
+        await self.raw_command(cmd)
+
+    async def recv(
+        self, timeout: typing.Optional[float] = None, max: typing.Optional[int] = None
+    ) -> bytes:
+        """
+        Receive some data from this channel.
+
+        See :meth:`tbot.machine.channel.Channel.recv`.
+
+        :param float timeout: Optional timeout.
+        :param int max: Optional maximum number of bytes to read.
+        :raises ChannelClosedException: If the channel is no longer open.
+        :raises TimeoutError: If the timeout was reached before data got available.
+        """
+        view = memoryview(self._recv_buffer)
+        if max:
+            view = view[:max]
+        length = await self.recv_into(view, timeout)
+        return bytes(view[:length])
+
+    async def read_until_prompt(
+        self,
+        prompt: str,
+        *,
+        regex: bool = False,
+        stream: typing.Optional[typing.TextIO] = None,
+        timeout: typing.Optional[float] = None,
+        must_end: bool = True,
+        lookbehind: int = 1024,
+    ) -> str:
+        """
+        Read until receiving ``prompt``.
+
+        See :meth:`tbot.machine.channel.Channel.read_until_prompt` for the
+        meaning of the parameters.
+
+        :rtype: str
+        :returns: Everything read up until the prompt.
+        """
+        return (
+            await self._read_until_prompt(
+                prompt,
+                regex=regex,
+                stream=stream,
+                timeout=timeout,
+                must_end=must_end,
+                lookbehind=lookbehind,
+            )
+        )[0]
+
+    async def _read_until_prompt(
+        self,
+        prompt: str,
+        *,
+        regex: bool = False,
+        stream: typing.Optional[typing.TextIO] = None,
+        timeout: typing.Optional[float] = None,
+        must_end: bool = True,
+        lookbehind: int = 1024,
+    ) -> typing.Tuple[str, int]:
+        matcher = channel._PromptMatcher(
+            prompt, regex=regex, must_end=must_end, lookbehind=lookbehind
+        )
+        return await self._read_until(
+            channel._PromptReader(self._decoder, matcher, stream=stream), timeout
+        )
+
+    async def _read_until(
+        self, reader: channel._PromptReader, timeout: typing.Optional[float]
+    ) -> typing.Tuple[str, int]:
+        start_time = time.monotonic()
+        view = memoryview(self._recv_buffer)
+
+        timeout_remaining = timeout
+        while True:
+            filled = await self.recv_into(view, timeout=timeout_remaining)
+            result = reader.feed(view[:filled])
+            if result is not None:
+                return result
+
+            if timeout is not None:
+                current_time = time.monotonic()
+                timeout_remaining = timeout - (current_time - start_time)
+
+    async def expect(
+        self,
+        patterns: typing.Sequence[channel.Pattern],
+        *,
+        stream: typing.Optional[typing.TextIO] = None,
+        timeout: typing.Optional[float] = None,
+        lookbehind: int = 1024,
+    ) -> channel.ExpectMatch:
+        """
+        Read until one of multiple patterns is received.
+
+        See :meth:`tbot.machine.channel.Channel.expect`.
+
+        :rtype: ExpectMatch
+        :returns: Which pattern matched, and where.
+        """
+        matcher = channel._ExpectMatcher(patterns, lookbehind=lookbehind)
+        output, _ = await self._read_until(
+            channel._PromptReader(self._decoder, matcher, stream=stream), timeout
+        )
+        return channel._expect_result(matcher, output)
+
+    async def raw_command(
+        self,
+        command: str,
+        *,
+        prompt: str = TBOT_PROMPT,
+        stream: typing.Optional[typing.TextIO] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> str:
+        """
+        Send a command to this channel and wait until it finishes.
+
+        See :meth:`tbot.machine.channel.Channel.raw_command`.  Concurrent
+        commands on the same channel are run one after the other.
+
+        :rtype: str
+        :returns: The ouput of the command.
+        """
+        return (
+            await self._raw_command(
+                command, prompt=prompt, stream=stream, timeout=timeout
+            )
+        )[1]
+
+    async def _raw_command(
+        self,
+        command: str,
+        *,
+        prompt: str,
+        stream: typing.Optional[typing.TextIO],
+        timeout: typing.Optional[float],
+    ) -> typing.Tuple[typing.Optional[int], str]:
+        async with self._lock:
+            return await self._run_command(
+                command, prompt=prompt, stream=stream, timeout=timeout
+            )
+
+    async def _run_command(
+        self,
+        command: str,
+        *,
+        prompt: str,
+        stream: typing.Optional[typing.TextIO],
+        timeout: typing.Optional[float],
+    ) -> typing.Tuple[typing.Optional[int], str]:
+        # Callers have to hold self._lock
+        await self.send(f"{command}\n".encode("utf-8"))
+        if stream:
+            stream = channel.SkipStream(stream, len(command) + 1)
+
+        prompt, regex = channel._command_prompt(prompt, self._prompt_retval)
+        try:
+            buf, end = await self._read_until_prompt(
+                prompt, regex=regex, stream=stream, timeout=timeout
+            )
+        except TimeoutError:
+            if self.interrupt_on_timeout:
+                tbot.log.warning("Command timed out, interrupting it ...")
+                await self._interrupt(prompt, regex)
+            raise
+        return channel._command_result(command, buf, end, regex)
+
+    async def _interrupt(self, prompt: str, regex: bool) -> None:
+        """
+        Interrupt the running command and wait until the shell is ready again.
+
+        See :meth:`tbot.machine.channel.Channel._interrupt`.
+        """
+        prompt = prompt if regex else re.escape(prompt)
+        for _ in range(self.interrupt_retries):
+            nonce = secrets.token_hex(8)
+            await self.send(b"\x03")
+            try:
+                await self._read_until_prompt(
+                    prompt, regex=True, timeout=self.interrupt_timeout
+                )
+                await self.send(f"echo TBOT-SYNC''-{nonce}\n")
+                await self._read_until_prompt(
+                    re.escape(f"TBOT-SYNC-{nonce}\n") + prompt,
+                    regex=True,
+                    timeout=self.interrupt_timeout,
+                )
+            except TimeoutError:
+                continue
+            return
+
+        tbot.log.warning("Shell did not recover from the interrupt")
+
+    async def raw_command_with_retval(
+        self,
+        command: str,
+        *,
+        prompt: str = TBOT_PROMPT,
+        retval_check_cmd: str = "echo $?",
+        stream: typing.Optional[typing.TextIO] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> typing.Tuple[int, str]:
+        """
+        Send a command to this channel, wait until it finishes, and check its retcode.
+
+        See :meth:`tbot.machine.channel.Channel.raw_command_with_retval`.
+
+        :rtype: tuple[int, str]
+        :returns: The retcode and ouput of the command.
+        """
+        # Hold the lock until the exit code was queried, otherwise a concurrent
+        # command could run in between and overwrite it
+        async with self._lock:
+            retval, out = await self._run_command(
+                command, prompt=prompt, stream=stream, timeout=timeout
+            )
+
+            if retval is None:
+                retval = int(
+                    (
+                        await self._run_command(
+                            retval_check_cmd,
+                            prompt=prompt,
+                            stream=None,
+                            timeout=timeout,
+                        )
+                    )[1].strip()
+                )
+
+        return retval, out
+
+
+class AsyncSubprocessChannel(AsyncChannel):
+    """Subprocess based asyncio channel."""
+
+    def __init__(self) -> None:
+        """Create a new :mod:`subprocess` based asyncio channel."""
+        self.pty_master, self.p = _spawn_shell()
+
+        super().__init__()
+
+    async def send(self, data: typing.Union[bytes, str]) -> None:  # noqa: D102
+        self.p.poll()
+        if self.p.returncode is not None:
+            raise channel.ChannelClosedException()
+
+        data = data if isinstance(data, bytes) else data.encode("utf-8")
+        channel._debug_log(data, True)
+
+        loop = asyncio.get_event_loop()
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                b = os.write(self.pty_master, view)
+            except BlockingIOError:
+                # The pty's buffer is full, wait for the shell to catch up
+                fut = loop.create_future()
+                loop.add_writer(self.pty_master, fut.set_result, None)
+                try:
+                    await fut
+                finally:
+                    loop.remove_writer(self.pty_master)
+                continue
+            if b == 0:
+                raise channel.ChannelClosedException()
+            view = view[b:]
+
+    async def recv_into(
+        self,
+        buf: typing.Union[bytearray, memoryview],
+        timeout: typing.Optional[float] = None,
+    ) -> int:  # noqa: D102
+        self.p.poll()
+
+        if self.p.returncode is None:
+            await _wait_readable(self.pty_master, timeout)
+        # If the process has ended, check for anything left
+
+        view = memoryview(buf)
+        try:
+            length = _read_available(self.pty_master, view)
+        except OSError:
+            # Reading from a pty whose other end is closed fails with EIO
+            raise channel.ChannelClosedException()
+        channel._debug_log(view[:length])
+        return length
+
+    def close(self) -> None:  # noqa: D102
+        self.p.kill()
+        self.p.wait()
+        os.close(self.pty_master)
+
+    def isopen(self) -> bool:  # noqa: D102
+        self.p.poll()
+        return self.p.returncode is None
+
+
+class AsyncParamikoChannel(AsyncChannel):
+    """Paramiko based asyncio channel."""
+
+    def __init__(self, ch: paramiko.Channel) -> None:
+        """
+        Create a new asyncio channel based on a Paramiko channel.
+
+        :param paramiko.Channel ch: Paramiko Channel
+        """
+        self.ch = ch
+
+        self.ch.get_pty("xterm-256color", 80, 25, 1024, 1024)
+        self.ch.invoke_shell()
+        # Never block the event loop, wait for the channel's fd instead
+        self.ch.settimeout(0.0)
+
+        super().__init__()
+
+    async def send(self, data: typing.Union[bytes, str]) -> None:  # noqa: D102
+        if self.ch.exit_status_ready():
+            raise channel.ChannelClosedException()
+
+        data = data if isinstance(data, bytes) else data.encode("utf-8")
+        channel._debug_log(data, True)
+
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                b = self.ch.send(bytes(view))
+            except socket.timeout:
+                # The remote window is full
+                await asyncio.sleep(0.01)
+                continue
+            if b == 0:
+                raise channel.ChannelClosedException()
+            view = view[b:]
+
+    async def recv_into(
+        self,
+        buf: typing.Union[bytearray, memoryview],
+        timeout: typing.Optional[float] = None,
+    ) -> int:  # noqa: D102
+        if not self.ch.recv_ready():
+            await _wait_readable(self.ch.fileno(), timeout)
+
+        view = memoryview(buf)
+        length = 0
+        try:
+            while length < len(view):
+                new = self.ch.recv(len(view) - length)
+                if new == b"":
+                    break
+                view[length : length + len(new)] = new
+                length += len(new)
+                if not self.ch.recv_ready():
+                    break
+        except socket.timeout:
+            pass
+
+        if length == 0:
+            raise channel.ChannelClosedException()
+
+        channel._debug_log(view[:length])
+        return length
+
+    def close(self) -> None:  # noqa: D102
+        self.ch.close()
+
+    def isopen(self) -> bool:  # noqa: D102
+        return not self.ch.exit_status_ready()
@@ -15,10 +15,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import abc
+import codecs
 import collections
 import io
 import itertools
 import re
+import secrets
 import select
 import sys
 import termios
@@ -30,6 +32,8 @@ import tbot
 from tbot.machine.linux import shell
 
 TBOT_PROMPT = "TBOT-VEJPVC1QUk9NUFQK$ "
+TBOT_RETVAL = "TBOT-VEJPVC1SRVRWQUwK-"
+_RETVAL_PROMPT = re.escape(TBOT_RETVAL) + r"\d+" + re.escape(TBOT_PROMPT)
 
 
 class ChannelClosedException(Exception):
@@ -67,9 +71,376 @@ class SkipStream(io.StringIO):
             return self.stream.write(s)
 
 
+class _PromptMatcher:
+    """
+    Incrementally search a stream of text for a prompt.
+
+    Only a bounded tail of the text seen so far is kept, which is just long
+    enough to detect a prompt that was split across chunks.
+    """
+
+    __slots__ = ("prompt", "expr", "must_end", "window", "tail", "offset")
+
+    def __init__(
+        self, prompt: str, *, regex: bool, must_end: bool, lookbehind: int
+    ) -> None:
+        self.prompt = prompt
+        self.must_end = must_end
+        self.expr: typing.Optional[typing.Pattern[str]] = None
+        if regex:
+            self.expr = re.compile(f"{prompt}$" if must_end else prompt)
+            self.window = lookbehind
+        elif must_end:
+            self.window = len(prompt)
+        else:
+            self.window = len(prompt) - 1
+
+        self.tail = ""
+        self.offset = 0
+
+    def feed(self, s: str) -> typing.Optional[typing.Tuple[int, int]]:
+        """
+        Add some text and check if the prompt was found.
+
+        :returns: The span of the prompt, relative to the start of the stream,
+            or ``None`` if the prompt has not been found yet.
+        """
+        text = self.tail + s
+        offset = self.offset
+
+        cut = max(0, len(text) - self.window)
+        self.tail = text[cut:]
+        self.offset = offset + cut
+
+        if self.expr is not None:
+            m = self.expr.search(text)
+            if m is not None:
+                return (offset + m.start(), offset + m.end())
+        elif self.must_end:
+            if text.endswith(self.prompt):
+                return (offset + len(text) - len(self.prompt), offset + len(text))
+        else:
+            idx = text.find(self.prompt)
+            if idx != -1:
+                return (offset + idx, offset + idx + len(self.prompt))
+
+        return None
+
+    def holdback(self, pending: str) -> int:
+        """
+        Return how many chars at the end of ``pending`` might belong to a prompt.
+
+        These should not be written to a stream before it is known whether
+        they are part of the prompt.
+        """
+        if not self.must_end:
+            return 0
+        elif self.expr is None:
+            return min(len(pending), len(self.prompt) - 1)
+        else:
+            # Regex prompts are held back up to the last newline, which does
+            # not delay log output as that is printed line by line anyway.
+            return min(len(pending) - (pending.rfind("\n") + 1), self.window)
+
+
+Pattern = typing.Union[str, typing.Pattern[str]]
+
+
+class _ExpectMatcher:
+    """
+    Incrementally search a stream of text for the first of multiple patterns.
+
+    All literal patterns are compiled into a single expression, so each chunk
+    is only scanned once for all of them.  Regular expressions are searched
+    separately and the earliest match wins.
+    """
+
+    __slots__ = ("patterns", "literals", "exprs", "window", "tail", "offset", "found")
+
+    must_end = False
+
+    def __init__(self, patterns: typing.Sequence[Pattern], *, lookbehind: int) -> None:
+        self.patterns = patterns
+        self.literals: typing.Optional[typing.Pattern[str]] = None
+        self.exprs: typing.List[typing.Tuple[int, typing.Pattern[str]]] = []
+
+        literals = []
+        window = 0
+        for i, pattern in enumerate(patterns):
+            if isinstance(pattern, str):
+                if pattern == "":
+                    raise ValueError("Empty pattern")
+                literals.append(f"(?P<p{i}>{re.escape(pattern)})")
+                window = max(window, len(pattern) - 1)
+            else:
+                self.exprs.append((i, pattern))
+                window = max(window, lookbehind)
+        if literals != []:
+            self.literals = re.compile("|".join(literals))
+
+        self.window = window
+        self.tail = ""
+        self.offset = 0
+        # Index and span of the matching pattern, once one was found
+        self.found: typing.Optional[typing.Tuple[int, int, int]] = None
+
+    def feed(self, s: str) -> typing.Optional[typing.Tuple[int, int]]:
+        """
+        Add some text and check if one of the patterns was found.
+
+        :returns: The span of the match, relative to the start of the stream,
+            or ``None`` if no pattern has been found yet.
+        """
+        text = self.tail + s
+        offset = self.offset
+
+        cut = max(0, len(text) - self.window)
+        self.tail = text[cut:]
+        self.offset = offset + cut
+
+        best: typing.Optional[typing.Tuple[int, int, int]] = None
+        if self.literals is not None:
+            m = self.literals.search(text)
+            if m is not None:
+                assert m.lastgroup is not None
+                best = (m.start(), int(m.lastgroup[1:]), m.end())
+        for i, expr in self.exprs:
+            m = expr.search(text)
+            if m is not None and (best is None or (m.start(), i) < best[:2]):
+                best = (m.start(), i, m.end())
+
+        if best is None:
+            return None
+        start, i, end = best
+        self.found = (i, offset + start, offset + end)
+        return (offset + start, offset + end)
+
+    def holdback(self, pending: str) -> int:
+        return 0
+
+
+class ExpectMatch:
+    """Result of :meth:`~tbot.machine.channel.Channel.expect`."""
+
+    __slots__ = ("i", "pattern", "output", "start", "end")
+
+    def __init__(
+        self, i: int, pattern: Pattern, output: str, start: int, end: int
+    ) -> None:
+        self.i = i
+        """Index of the pattern that matched."""
+
+        self.pattern = pattern
+        """The pattern that matched."""
+
+        self.output = output
+        """
+        Everything that was read.  This can include text received after the
+        match, up to the end of the chunk it was in.
+        """
+
+        self.start = start
+        """Start of the match in :attr:`output`."""
+
+        self.end = end
+        """End of the match in :attr:`output`."""
+
+    @property
+    def text(self) -> str:
+        """The text that matched."""
+        return self.output[self.start : self.end]
+
+    @property
+    def before(self) -> str:
+        """Everything read before the match."""
+        return self.output[: self.start]
+
+    def __repr__(self) -> str:
+        return f"<ExpectMatch {self.i}: {self.text!r}@{self.start}>"
+
+
+def _expect_result(matcher: _ExpectMatcher, output: str) -> ExpectMatch:
+    assert matcher.found is not None
+    i, start, end = matcher.found
+    return ExpectMatch(i, matcher.patterns[i], output, start, end)
+
+
+def _debug_log(
+    data: typing.Union[bytes, bytearray, memoryview], out: bool = False
+) -> None:
+    if tbot.log.VERBOSITY >= tbot.log.Verbosity.CHANNEL:
+        msg = tbot.log.c(repr(bytes(data))[1:])
+        tbot.log.EventIO(
+            ["__debug__"],
+            (
+                tbot.log.c("> ").blue.bold + msg.blue
+                if out
+                else tbot.log.c("< ").yellow.bold + msg.yellow
+            ),
+            verbosity=tbot.log.Verbosity.CHANNEL,
+        )
+
+
+class _PromptReader:
+    """
+    Decode received data and search it for a prompt.
+
+    This holds everything :meth:`~tbot.machine.channel.Channel.read_until_prompt`
+    does besides waiting for data, so it can be shared between blocking and
+    asyncio based channels.
+    """
+
+    def __init__(
+        self,
+        decoder: codecs.IncrementalDecoder,
+        matcher: typing.Union[_PromptMatcher, _ExpectMatcher],
+        *,
+        stream: typing.Optional[typing.TextIO],
+        keep: bool = True,
+    ) -> None:
+        self.decoder = decoder
+        self.decoder.reset()
+        self.matcher = matcher
+        self.stream = stream
+        self.must_end = matcher.must_end
+        # Without keep, only the text around the prompt is returned, so
+        # memory use does not grow with the output
+        self.keep = keep
+
+        self.chunks: typing.List[str] = []
+        self.length = 0
+        # Text that was received but not yet written to stream
+        self.pending = ""
+        # A trailing '\r' might be the start of a '\r\n' and is carried over
+        self.carry = ""
+
+    def feed(
+        self, data: typing.Union[bytes, bytearray, memoryview]
+    ) -> typing.Optional[typing.Tuple[str, int]]:
+        """
+        Process newly received data.
+
+        Multibyte sequences split between two reads are kept by the decoder
+        until the rest arrives.
+
+        :returns: Everything read and the start of the prompt in it, once the
+            prompt was found.  ``None`` otherwise.
+        """
+        decoded = self.carry + self.decoder.decode(data)
+        if decoded.endswith("\r"):
+            decoded, self.carry = decoded[:-1], "\r"
+        else:
+            self.carry = ""
+
+        decoded = (
+            decoded.replace("\r\n", "\n").replace("\r\n", "\n").replace("\r", "\n")
+        )
+
+        if self.keep:
+            self.chunks.append(decoded)
+        self.length += len(decoded)
+        match = self.matcher.feed(decoded)
+
+        if self.stream is not None:
+            self.pending += decoded
+            if match is not None:
+                # Don't clip prompt if it doesn't need to be at the end
+                end = match[0] if self.must_end else self.length
+                self.stream.write(
+                    self.pending[: max(0, len(self.pending) - (self.length - end))]
+                )
+            else:
+                keep = self.matcher.holdback(self.pending)
+                self.stream.write(self.pending[: len(self.pending) - keep])
+                self.pending = self.pending[len(self.pending) - keep :]
+
+        if match is None:
+            return None
+        elif not self.keep:
+            return self.matcher.tail, match[0] - self.matcher.offset
+        return "".join(self.chunks), match[0]
+
+
+def _initialize_commands(sh: typing.Type[shell.Shell]) -> typing.Tuple[str, bool]:
+    """
+    Return the command to initialize a shell.
+
+    All setup commands are combined into a single line, so initialization only
+    needs one round trip.  The prompt is set last, so it only shows up once
+    everything else is done.  The second value is whether the prompt contains
+    the exit code of the previous command afterwards.
+    """
+    cmds = []
+
+    # Ensure we don't make history, disable line editing, and ensure multiline
+    # commands work
+    for cmd in [sh.disable_history(), sh.disable_editing(), sh.set_prompt2("")]:
+        if cmd is not None:
+            cmds.append(cmd)
+
+    # Set proper prompt
+    cmd = sh.set_prompt_retval(TBOT_PROMPT, TBOT_RETVAL)
+    prompt_retval = cmd is not None
+    cmds.append(cmd if cmd is not None else sh.set_prompt(TBOT_PROMPT))
+
+    return "; ".join(cmds), prompt_retval
+
+
+def _command_prompt(prompt: str, prompt_retval: bool) -> typing.Tuple[str, bool]:
+    """Return the prompt to wait for after a command and whether it is a regex."""
+    if prompt == TBOT_PROMPT and prompt_retval:
+        # The prompt looks like TBOT_RETVAL + "<retcode>" + TBOT_PROMPT
+        return _RETVAL_PROMPT, True
+    return prompt, False
+
+
+def _command_result(
+    command: str, buf: str, end: int, retval_prompt: bool
+) -> typing.Tuple[typing.Optional[int], str]:
+    """Split everything read after sending a command into exit code and output."""
+    retval = None
+    if retval_prompt:
+        retval = int(buf[end + len(TBOT_RETVAL) : -len(TBOT_PROMPT)])
+
+    return retval, buf[len(command) + 1 : end]
+
+
 class Channel(abc.ABC):
     """Generic channel."""
 
+    recv_size = 65536
+    """
+    Size of the buffer incoming data is read into.
+
+    This is the maximum number of bytes read by a single
+    :meth:`~tbot.machine.channel.Channel.recv` call.
+    """
+
+    decode_errors = "replace"
+    """
+    Error policy for decoding received data as UTF-8.
+
+    Any error handler known to :mod:`codecs` can be used, eg. ``"strict"`` to
+    raise an exception on invalid input or ``"backslashreplace"`` to keep
+    the original bytes visible.
+    """
+
+    interrupt_on_timeout = True
+    """
+    Whether to interrupt a command that timed out.
+
+    If set, a command that runs into its timeout is interrupted with ``Ctrl-C``
+    and tbot waits for a fresh prompt, before the :class:`TimeoutError` is
+    raised.  The channel can then be used for further commands, instead of
+    having to reconnect (or reboot the board).
+    """
+
+    interrupt_timeout = 5.0
+    """Time in seconds to wait for the prompt after each interrupt."""
+
+    interrupt_retries = 3
+    """Number of interrupts sent before giving up on the channel."""
+
     @abc.abstractmethod
     def send(self, data: typing.Union[bytes, str]) -> None:
         """
@@ -107,6 +478,33 @@ class Channel(abc.ABC):
         """
         pass
 
+    def recv_into(
+        self,
+        buf: typing.Union[bytearray, memoryview],
+        timeout: typing.Optional[float] = None,
+    ) -> int:
+        """
+        Receive some data from this channel into a writable buffer.
+
+        Like :meth:`~tbot.machine.channel.Channel.recv`, but instead of creating
+        a new :class:`bytes` object, the data is written to the start of ``buf``.
+        At most ``len(buf)`` bytes are read.
+
+        The default implementation uses ``recv``, channel implementations should
+        override this if they can read into a buffer directly.
+
+        :param buf: Buffer to write the received data to.
+        :param float timeout: Optional timeout after which ``recv_into`` should
+            return if no data is avalable.
+        :raises ChannelClosedException: If the channel is no longer open.
+        :raises TimeoutError: If the timeout was reached before data got available.
+        :rtype: int
+        :returns: Number of bytes written to ``buf``.
+        """
+        data = self.recv(timeout=timeout, max=len(buf))
+        buf[: len(data)] = data
+        return len(data)
+
     @abc.abstractmethod
     def close(self) -> None:
         """
@@ -231,33 +629,45 @@ class Channel(abc.ABC):
         Initialize this channel so it is ready to receive commands.
 
         Internally runs commands to set the prompt to a known value and disable
-        history + line-editing.
+        history + line-editing.  All of them are sent as a single line.
+
+        If the shell supports it, the prompt will also contain the exit code of
+        the previous command, which allows
+        :meth:`~tbot.machine.channel.Channel.raw_command_with_retval` to run
+        a command in a single round trip.
+
+        A new channel is initialized for a :class:`~tbot.machine.linux.shell.Bash`
+        automatically, right before the first command waiting for the default
+        prompt is run.  Call this method explicitly if the channel is
+        connected to a different shell, or after starting a new shell on it.
 
         :param tbot.machine.linux.shell.Shell sh: Type of the Shell this channel
             is connected to.
         """
-        # Set proper prompt
-        self.raw_command(sh.set_prompt(TBOT_PROMPT))
+        cmd, prompt_retval = _initialize_commands(sh)
+        self._lazy_shell: typing.Optional[typing.Type[shell.Shell]] = None
 
-        # Ensure we don't make history
-        cmd = sh.disable_history()
-        if cmd is not None:
-            self.raw_command(cmd)
+        # The new prompt is the first one we will see after the command
+        self._prompt_retval = prompt_retval
+        self.raw_command(cmd)
 
-        # Disable line editing
-        cmd = sh.disable_editing()
-        if cmd is not None:
-            self.raw_command(cmd)
-
-        # Ensure multiline commands work
-        cmd = sh.set_prompt2("")
-        if cmd is not None:
-            self.raw_command(cmd)
+    def _lazy_initialize(self) -> None:
+        """Initialize this channel, if this has not happened yet."""
+        sh = self._lazy_shell
+        if sh is not None:
+            self._lazy_shell = None
+            self.initialize(sh=sh)
 
     def __init__(self) -> None:
         """Create a new channel."""
         self.cleanup: typing.Callable[[], None] = lambda: None
-        self.initialize()
+        self._prompt_retval = False
+        self._recv_buffer = bytearray(self.recv_size)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(self.decode_errors)
+        # Initialization is deferred until the first command, so channels which
+        # are never used to run commands don't pay for it.  Connect commands
+        # (see LabHost.new_channel) still need an initialized shell.
+        self._lazy_shell = shell.Bash
 
     def recv_n(self, n: int, timeout: typing.Optional[float] = None) -> bytes:
         """
@@ -270,27 +680,22 @@ class Channel(abc.ABC):
         :param float timeout: Optional timeout
         """
         start_time = time.monotonic()
-        buf = b""
+        buf = bytearray(n)
+        view = memoryview(buf)
+        length = 0
 
-        while len(buf) < n:
-            buf += self.recv(timeout=timeout, max=(n - len(buf)))
+        while length < n:
+            length += self.recv_into(view[length:], timeout=timeout)
             if timeout is not None:
                 timeout = timeout - (time.monotonic() - start_time)
 
-        return buf
-
-    def _debug_log(self, data: bytes, out: bool = False) -> None:
-        if tbot.log.VERBOSITY >= tbot.log.Verbosity.CHANNEL:
-            msg = tbot.log.c(repr(data)[1:])
-            tbot.log.EventIO(
-                ["__debug__"],
-                (
-                    tbot.log.c("> ").blue.bold + msg.blue
-                    if out
-                    else tbot.log.c("< ").yellow.bold + msg.yellow
-                ),
-                verbosity=tbot.log.Verbosity.CHANNEL,
-            )
+        view.release()
+        return bytes(buf)
+
+    def _debug_log(
+        self, data: typing.Union[bytes, bytearray, memoryview], out: bool = False
+    ) -> None:
+        _debug_log(data, out)
 
     def read_until_prompt(
         self,
@@ -300,10 +705,15 @@ class Channel(abc.ABC):
         stream: typing.Optional[typing.TextIO] = None,
         timeout: typing.Optional[float] = None,
         must_end: bool = True,
+        lookbehind: int = 1024,
     ) -> str:
         """
         Read until receiving ``prompt``.
 
+        Incoming data is only scanned in a bounded window at the end of the
+        stream, so the cost of each received chunk does not grow with the amount
+        of output that was already read.
+
         :param str prompt: The prompt to wait for. If ``regex`` is ``True``, this
             will be interpreted as a regular expression.
         :param bool regex: Whether the prompt should be interpreted as is or as a
@@ -314,60 +724,99 @@ class Channel(abc.ABC):
         :param float timeout: Optional timeout.
         :param bool must_end: Whether the prompt has to appear at the end of
             the stream.
+        :param int lookbehind: Number of already received characters a regular
+            expression prompt is matched against, in addition to each new chunk.
+            Increase this if your regex can match more text than this.
         :raises TimeoutError: If a timeout is set and this timeout is reached before
             the prompt is detected.
         :rtype: str
         :returns: Everything read up until the prompt.
         """
+        return self._read_until_prompt(
+            prompt,
+            regex=regex,
+            stream=stream,
+            timeout=timeout,
+            must_end=must_end,
+            lookbehind=lookbehind,
+        )[0]
+
+    def _read_until_prompt(
+        self,
+        prompt: str,
+        *,
+        regex: bool = False,
+        stream: typing.Optional[typing.TextIO] = None,
+        timeout: typing.Optional[float] = None,
+        must_end: bool = True,
+        lookbehind: int = 1024,
+    ) -> typing.Tuple[str, int]:
+        matcher = _PromptMatcher(
+            prompt, regex=regex, must_end=must_end, lookbehind=lookbehind
+        )
+        return self._read_until(
+            _PromptReader(self._decoder, matcher, stream=stream), timeout
+        )
+
+    def _read_until(
+        self, reader: _PromptReader, timeout: typing.Optional[float]
+    ) -> typing.Tuple[str, int]:
         start_time = time.monotonic()
-        expr = None
-        if regex:
-            expr = f"{prompt}$" if must_end else prompt
-        elif not must_end:
-            expr = re.escape(prompt)
-        buf = ""
+        # Incoming data is read into a reusable buffer and decoded from there
+        # directly, so no intermediate bytes objects are created.
+        view = memoryview(self._recv_buffer)
 
         timeout_remaining = timeout
         while True:
-            new = self.recv(timeout=timeout_remaining)
-
-            decoded = ""
-            for _ in range(10):
-                try:
-                    decoded += new.decode("utf-8")
-                    break
-                except UnicodeDecodeError:
-                    try:
-                        new += self.recv(timeout=0.1)
-                    except TimeoutError:
-                        pass
-            else:
-                decoded += new.decode("latin_1")
-
-            decoded = (
-                decoded.replace("\r\n", "\n").replace("\r\n", "\n").replace("\r", "\n")
-            )
-
-            buf += decoded
-
-            if (expr is None and buf[-len(prompt) :] == prompt) or (
-                expr is not None and re.search(expr, buf) is not None
-            ):
-                if stream:
-                    # Don't clip prompt if it doesn't need to be at the end
-                    if must_end:
-                        stream.write(decoded[: -len(prompt)])
-                    else:
-                        stream.write(decoded)
-                break
-            elif stream is not None:
-                stream.write(decoded)
+            filled = self.recv_into(view, timeout=timeout_remaining)
+            result = reader.feed(view[:filled])
+            if result is not None:
+                return result
 
             if timeout is not None:
                 current_time = time.monotonic()
                 timeout_remaining = timeout - (current_time - start_time)
 
-        return buf
+    def expect(
+        self,
+        patterns: typing.Sequence[Pattern],
+        *,
+        stream: typing.Optional[typing.TextIO] = None,
+        timeout: typing.Optional[float] = None,
+        lookbehind: int = 1024,
+    ) -> ExpectMatch:
+        """
+        Read until one of multiple patterns is received.
+
+        Incoming data is only scanned once for all patterns, which makes it
+        possible to watch for error messages while waiting for a prompt::
+
+            m = chan.expect(["login: ", re.compile(r"Kernel panic.*")])
+            if m.i == 1:
+                raise Exception("Boot failed")
+
+        If multiple patterns match, the one starting first wins, or the one
+        first in the list if they start at the same position.
+
+        :param patterns: Patterns to wait for.  A :class:`str` is matched
+            literally, a compiled regular expression (:func:`re.compile`) is
+            searched for.  Regular expressions can use ``$`` to only match at
+            the end of the received data, like a prompt.
+        :param io.TextIOBase stream: Optional stream where ``expect`` should
+            write everything received.
+        :param float timeout: Optional timeout.
+        :param int lookbehind: Number of already received characters regular
+            expressions are matched against, in addition to each new chunk.
+        :raises TimeoutError: If a timeout is set and this timeout is reached
+            before any of the patterns is detected.
+        :rtype: ExpectMatch
+        :returns: Which pattern matched, and where.
+        """
+        matcher = _ExpectMatcher(patterns, lookbehind=lookbehind)
+        output, _ = self._read_until(
+            _PromptReader(self._decoder, matcher, stream=stream), timeout
+        )
+        return _expect_result(matcher, output)
 
     def raw_command(
         self,
@@ -391,13 +840,134 @@ class Channel(abc.ABC):
         :returns: The ouput of the command. Will contain a trailing newline unless the
             command did not send one (eg. ``printf``)
         """
+        return self._raw_command(
+            command, prompt=prompt, stream=stream, timeout=timeout
+        )[1]
+
+    def _raw_command(
+        self,
+        command: str,
+        *,
+        prompt: str,
+        stream: typing.Optional[typing.TextIO],
+        timeout: typing.Optional[float],
+    ) -> typing.Tuple[typing.Optional[int], str]:
+        if prompt == TBOT_PROMPT:
+            # The default prompt only exists once the shell is initialized
+            self._lazy_initialize()
+
         self.send(f"{command}\n".encode("utf-8"))
         if stream:
             stream = SkipStream(stream, len(command) + 1)
-        out = self.read_until_prompt(prompt, stream=stream, timeout=timeout)[
-            len(command) + 1 : -len(prompt)
-        ]
-        return out
+
+        prompt, regex = _command_prompt(prompt, self._prompt_retval)
+        try:
+            buf, end = self._read_until_prompt(
+                prompt, regex=regex, stream=stream, timeout=timeout
+            )
+        except TimeoutError:
+            if self.interrupt_on_timeout:
+                tbot.log.warning("Command timed out, interrupting it ...")
+                self._interrupt(prompt, regex)
+            raise
+        return _command_result(command, buf, end, regex)
+
+    def _raw_command_iter(
+        self,
+        command: str,
+        *,
+        prompt: str = TBOT_PROMPT,
+        timeout: typing.Optional[float] = None,
+    ) -> typing.Generator[str, None, typing.Optional[int]]:
+        """
+        Send a command and yield its output as it arrives.
+
+        The first item is always empty and is yielded right after the command
+        was sent, so callers can start the command before reading its output.
+        Output is not accumulated, so memory use stays bounded no matter how
+        much the command prints.  If the generator is closed before the
+        command finished, the command is interrupted.
+
+        :returns: The exit code, if the prompt contains it.
+        """
+        if prompt == TBOT_PROMPT:
+            self._lazy_initialize()
+
+        self.send(f"{command}\n".encode("utf-8"))
+        collector = io.StringIO()
+
+        prompt, regex = _command_prompt(prompt, self._prompt_retval)
+        matcher = _PromptMatcher(prompt, regex=regex, must_end=True, lookbehind=1024)
+        reader = _PromptReader(
+            self._decoder,
+            matcher,
+            stream=SkipStream(collector, len(command) + 1),
+            keep=False,
+        )
+        view = memoryview(self._recv_buffer)
+
+        start_time = time.monotonic()
+        try:
+            yield ""
+
+            while True:
+                timeout_remaining = None
+                if timeout is not None:
+                    timeout_remaining = timeout - (time.monotonic() - start_time)
+                    if timeout_remaining <= 0:
+                        raise TimeoutError()
+
+                filled = self.recv_into(view, timeout=timeout_remaining)
+                result = reader.feed(view[:filled])
+
+                text = collector.getvalue()
+                if text != "":
+                    collector.seek(0)
+                    collector.truncate()
+                    yield text
+
+                if result is not None:
+                    return _command_result("", result[0], result[1], regex)[0]
+        except TimeoutError:
+            if self.interrupt_on_timeout:
+                tbot.log.warning("Command timed out, interrupting it ...")
+                self._interrupt(prompt, regex)
+            raise
+        except GeneratorExit:
+            # The consumer stopped early, don't leave the command running
+            self._interrupt(prompt, regex)
+            raise
+
+    def _interrupt(self, prompt: str, regex: bool) -> None:
+        """
+        Interrupt the running command and wait until the shell is ready again.
+
+        After the interrupt, a marker with a random nonce is echoed.  Everything
+        up to the marker and the prompt following it is discarded, so no
+        output or prompt of the interrupted command is left over.
+        """
+        prompt = prompt if regex else re.escape(prompt)
+        for _ in range(self.interrupt_retries):
+            nonce = secrets.token_hex(8)
+            self.send(b"\x03")
+            try:
+                # Wait for the shell first, so the marker command is not
+                # swallowed by the interrupted command
+                self._read_until_prompt(
+                    prompt, regex=True, timeout=self.interrupt_timeout
+                )
+                # The quotes keep the echoed command line from matching
+                self.send(f"echo TBOT-SYNC''-{nonce}\n")
+                self._read_until_prompt(
+                    re.escape(f"TBOT-SYNC-{nonce}\n") + prompt,
+                    regex=True,
+                    timeout=self.interrupt_timeout,
+                )
+            except TimeoutError:
+                continue
+            return
+
+        tbot.log.warning("Shell did not recover from the interrupt")
 
     def raw_command_with_retval(
         self,
@@ -411,6 +981,11 @@ class Channel(abc.ABC):
         """
         Send a command to this channel, wait until it finishes, and check its retcode.
 
+        If the shell's prompt contains the exit code (see
+        :meth:`~tbot.machine.channel.Channel.initialize`), the exit code is
+        taken from there.  Otherwise ``retval_check_cmd`` is run as a second
+        command, which is the case for eg. U-Boot.
+
         :param str command: The command without a trailing newline
         :param str prompt: The prompt of the shell on this channel. This is needed
             to detect when the command is done.
@@ -423,10 +998,15 @@ class Channel(abc.ABC):
         :returns: The retcode and ouput of the command. Will contain a trailing newline
             unless the command did not send one (eg. ``printf``)
         """
-        out = self.raw_command(command, prompt=prompt, stream=stream, timeout=timeout)
-
-        retval = int(
-            self.raw_command(retval_check_cmd, prompt=prompt, timeout=timeout).strip()
+        retval, out = self._raw_command(
+            command, prompt=prompt, stream=stream, timeout=timeout
         )
 
+        if retval is None:
+            retval = int(
+                self.raw_command(
+                    retval_check_cmd, prompt=prompt, timeout=timeout
+                ).strip()
+            )
+
         return retval, out
@@ -55,32 +55,45 @@ class ParamikoChannel(channel.Channel):
     def recv(
         self, timeout: typing.Optional[float] = None, max: typing.Optional[int] = None
     ) -> bytes:  # noqa: D102
+        view = memoryview(self._recv_buffer)
+        if max:
+            view = view[:max]
+        length = self.recv_into(view, timeout)
+        return bytes(view[:length])
+
+    def recv_into(
+        self,
+        buf: typing.Union[bytearray, memoryview],
+        timeout: typing.Optional[float] = None,
+    ) -> int:  # noqa: D102
         if timeout is not None:
             self.ch.settimeout(timeout)
 
+        view = memoryview(buf)
+        length = 0
         try:
-            maxread = min(1024, max) if max else 1024
-            buf = self.ch.recv(maxread)
-            self._debug_log(buf)
-
-            while self.ch.recv_ready():
-                maxread = min(1024, max - len(buf)) if max else 1024
-                if maxread == 0:
+            # Paramiko can't read into a buffer, so copy each read once
+            new = self.ch.recv(len(view))
+            view[: len(new)] = new
+            length = len(new)
+
+            while length < len(view) and self.ch.recv_ready():
+                new = self.ch.recv(len(view) - length)
+                if new == b"":
                     break
-
-                new = self.ch.recv(maxread)
-                buf += new
-                self._debug_log(new)
+                view[length : length + len(new)] = new
+                length += len(new)
         except socket.timeout:
             raise TimeoutError()
         finally:
             if timeout is not None:
                 self.ch.settimeout(None)
 
-        if buf == b"":
+        if length == 0:
             raise channel.ChannelClosedException()
 
-        return buf
+        self._debug_log(view[:length])
+        return length
 
     def close(self) -> None:  # noqa: D102
         if self.isopen():
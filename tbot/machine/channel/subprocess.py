@@ -23,24 +23,52 @@ import subprocess
 from . import channel
 
 
+def _spawn_shell() -> typing.Tuple[int, subprocess.Popen]:
+    """Start a bash on a new pty and return the non-blocking pty master."""
+    pty_master, pty_slave = pty.openpty()
+
+    p = subprocess.Popen(
+        ["bash", "--norc", "-i"],
+        stdin=pty_slave,
+        stdout=pty_slave,
+        stderr=pty_slave,
+        start_new_session=True,
+    )
+
+    flags = fcntl.fcntl(pty_master, fcntl.F_GETFL)
+    flags = flags | os.O_NONBLOCK
+    fcntl.fcntl(pty_master, fcntl.F_SETFL, flags)
+
+    return pty_master, p
+
+
+def _read_available(fd: int, view: memoryview) -> int:
+    """Read everything available from ``fd`` into ``view``, at least one byte."""
+    try:
+        length = os.readv(fd, [view])
+    except BlockingIOError:
+        # If we don't get anything, and the timeout hasn't triggered
+        # this channel is closed
+        raise channel.ChannelClosedException()
+
+    try:
+        while 0 < length < len(view):
+            new = os.readv(fd, [view[length:]])
+            if new == 0:
+                break
+            length += new
+    except BlockingIOError:
+        pass
+
+    return length
+
+
 class SubprocessChannel(channel.Channel):
     """Subprocess based channel."""
 
     def __init__(self) -> None:
         """Create a new :mod:`subprocess` based channel."""
-        self.pty_master, pty_slave = pty.openpty()
-
-        self.p = subprocess.Popen(
-            ["bash", "--norc", "-i"],
-            stdin=pty_slave,
-            stdout=pty_slave,
-            stderr=pty_slave,
-            start_new_session=True,
-        )
-
-        flags = fcntl.fcntl(self.pty_master, fcntl.F_GETFL)
-        flags = flags | os.O_NONBLOCK
-        fcntl.fcntl(self.pty_master, fcntl.F_SETFL, flags)
+        self.pty_master, self.p = _spawn_shell()
 
         super().__init__()
 
@@ -55,7 +83,13 @@ class SubprocessChannel(channel.Channel):
         length = len(data)
         c = 0
         while c < length:
-            b = os.write(self.pty_master, data[c:])
+            try:
+                b = os.write(self.pty_master, data[c:])
+            except BlockingIOError:
+                # The shell did not read the previous input yet (eg. a long
+                # command from stat_many), wait until there is room again
+                select.select([], [self.pty_master], [])
+                continue
             if b == 0:
                 raise channel.ChannelClosedException()
             c += b
@@ -63,10 +97,19 @@ class SubprocessChannel(channel.Channel):
     def recv(
         self, timeout: typing.Optional[float] = None, max: typing.Optional[int] = None
     ) -> bytes:  # noqa: D102
+        view = memoryview(self._recv_buffer)
+        if max:
+            view = view[:max]
+        length = self.recv_into(view, timeout)
+        return bytes(view[:length])
+
+    def recv_into(
+        self,
+        buf: typing.Union[bytearray, memoryview],
+        timeout: typing.Optional[float] = None,
+    ) -> int:  # noqa: D102
         self.p.poll()
 
-        buf = b""
-
         if self.p.returncode is None:
             # If the process is still running, wait for one byte or
             # the timeout to arrive
@@ -75,27 +118,10 @@ class SubprocessChannel(channel.Channel):
                 raise TimeoutError()
         # If the process has ended, check for anything left
 
-        maxread = min(1024, max) if max else 1024
-        try:
-            buf = os.read(self.pty_master, maxread)
-            self._debug_log(buf)
-        except BlockingIOError:
-            # If we don't get anything, and the timeout hasn't triggered
-            # this channel is closed
-            raise channel.ChannelClosedException()
-
-        try:
-            while True:
-                maxread = min(1024, max - len(buf)) if max else 1024
-                if maxread == 0:
-                    break
-                new = os.read(self.pty_master, maxread)
-                buf += new
-                self._debug_log(new)
-        except BlockingIOError:
-            pass
-
-        return buf
+        view = memoryview(buf)
+        length = _read_available(self.pty_master, view)
+        self._debug_log(view[:length])
+        return length
 
     def close(self) -> None:  # noqa: D102
         if self.isopen():
@@ -60,3 +60,23 @@ class WrongHostException(Exception):
 
     def __str__(self) -> str:
         return f"{self.arg!r} is not associated with {self.host!r}"
+
+
+class BootException(Exception):
+    """A board printed an error message while booting."""
+
+    def __init__(self, host: machine.Machine, message: str, output: str) -> None:
+        """
+        Create a new BootException.
+
+        :param machine.Machine host: The machine that failed to boot
+        :param str message: The error message that was detected
+        :param str output: Everything printed during boot, up to the error
+        """
+        super().__init__()
+        self.host = host
+        self.message = message
+        self.output = output
+
+    def __str__(self) -> str:
+        return f"{self.host.name} failed to boot: {self.message!r}"
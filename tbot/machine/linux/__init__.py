@@ -1,4 +1,5 @@
-from .machine import LinuxMachine, _SubshellContext
+from .machine import CommandStream, HostFacts, LinuxMachine, _SubshellContext
+from .job import Job
 from .path import Path
 
 from .build import BuildMachine
@@ -10,6 +11,9 @@ from .special import AndThen, Background, Env, OrElse, Pipe, Raw, Then, F, Speci
 
 __all__ = (
     "BuildMachine",
+    "CommandStream",
+    "HostFacts",
+    "Job",
     "LabHost",
     "LinuxMachine",
     "_SubshellContext",
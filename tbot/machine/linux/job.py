@@ -0,0 +1,141 @@
+# tbot, Embedded Automation Tool
+# Copyright (C) 2018  Harald Seiler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import shlex
+import typing
+from tbot.machine import linux  # noqa: F401
+
+H = typing.TypeVar("H", bound="linux.LinuxMachine")
+
+
+class Job(typing.Generic[H]):
+    """
+    Handle for a command running in the background.
+
+    Returned by :meth:`~tbot.machine.linux.LinuxMachine.spawn`.  The command
+    runs in its own process group, with its output redirected to a file in the
+    workdir.  Using the job as a context manager kills it (if it is still
+    running) and removes its files afterwards.
+    """
+
+    def __init__(self, host: H, pid: int, out: "linux.Path[H]") -> None:
+        """
+        Create a new job handle.
+
+        :param linux.LinuxMachine host: Host the job is running on
+        :param int pid: PID of the job, which is also its process group ID
+        :param linux.Path out: File the output is written to.  The exit code
+            is written to the same path with a ``.rc`` suffix.
+        """
+        self.host = host
+        self.pid = pid
+        self.out = out
+        self.rc = out.parent / (out.stem + ".rc")
+        self._returncode: typing.Optional[int] = None
+
+    def __repr__(self) -> str:
+        return f"<Job {self.pid} on {self.host.name}>"
+
+    def _finish(self, rc: str) -> int:
+        # Empty if the job was killed before it could write its exit code
+        self._returncode = int(rc) if rc.strip() != "" else -1
+        # The job might have changed files
+        self.host.invalidate_stat_cache()
+        return self._returncode
+
+    @property
+    def returncode(self) -> typing.Optional[int]:
+        """
+        Exit code of the job, as of the last check.
+
+        ``None`` if the job was still running, or was not checked yet.  ``-1``
+        if the job was killed before it could record its exit code.
+        """
+        return self._returncode
+
+    def poll(self) -> typing.Optional[int]:
+        """
+        Check whether the job has finished.
+
+        :returns: The exit code, or ``None`` if the job is still running.
+            ``-1`` if the job was killed before it could record its exit
+            code.
+        """
+        if self._returncode is not None:
+            return self._returncode
+
+        rc = shlex.quote(self.rc._local_str())
+        ret, out = self.host.exec(
+            linux.Raw(f"cat {rc} 2>/dev/null || kill -0 {self.pid} 2>/dev/null")
+        )
+        if ret == 0 and out == "":
+            return None
+        return self._finish(out)
+
+    def wait(self, timeout: typing.Optional[float] = None) -> int:
+        """
+        Wait until the job has finished.
+
+        The waiting happens on the host, so this only takes a single command.
+
+        :param float timeout: Optional timeout.
+        :raises TimeoutError: If the job did not finish in time.  It keeps
+            running.
+        :returns: The exit code of the job, or ``-1`` if it was killed
+            before it could record one.
+        """
+        if self._returncode is not None:
+            return self._returncode
+
+        rc = shlex.quote(self.rc._local_str())
+        out = self.host.exec0(
+            linux.Raw(
+                f"while [ ! -e {rc} ] && kill -0 {self.pid} 2>/dev/null; "
+                f"do sleep 0.1; done; cat {rc} 2>/dev/null; true"
+            ),
+            timeout=timeout,
+        )
+        return self._finish(out)
+
+    def kill(self, signal: str = "TERM") -> None:
+        """
+        Send a signal to the job's processes.
+
+        :param str signal: Name of the signal.
+        """
+        self.host.exec(
+            linux.Raw(
+                f"kill -s {shlex.quote(signal)} -- -{self.pid} 2>/dev/null"
+                f" || kill -s {shlex.quote(signal)} {self.pid} 2>/dev/null"
+            )
+        )
+
+    def output(self) -> str:
+        """
+        Return everything the job printed so far.
+
+        :returns: The combined stdout and stderr of the job.
+        """
+        return self.host.exec0("cat", self.out)
+
+    def __enter__(self) -> "Job[H]":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        if self.poll() is None:
+            self.kill()
+            self.wait()
+        self.host.exec0("rm", "-f", self.out, self.rc)
@@ -63,9 +63,14 @@ class LocalLabHost(LabHost):
     def destroy(self) -> None:
         """Destroy this instance of a LocalLabHost."""
         self.channel.close()
+        if self._async_channel is not None and self._async_channel.done():
+            self._async_channel.result().close()
 
     def _obtain_channel(self) -> channel.Channel:
         return self.channel
 
     def _new_channel(self) -> channel.Channel:
         return channel.SubprocessChannel()
+
+    async def _new_channel_async(self) -> channel.AsyncChannel:
+        return await channel.AsyncSubprocessChannel.create()
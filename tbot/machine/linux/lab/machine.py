@@ -15,6 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import abc
+import asyncio
 import typing
 import tbot
 from tbot.machine import linux
@@ -27,6 +28,15 @@ Self = typing.TypeVar("Self", bound="LabHost")
 class LabHost(linux.LinuxMachine):
     """Generic LabHost abstraction."""
 
+    def __init__(self) -> None:
+        """Create a new instance of this LabHost."""
+        super().__init__()
+        self._async_channel: typing.Optional[
+            "asyncio.Future[channel.AsyncChannel]"
+        ] = None
+        # Number of SSHMachines using each ControlMaster socket on this host
+        self._mux_users: typing.Dict[str, int] = {}
+
     @abc.abstractmethod
     def _new_channel(self) -> channel.Channel:
         pass
@@ -53,6 +63,9 @@ class LabHost(linux.LinuxMachine):
         """
         chan = self._new_channel()
         if args != ():
+            # Wait for the shell to be ready, otherwise the command might be
+            # read by its line editor and echoed in unpredictable ways
+            chan._lazy_initialize()
             cmd = self.build_command(*args)
             tbot.log_event.command(self.name, cmd)
             # Send exit after the command so this channel will close once it
@@ -62,6 +75,67 @@ class LabHost(linux.LinuxMachine):
             chan.recv()
         return chan
 
+    async def _new_channel_async(self) -> channel.AsyncChannel:
+        raise NotImplementedError(f"{self!r} does not support asyncio")
+
+    async def new_channel_async(
+        self: Self, *args: typing.Union[str, special.Special, linux.Path[Self]]
+    ) -> channel.AsyncChannel:
+        """
+        Create a new asyncio channel for a new machine instance via this LabHost.
+
+        Like :meth:`~tbot.machine.linux.LabHost.new_channel`, but returns an
+        :class:`~tbot.machine.channel.AsyncChannel`.
+
+        **Example**::
+
+            async def boot_all(lh, consoles):
+                chans = await asyncio.gather(
+                    *[lh.new_channel_async("picocom", "-b", "115200", c)
+                      for c in consoles]
+                )
+                await asyncio.gather(
+                    *[ch.read_until_prompt("login: ", must_end=False)
+                      for ch in chans]
+                )
+        """
+        chan = await self._new_channel_async()
+        if args != ():
+            cmd = self.build_command(*args)
+            tbot.log_event.command(self.name, cmd)
+            # Send exit after the command so this channel will close once it
+            # is done.
+            await chan.send(cmd + " ; exit\n")
+            # Read back the command we just sent
+            await chan.recv()
+        return chan
+
+    async def _obtain_channel_async(self) -> channel.AsyncChannel:
+        # Store the task, so concurrent callers share the same channel
+        if self._async_channel is None:
+            self._async_channel = asyncio.ensure_future(self._new_channel_async())
+        return await self._async_channel
+
+    def clone(self: Self) -> Self:
+        """
+        Create another instance of this LabHost.
+
+        The new instance runs commands on its own channel and starts out with
+        empty caches, so it can be used from a different thread at the same
+        time as this one.  Connections are shared where possible, eg. an
+        :class:`~tbot.machine.linux.lab.SSHLabHost` leases the same pooled
+        connection.  Destroy the clone once it is no longer needed.
+
+        **Example**::
+
+            with tbot.acquire_lab() as lh, lh.clone() as lh2:
+                job = threading.Thread(target=lh2.exec0, args=("make",))
+                job.start()
+                lh.exec0("ls")
+                job.join()
+        """
+        return type(self)()
+
     def build(self) -> linux.BuildMachine:
         raise KeyError("No build machine available!")
 
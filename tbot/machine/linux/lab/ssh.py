@@ -15,17 +15,118 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import abc
+import atexit
+import codecs
+import hashlib
+import socket
+import threading
+import time
 import typing
 import getpass
 import pathlib
 import paramiko
-from tbot.machine import channel
-from tbot.machine.linux import auth
-from tbot import log
+from tbot import machine
+from tbot.machine import channel, linux
+from tbot.machine.linux import auth, special
+from tbot import log, log_event
 from .machine import LabHost
 
 SLH = typing.TypeVar("SLH", bound="SSHLabHost")
 
+_PoolKey = typing.Tuple[str, int, str, str, typing.Optional[str], bool]
+
+
+class _PooledClient:
+    __slots__ = ("client", "leases", "last_used", "timeout")
+
+    def __init__(self, client: paramiko.SSHClient) -> None:
+        self.client = client
+        self.leases = 0
+        self.last_used = time.monotonic()
+        self.timeout = 0.0
+
+
+class _ConnectionPool:
+    """
+    Process-wide pool of SSH connections.
+
+    Each connection can be leased by multiple lab-hosts at once, which open
+    their own sessions on it.  Unused connections are kept open for a while,
+    so the next lab-host to the same destination doesn't need a new handshake.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.clients: typing.Dict[_PoolKey, _PooledClient] = {}
+
+    @staticmethod
+    def _healthy(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key, entry in list(self.clients.items()):
+            if entry.leases == 0 and now - entry.last_used >= entry.timeout:
+                del self.clients[key]
+                entry.client.close()
+
+    def acquire(self, key: _PoolKey) -> typing.Optional[paramiko.SSHClient]:
+        """Lease an existing connection, if there is a healthy one."""
+        with self.lock:
+            self._evict()
+            entry = self.clients.get(key)
+            if entry is None:
+                return None
+            if not self._healthy(entry.client):
+                del self.clients[key]
+                entry.client.close()
+                return None
+            entry.leases += 1
+            return entry.client
+
+    def add(self, key: _PoolKey, client: paramiko.SSHClient) -> None:
+        """Add a new connection, which is leased once."""
+        with self.lock:
+            old = self.clients.get(key)
+            if old is not None and old.leases == 0:
+                old.client.close()
+            entry = _PooledClient(client)
+            entry.leases = 1
+            self.clients[key] = entry
+
+    def release(
+        self, key: _PoolKey, client: paramiko.SSHClient, timeout: float
+    ) -> None:
+        """Return a leased connection and keep it open for ``timeout`` seconds."""
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is None or entry.client is not client:
+                # Not (or no longer) pooled
+                client.close()
+                return
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            entry.timeout = timeout
+            self._evict()
+
+    def close_all(self) -> None:
+        """Close all connections."""
+        with self.lock:
+            for entry in self.clients.values():
+                entry.client.close()
+            self.clients.clear()
+
+
+_POOL = _ConnectionPool()
+atexit.register(_POOL.close_all)
+
 
 class SSHLabHost(LabHost):
     """
@@ -128,6 +229,28 @@ class SSHLabHost(LabHost):
         else:
             return 22
 
+    pool_timeout: float = 60.0
+    """
+    Time in seconds an unused connection is kept open for reuse.
+
+    Connections are shared between all instances of a lab-host with the same
+    hostname, port, username, authentication and host key checking, so calling
+    :func:`tbot.acquire_lab` again only opens a new session instead of
+    connecting again.  Set this to ``0`` to close connections as soon as they
+    are no longer used.
+    """
+
+    stateless: bool = False
+    """
+    Whether commands are run using :meth:`~tbot.machine.linux.lab.SSHLabHost.exec_fast`.
+
+    If this is ``True``, :meth:`~tbot.machine.linux.LinuxMachine.exec` and
+    :meth:`~tbot.machine.linux.LinuxMachine.exec0` run each command on its own
+    exec channel, unless a :meth:`~tbot.machine.linux.LinuxMachine.subshell`
+    is active.  Only enable this if your testcases don't rely on state of the
+    lab-host's shell, like environment variables or the working directory.
+    """
+
     def __repr__(self) -> str:
         return (
             f"<{self.__class__.__name__} {self.username}@{self.hostname}:{self.port}>"
@@ -150,11 +273,6 @@ class SSHLabHost(LabHost):
             log.message(log.c("Invalid").red + " .ssh/config")
             raise
 
-        if self.ignore_hostkey:
-            self.client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
-        else:
-            self.client.load_system_host_keys()
-
         password = None
         key_file = None
 
@@ -164,23 +282,53 @@ class SSHLabHost(LabHost):
         if isinstance(authenticator, auth.PrivateKeyAuthenticator):
             key_file = str(authenticator.key)
 
-        log.message(
-            "Logging in on "
-            + log.c(f"{self.username}@{self.hostname}:{self.port}").yellow
-            + " ...",
-            verbosity=log.Verbosity.COMMAND,
-        )
-        self.client.connect(
+        # The pool outlives this lab-host, don't keep the password around in it
+        secret = password if password is not None else key_file
+        self._pool_key: _PoolKey = (
             self.hostname,
-            username=self.username,
-            port=self.port,
-            password=password,
-            key_filename=key_file,
+            self.port,
+            self.username,
+            authenticator.__class__.__name__,
+            hashlib.sha256(secret.encode("utf-8")).hexdigest() if secret else None,
+            # A connection which skipped host key checking must not be handed
+            # to a lab-host which requires it
+            self.ignore_hostkey,
         )
+        self._channels: typing.List[
+            typing.Union[channel.Channel, channel.AsyncChannel]
+        ] = []
+
+        client = _POOL.acquire(self._pool_key)
+        if client is not None:
+            log.message(
+                "Reusing connection to "
+                + log.c(f"{self.username}@{self.hostname}:{self.port}").yellow
+                + " ...",
+                verbosity=log.Verbosity.COMMAND,
+            )
+            self.client = client
+        else:
+            if self.ignore_hostkey:
+                self.client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
+            else:
+                self.client.load_system_host_keys()
+
+            log.message(
+                "Logging in on "
+                + log.c(f"{self.username}@{self.hostname}:{self.port}").yellow
+                + " ...",
+                verbosity=log.Verbosity.COMMAND,
+            )
+            self.client.connect(
+                self.hostname,
+                username=self.username,
+                port=self.port,
+                password=password,
+                key_filename=key_file,
+            )
+            _POOL.add(self._pool_key, self.client)
 
-        self.channel = channel.ParamikoChannel(
-            self.client.get_transport().open_session()
-        )
+        self.channel = self._new_channel()
 
     def destroy(self) -> None:
         """
@@ -190,11 +338,145 @@ class SSHLabHost(LabHost):
             Closes all channels that are still open. You should not call this method
             unless you know what you are doing. The preferred way is to use a context
             block using ``with``.
+
+        The connection itself is returned to the pool and stays open for
+        :attr:`~tbot.machine.linux.lab.SSHLabHost.pool_timeout` seconds.
+        """
+        for ch in self._channels:
+            if ch.isopen():
+                ch.close()
+        self._channels = []
+        _POOL.release(self._pool_key, self.client, self.pool_timeout)
+
+    def exec(
+        self: SLH,
+        *args: typing.Union[str, special.Special[SLH], linux.Path[SLH]],
+        stdout: typing.Optional[linux.Path[SLH]] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> typing.Tuple[int, str]:  # noqa: D102
+        if self.stateless and self._subshells == 0:
+            return self.exec_fast(*args, stdout=stdout, timeout=timeout)
+        return super().exec(*args, stdout=stdout, timeout=timeout)
+
+    def exec_fast(
+        self: SLH,
+        *args: typing.Union[str, special.Special[SLH], linux.Path[SLH]],
+        stdout: typing.Optional[linux.Path[SLH]] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> typing.Tuple[int, str]:
+        """
+        Run a command on its own exec channel.
+
+        Instead of typing the command into the lab-host's shell, it is started
+        with a separate SSH exec request on the existing connection.  There is
+        no prompt or command echo to parse and the exit code is reported by the
+        SSH server, which makes this faster for short commands.  As every
+        command gets its own channel, multiple threads can call this method
+        concurrently.
+
+        The command runs in a new non-interactive shell without a terminal and
+        with stdin closed.  Changes to the environment or working directory
+        of the lab-host's shell (eg. in a
+        :meth:`~tbot.machine.linux.LinuxMachine.subshell`) do not apply.
+
+        :param args: Each arg is a token that will be sent to the shell. Can be
+            either a str, a :class:`~linux.special.Special` or a Path that
+            is associated with this host.
+        :param Path stdout: File where stdout should be directed to
+        :param float timeout: Optional timeout.
+        :raises TimeoutError: If the timeout was reached before the command finished.
+        :returns: Tuple with the exit code and a string containing the combined
+            stdout and stderr of the command.
+        :rtype: (int, str)
+        """
+        command = self.build_command(*args, stdout=stdout)
+        if stdout is not None or not self._is_readonly(args):
+            self._invalidate_caches()
+
+        with log_event.command(self.name, command) as ev:
+            ret, out = self._exec_fast(command, ev, timeout)
+            ev.data["stdout"] = out
+
+        return ret, out
+
+    def exec0_fast(
+        self: SLH,
+        *args: typing.Union[str, special.Special[SLH], linux.Path[SLH]],
+        stdout: typing.Optional[linux.Path[SLH]] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> str:
         """
-        self.client.close()
+        Run a command on its own exec channel and ensure it succeeds.
+
+        See :meth:`~tbot.machine.linux.lab.SSHLabHost.exec_fast`.
+
+        :param args: Each arg is a token that will be sent to the shell.
+        :param Path stdout: File where stdout should be directed to
+        :param float timeout: Optional timeout.
+        :returns: A string containing the combined stdout and stderr of the
+            command.
+        :rtype: str
+        """
+        ret, out = self.exec_fast(*args, stdout=stdout, timeout=timeout)
+
+        if ret != 0:
+            raise machine.CommandFailedException(self, self.build_command(*args), out)
+
+        return out
+
+    def _exec_fast(
+        self, command: str, stream: typing.TextIO, timeout: typing.Optional[float]
+    ) -> typing.Tuple[int, str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ch = self.client.get_transport().open_session(timeout=timeout)
+        try:
+            # Keep the output identical to commands run in the shell
+            ch.set_combine_stderr(True)
+            ch.exec_command(command)
+            # Commands reading stdin get EOF instead of blocking forever
+            ch.shutdown_write()
+
+            decoder = codecs.getincrementaldecoder("utf-8")(
+                channel.Channel.decode_errors
+            )
+            chunks = []
+            while True:
+                if deadline is not None:
+                    ch.settimeout(max(deadline - time.monotonic(), 0.0))
+                try:
+                    data = ch.recv(channel.Channel.recv_size)
+                except socket.timeout:
+                    raise TimeoutError()
+                if data == b"":
+                    break
+
+                text = decoder.decode(data)
+                stream.write(text)
+                chunks.append(text)
+            chunks.append(decoder.decode(b"", final=True))
+
+            return ch.recv_exit_status(), "".join(chunks)
+        finally:
+            ch.close()
 
     def _obtain_channel(self) -> channel.Channel:
         return self.channel
 
+    def _track_channel(
+        self, ch: typing.Union[channel.Channel, channel.AsyncChannel]
+    ) -> None:
+        # Forget channels which were closed in the meantime
+        self._channels = [c for c in self._channels if c.isopen()]
+        self._channels.append(ch)
+
     def _new_channel(self) -> channel.Channel:
-        return channel.ParamikoChannel(self.client.get_transport().open_session())
+        ch = channel.ParamikoChannel(self.client.get_transport().open_session())
+        self._track_channel(ch)
+        return ch
+
+    async def _new_channel_async(self) -> channel.AsyncChannel:
+        ch = await channel.AsyncParamikoChannel.create(
+            self.client.get_transport().open_session()
+        )
+        self._track_channel(ch)
+        return ch
@@ -15,17 +15,223 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import abc
+import os
+import re
+import secrets
+import time
 import typing
 import shlex
 import shutil
 import tbot
 from tbot import machine
 from tbot.machine import channel
+from .job import Job
 from .path import Path
 from .special import Raw, Special
 from . import shell as sh
 
 Self = typing.TypeVar("Self", bound="LinuxMachine")
+T = typing.TypeVar("T")
+
+# Commands that are known to not modify the filesystem, if used without
+# any redirection or other special tokens
+_READONLY_COMMANDS = {
+    "cat",
+    "df",
+    "echo",
+    "false",
+    "head",
+    "ls",
+    "md5sum",
+    "nproc",
+    "printf",
+    "pwd",
+    "readlink",
+    "realpath",
+    "sha256sum",
+    "stat",
+    "tail",
+    "test",
+    "true",
+    "uname",
+    "wc",
+    "which",
+}
+
+
+class _EnvValue(Special):
+    """Quoted expansion of a variable, which does not modify anything."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def resolve_string(self, _: typing.Any) -> str:
+        return f'"${{{self.name}}}"'
+
+
+_STAT_FORMAT = "TBOT-STAT %f %i %d %h %u %g %s %X %Y %Z %n"
+
+# Result of lstat and stat for a path, along with the time it was fetched
+_StatEntry = typing.Tuple[
+    float, typing.Optional[os.stat_result], typing.Optional[os.stat_result]
+]
+
+
+def _parse_stat(out: str) -> typing.Dict[str, os.stat_result]:
+    results = {}
+    for line in out.split("\n"):
+        if not line.startswith("TBOT-STAT "):
+            continue
+        fields = line.split(" ", 11)
+        results[fields[11]] = os.stat_result(
+            (
+                int(fields[1], 16),
+                int(fields[2]),
+                int(fields[3]),
+                int(fields[4]),
+                int(fields[5]),
+                int(fields[6]),
+                int(fields[7]),
+                int(fields[8]),
+                int(fields[9]),
+                int(fields[10]),
+            )
+        )
+    return results
+
+
+def _parse_fact(
+    out: typing.Optional[str], parse: typing.Callable[[str], T]
+) -> typing.Optional[T]:
+    """Parse the output of a fact's command, ``None`` if it failed."""
+    if out is None:
+        return None
+    try:
+        return parse(out)
+    except (ValueError, IndexError):
+        return None
+
+
+class HostFacts:
+    """
+    Facts about a host, see :attr:`~tbot.machine.linux.LinuxMachine.facts`.
+
+    All values are gathered at the same time and are not updated afterwards.
+    A value is ``None`` if it could not be determined, eg. because the command
+    reporting it is not available on the host.
+    """
+
+    __slots__ = ("home", "path", "nproc", "uname", "arch", "disk_free")
+
+    def __init__(
+        self,
+        home: typing.Optional[str],
+        path: typing.Optional[str],
+        nproc: typing.Optional[int],
+        uname: typing.Optional[str],
+        arch: typing.Optional[str],
+        disk_free: typing.Optional[int],
+    ) -> None:
+        self.home = home
+        """Home directory of the user (``$HOME``)."""
+
+        self.path = path
+        """Search path for commands (``$PATH``)."""
+
+        self.nproc = nproc
+        """Number of processors (``nproc --all``)."""
+
+        self.uname = uname
+        """Kernel name and release (``uname -sr``)."""
+
+        self.arch = arch
+        """Machine hardware name (``uname -m``)."""
+
+        self.disk_free = disk_free
+        """Free space in the workdir in bytes."""
+
+    def __repr__(self) -> str:
+        return f"<HostFacts {self.uname} {self.arch}, {self.nproc} CPUs>"
+
+
+class CommandStream(typing.Iterator[str]):
+    """
+    Output of a command, line by line, as it arrives.
+
+    Returned by :meth:`~tbot.machine.linux.LinuxMachine.exec_stream`.  Each
+    line keeps its trailing newline.  Lines longer than
+    :attr:`~tbot.machine.linux.CommandStream.max_line` are split.  Once
+    all lines were read, the exit code is available as
+    :attr:`~tbot.machine.linux.CommandStream.retcode`.  Closing the
+    stream early interrupts the command.
+    """
+
+    max_line = 64 * 1024
+    """Maximum length of a line, longer ones are returned in pieces."""
+
+    summary_size = 16 * 1024
+    """Number of characters of the start and of the end of the output kept for the log."""
+
+    def __init__(self, lines: typing.Generator[str, None, int]) -> None:
+        self._lines = lines
+        self._retcode: typing.Optional[int] = None
+
+    def __iter__(self) -> "CommandStream":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._lines)
+        except StopIteration as e:
+            self._retcode = e.value
+            raise
+
+    def __enter__(self) -> "CommandStream":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        self.close()
+
+    def close(self) -> None:
+        """Stop reading, interrupting the command if it is still running."""
+        self._lines.close()
+
+    @property
+    def retcode(self) -> int:
+        """
+        Exit code of the command.
+
+        :raises RuntimeError: If the output was not read completely yet.
+        """
+        if self._retcode is None:
+            raise RuntimeError("Command has not finished yet")
+        return self._retcode
+
+
+class _Summary:
+    """Start and end of a text, with the middle left out."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.head = ""
+        self.tail = ""
+        self.total = 0
+
+    def add(self, text: str) -> None:
+        self.total += len(text)
+        if len(self.head) < self.size:
+            n = self.size - len(self.head)
+            self.head += text[:n]
+            text = text[n:]
+        self.tail = (self.tail + text)[-self.size :]
+
+    def __str__(self) -> str:
+        omitted = self.total - len(self.head) - len(self.tail)
+        if omitted == 0:
+            return self.head + self.tail
+        return f"{self.head}\n[... {omitted} characters omitted ...]\n{self.tail}"
 
 
 class LinuxMachine(machine.Machine, machine.InteractiveMachine):
@@ -48,10 +254,32 @@ class LinuxMachine(machine.Machine, machine.InteractiveMachine):
         """Return a path where testcases can store data on this host."""
         pass
 
+    stat_cache_ttl: typing.Optional[float] = 0.0
+    """
+    Time in seconds for which the results of stat queries are cached.
+
+    Caching is disabled by default (``0``), so polling eg.
+    :meth:`~tbot.machine.linux.Path.exists` sees files created by other
+    machines right away.  If enabled, the cache is also invalidated whenever
+    a command is run which could modify the filesystem.  Set this to ``None``
+    to only rely on the latter.
+    """
+
+    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        """Create a new instance of this LinuxMachine."""
+        super().__init__(*args, **kwargs)
+        self._stat_entries: typing.Dict[str, _StatEntry] = {}
+        self._env_values: typing.Dict[str, str] = {}
+        self._facts: typing.Optional[HostFacts] = None
+        self._subshells = 0
+
     @abc.abstractmethod
     def _obtain_channel(self) -> channel.Channel:
         pass
 
+    async def _obtain_channel_async(self) -> channel.AsyncChannel:
+        raise NotImplementedError(f"{self!r} does not support asyncio")
+
     def build_command(
         self: Self,
         *args: typing.Union[str, Special[Self], Path[Self]],
@@ -115,6 +343,8 @@ class LinuxMachine(machine.Machine, machine.InteractiveMachine):
         channel = self._obtain_channel()
 
         command = self.build_command(*args, stdout=stdout)
+        if stdout is not None or not self._is_readonly(args):
+            self._invalidate_caches()
 
         with tbot.log_event.command(self.name, command) as ev:
             ret, out = channel.raw_command_with_retval(
@@ -150,6 +380,279 @@ class LinuxMachine(machine.Machine, machine.InteractiveMachine):
 
         return out
 
+    def exec_stream(
+        self: Self,
+        *args: typing.Union[str, Special[Self], Path[Self]],
+        timeout: typing.Optional[float] = None,
+    ) -> CommandStream:
+        """
+        Run a command on this machine and read its output while it is running.
+
+        Unlike :meth:`~tbot.machine.linux.LinuxMachine.exec`, the output is
+        not kept in memory.  Only its start and end are stored in the log,
+        while everything is still printed as usual.  Don't run other commands
+        on this machine until the stream is exhausted or closed.
+
+        **Example**::
+
+            with lh.exec_stream("make", "-j4") as lines:
+                for line in lines:
+                    if "warning:" in line:
+                        tbot.log.warning(line.strip())
+            assert lines.retcode == 0
+
+        :param args: Each arg is a token that will be sent to the shell, like
+            for :meth:`~tbot.machine.linux.LinuxMachine.exec`.
+        :param float timeout: Optional timeout for the whole command.
+        :rtype: CommandStream
+        :returns: An iterator over the lines of the combined stdout and stderr
+            of the command.  The exit code is available afterwards.
+        """
+        channel = self._obtain_channel()
+
+        command = self.build_command(*args)
+        if not self._is_readonly(args):
+            self._invalidate_caches()
+
+        lines = self._exec_stream(channel, command, timeout)
+        # Run up to sending the command, so it starts before the first line is
+        # requested
+        next(lines)
+        return CommandStream(lines)
+
+    def _exec_stream(
+        self, chan: channel.Channel, command: str, timeout: typing.Optional[float]
+    ) -> typing.Generator[str, None, int]:
+        with tbot.log_event.command(self.name, command) as ev:
+            summary = _Summary(CommandStream.summary_size)
+            output = chan._raw_command_iter(command, timeout=timeout)
+            pending = ""
+            retval: typing.Optional[int] = None
+            try:
+                # Send the command and hand control back to exec_stream()
+                next(output)
+                yield ""
+
+                while True:
+                    try:
+                        text = next(output)
+                    except StopIteration as e:
+                        retval = e.value
+                        break
+
+                    ev.write(text)
+                    summary.add(text)
+
+                    *lines, pending = (pending + text).split("\n")
+                    for line in lines:
+                        yield line + "\n"
+                    while len(pending) > CommandStream.max_line:
+                        yield pending[: CommandStream.max_line]
+                        pending = pending[CommandStream.max_line :]
+            finally:
+                output.close()
+                ev.data["stdout"] = str(summary)
+
+            if pending != "":
+                yield pending
+
+        if retval is None:
+            retval = int(chan.raw_command("echo $?").strip())
+        return retval
+
+    def spawn(
+        self: Self, *args: typing.Union[str, Special[Self], Path[Self]]
+    ) -> Job[Self]:
+        """
+        Start a command in the background and return a handle for it.
+
+        The command runs in its own process group with its output redirected
+        to a file in the workdir, so other commands (and other jobs) can run
+        on this machine while it is running.
+
+        **Example**::
+
+            with lh.spawn("make", "-j4") as build:
+                with lh.spawn("tail", "-f", "/var/log/syslog") as log:
+                    assert build.wait(timeout=600) == 0
+                    log.kill()
+                    tbot.log.message(log.output())
+
+        :param args: Each arg is a token that will be sent to the shell, like
+            for :meth:`~tbot.machine.linux.LinuxMachine.exec`.
+        :rtype: Job
+        :returns: Handle to poll, wait for or kill the job and to read its
+            output.  Used as a context manager, it kills the job if it is
+            still running and removes its files afterwards.
+        """
+        nonce = secrets.token_hex(8)
+        out = self.workdir / f".tbot-job-{nonce}.out"
+        rc = shlex.quote((self.workdir / f".tbot-job-{nonce}.rc")._local_str())
+        command = self.build_command(*args)
+
+        # The outer subshell is not interactive, so the shell does not print
+        # job notifications.  `set -m` puts the job into its own process
+        # group, which allows killing it with all its children.
+        pid = self.exec0(
+            Raw(
+                f"(set -m; {{ {command}; echo $? >{rc}.tmp; mv {rc}.tmp {rc}; }}"
+                f" >{shlex.quote(out._local_str())} 2>&1 </dev/null & echo $!)"
+            )
+        )
+        self.invalidate_stat_cache()
+        return Job(self, int(pid.strip()), out)
+
+    async def exec_async(
+        self: Self,
+        *args: typing.Union[str, Special[Self], Path[Self]],
+        stdout: typing.Optional[Path[Self]] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> typing.Tuple[int, str]:
+        """
+        Run a command on this machine, using asyncio.
+
+        Like :meth:`~tbot.machine.linux.LinuxMachine.exec`, but the command is
+        run on a separate :class:`~tbot.machine.channel.AsyncChannel`, so
+        commands on many machines can be awaited concurrently.  Commands on the
+        same machine are run one after the other.
+
+        **Example**::
+
+            async def check_all(hosts):
+                coros = [h.exec_async("uname", "-r") for h in hosts]
+                for h, (ret, out) in zip(hosts, await asyncio.gather(*coros)):
+                    tbot.log.message(f"{h.name}: {out.strip()}")
+
+        :param args: Each arg is a token that will be sent to the shell. Can be
+            either a str, a :class:`~linux.special.Special` or a Path that
+            is associated with this host.
+        :param Path stdout: File where stdout should be directed to
+        :returns: Tuple with the exit code and a string containing the combined
+            stdout and stderr of the command (with a trailing newline).
+        :rtype: (int, str)
+        """
+        channel = await self._obtain_channel_async()
+
+        command = self.build_command(*args, stdout=stdout)
+        if stdout is not None or not self._is_readonly(args):
+            self._invalidate_caches()
+
+        with tbot.log_event.command(self.name, command) as ev:
+            ret, out = await channel.raw_command_with_retval(
+                command, stream=ev, timeout=timeout
+            )
+            ev.data["stdout"] = out
+
+        return ret, out
+
+    async def exec0_async(
+        self: Self,
+        *args: typing.Union[str, Special[Self], Path[Self]],
+        stdout: typing.Optional[Path[Self]] = None,
+        timeout: typing.Optional[float] = None,
+    ) -> str:
+        """
+        Run a command on this machine using asyncio and ensure it succeeds.
+
+        See :meth:`~tbot.machine.linux.LinuxMachine.exec_async`.
+
+        :param args: Each arg is a token that will be sent to the shell.
+        :param Path stdout: File where stdout should be directed to
+        :returns: A string containing the combined stdout and stderr of the
+            command (with a trailing newline).
+        :rtype: str
+        """
+        ret, out = await self.exec_async(*args, stdout=stdout, timeout=timeout)
+
+        if ret != 0:
+            raise machine.CommandFailedException(self, self.build_command(*args), out)
+
+        return out
+
+    def exec_many(
+        self: Self,
+        *commands: typing.Sequence[typing.Union[str, Special[Self], Path[Self]]],
+        timeout: typing.Optional[float] = None,
+    ) -> typing.List[typing.Tuple[int, str]]:
+        """
+        Run multiple commands on this machine in a single round trip.
+
+        All commands are sent at once and are run one after the other, even if
+        one of them fails.  Each command is logged separately.
+
+        **Example**::
+
+            (ret1, _), (ret2, out) = lh.exec_many(
+                ["test", "-d", repo / ".git"],
+                ["git", "-C", repo, "describe", "--tags"],
+            )
+
+        .. note::
+            The output of the commands is only available once all of them have
+            finished.  Commands should also not read from stdin.
+
+        :param commands: Each command is a sequence of arguments, like they
+            would be passed to :meth:`~tbot.machine.linux.LinuxMachine.exec`.
+        :param float timeout: Optional timeout for all commands together.
+        :rtype: list((int, str))
+        :returns: A list with the exit code and the output of each command.
+        """
+        cmds = [self.build_command(*args) for args in commands]
+
+        if tbot.log.INTERACTIVE or len(cmds) < 2:
+            # Each command needs to be confirmed before running it
+            return [self.exec(*args, timeout=timeout) for args in commands]
+
+        channel = self._obtain_channel()
+        if not all(self._is_readonly(args) for args in commands):
+            self._invalidate_caches()
+
+        # The marker is built by printf so it won't show up in the command echo
+        nonce = secrets.token_hex(8)
+        delim = f"printf 'TBOT-BATCH-%s-%d\\n' {nonce} $?"
+        script = "{\n" + "".join(f"{cmd}\n{delim}\n" for cmd in cmds) + "}"
+
+        out = channel.raw_command(script, timeout=timeout)
+        parts = re.split(f"TBOT-BATCH-{nonce}-(\\d+)\n", out)
+
+        results = []
+        for i, cmd in enumerate(cmds):
+            ret, cmd_out = int(parts[2 * i + 1]), parts[2 * i]
+            with tbot.log_event.command(self.name, cmd) as ev:
+                ev.write(cmd_out)
+                ev.data["stdout"] = cmd_out
+            results.append((ret, cmd_out))
+
+        return results
+
+    def exec0_many(
+        self: Self,
+        *commands: typing.Sequence[typing.Union[str, Special[Self], Path[Self]]],
+        timeout: typing.Optional[float] = None,
+    ) -> typing.List[str]:
+        """
+        Run multiple commands in a single round trip and ensure they succeed.
+
+        Like :meth:`~tbot.machine.linux.LinuxMachine.exec_many`, all commands
+        are run, even if one of them fails.
+
+        :param commands: Each command is a sequence of arguments, like they
+            would be passed to :meth:`~tbot.machine.linux.LinuxMachine.exec0`.
+        :param float timeout: Optional timeout for all commands together.
+        :rtype: list(str)
+        :returns: A list with the output of each command.
+        :raises CommandFailedException: For the first command that failed.
+        """
+        results = self.exec_many(*commands, timeout=timeout)
+
+        for args, (ret, out) in zip(commands, results):
+            if ret != 0:
+                raise machine.CommandFailedException(
+                    self, self.build_command(*args), out
+                )
+
+        return [out for _, out in results]
+
     def test(
         self: Self,
         *args: typing.Union[str, Special[Self], Path[Self]],
@@ -171,19 +674,199 @@ class LinuxMachine(machine.Machine, machine.InteractiveMachine):
         ret, _ = self.exec(*args, stdout=stdout, timeout=timeout)
         return ret == 0
 
+    @staticmethod
+    def _is_readonly(args: typing.Sequence[typing.Any]) -> bool:
+        return (
+            len(args) > 0
+            and args[0] in _READONLY_COMMANDS
+            and all(isinstance(arg, (str, Path, _EnvValue)) for arg in args)
+        )
+
+    def invalidate_stat_cache(self) -> None:
+        """
+        Forget all cached stat results of this machine.
+
+        This happens automatically when running commands through
+        :meth:`~tbot.machine.linux.LinuxMachine.exec` and friends.  Only call it
+        manually, if you modify files in other ways (eg. directly on the channel).
+        """
+        self._stat_entries.clear()
+
+    def _stat_lookup(
+        self: Self, path: Path[Self]
+    ) -> typing.Optional[
+        typing.Tuple[typing.Optional[os.stat_result], typing.Optional[os.stat_result]]
+    ]:
+        """Return ``(lstat, stat)`` of ``path`` or ``None`` if stat is unavailable."""
+        key = path._local_str()
+        entry = self._stat_entries.get(key)
+        if entry is None or (
+            self.stat_cache_ttl is not None
+            and time.monotonic() - entry[0] >= self.stat_cache_ttl
+        ):
+            if not self._stat_fetch([key]):
+                return None
+            entry = self._stat_entries[key]
+
+        return entry[1], entry[2]
+
+    def _stat_fetch(self, paths: typing.List[str]) -> bool:
+        # Split into chunks to stay well below the terminal's line length limit
+        chunks: typing.List[typing.List[str]] = [[]]
+        length = 0
+        for p in paths:
+            if length > 2048:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(p)
+            length += len(shlex.quote(p)) + 1
+
+        commands = []
+        for chunk in chunks:
+            commands.append(["stat", "-c", _STAT_FORMAT, "--", *chunk])
+            commands.append(["stat", "-L", "-c", _STAT_FORMAT, "--", *chunk])
+
+        results = self.exec_many(*commands)
+        if any(ret == 127 for ret, _ in results):
+            # stat is not available on this machine
+            return False
+
+        lstats: typing.Dict[str, os.stat_result] = {}
+        stats: typing.Dict[str, os.stat_result] = {}
+        for i, (_, out) in enumerate(results):
+            (lstats if i % 2 == 0 else stats).update(_parse_stat(out))
+
+        now = time.monotonic()
+        cache = self._stat_entries
+        for p in paths:
+            cache[p] = (now, lstats.get(p), stats.get(p))
+
+        return True
+
+    def stat_many(
+        self: Self, paths: typing.Iterable[Path[Self]]
+    ) -> typing.List[typing.Optional[os.stat_result]]:
+        """
+        Stat many paths at once.
+
+        All paths that are not already cached are queried in a single round
+        trip.  Afterwards, predicates like :meth:`~tbot.machine.linux.Path.is_file`
+        of those paths are answered from the cache.
+
+        **Example**::
+
+            files = [build_dir / name for name in ["u-boot.bin", "u-boot.img"]]
+            missing = [p for p, st in zip(files, lh.stat_many(files)) if st is None]
+
+        :param paths: Paths that are associated with this host.
+        :rtype: list(os.stat_result, None)
+        :returns: For each path, the result like :meth:`~tbot.machine.linux.Path.stat`
+            would return it, or ``None`` if it does not exist.
+        """
+        keys = []
+        for p in paths:
+            if p.host is not self:
+                raise machine.WrongHostException(self, p)
+            keys.append(p._local_str())
+
+        cache = self._stat_entries
+        now = time.monotonic()
+        missing = [
+            k
+            for k in keys
+            if k not in cache
+            or (
+                self.stat_cache_ttl is not None
+                and now - cache[k][0] >= self.stat_cache_ttl
+            )
+        ]
+        if missing != [] and not self._stat_fetch(missing):
+            raise RuntimeError(f"{self!r} does not support stat")
+
+        return [self._stat_entries[k][1] for k in keys]
+
     def env(self, var: str) -> str:
         """
         Get the value of an environment variable.
 
+        The value is cached until a command is run which could change it
+        (like ``export``) or a subshell is entered or left.
+
         :param str var: The variable's name
         :rtype: str
         :returns: Value of the environment variable
         """
-        return self.exec0("printf", "%s", Raw(f'"${{{var}}}"'))
+        if var not in self._env_values:
+            self._env_values[var] = self.exec0("printf", "%s", _EnvValue(var))
+        return self._env_values[var]
+
+    def _invalidate_caches(self) -> None:
+        # A command that could modify files or set variables was run
+        self.invalidate_stat_cache()
+        self._env_values.clear()
+
+    @property
+    def facts(self) -> HostFacts:
+        """
+        Facts about this host.
+
+        All facts are gathered with a single command when they are first
+        accessed and are kept until a subshell is entered or left.  If
+        gathering one of them fails, only that fact is ``None``.  This also
+        fills the cache of :meth:`~tbot.machine.linux.LinuxMachine.env` for
+        ``HOME`` and ``PATH``.
+
+        **Example**::
+
+            bh.exec0("make", "-j", str(bh.facts.nproc))
+
+        :rtype: HostFacts
+        """
+        if self._facts is None:
+            workdir = self.workdir
+            results = self.exec_many(
+                ["printf", "%s", _EnvValue("HOME")],
+                ["printf", "%s", _EnvValue("PATH")],
+                ["nproc", "--all"],
+                ["uname", "-sr"],
+                ["uname", "-m"],
+                ["df", "-Pk", workdir],
+            )
+            home, path, nproc, uname, arch, df = [
+                out if ret == 0 else None for ret, out in results
+            ]
+            self._facts = HostFacts(
+                home=home,
+                path=path,
+                nproc=_parse_fact(nproc, int),
+                uname=_parse_fact(uname, str.strip),
+                arch=_parse_fact(arch, str.strip),
+                disk_free=_parse_fact(
+                    df, lambda out: int(out.strip().split("\n")[-1].split()[3]) * 1024
+                ),
+            )
+            if home is not None:
+                self._env_values["HOME"] = home
+            if path is not None:
+                self._env_values["PATH"] = path
+        return self._facts
+
+    def invalidate_facts(self) -> None:
+        """
+        Forget all cached facts and environment variables of this machine.
+
+        This happens automatically when entering or leaving a subshell.  Cached
+        environment variables are also forgotten whenever a command is run
+        that could modify them.  Only call it manually, if you change the
+        environment in other ways (eg. directly on the channel).
+        """
+        self._facts = None
+        self._invalidate_caches()
 
     def interactive(self) -> None:
         """Drop into an interactive session on this machine."""
         channel = self._obtain_channel()
+        self.invalidate_facts()
 
         # Generate the endstring instead of having it as a constant
         # so opening this files won't trigger an exit
@@ -277,9 +960,19 @@ class _SubshellContext(typing.ContextManager):
     def __enter__(self) -> None:
         cmd = self.cmd or self.sh.name
         tbot.log_event.command(self.h.name, cmd)
+        # The parent shell's prompt is back after exiting, so it has to be set
+        # before starting the subshell
+        self.ch._lazy_initialize()
+        self.prompt_retval = self.ch._prompt_retval
         self.ch.send(f"{cmd}\n")
         self.ch.initialize(sh=self.sh)
+        # Let the machine know commands have to go through this shell
+        self.h._subshells += 1
+        self.h.invalidate_facts()
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:  # type: ignore
+        self.h._subshells -= 1
         self.ch.send("exit\n")
         self.ch.read_until_prompt(channel.TBOT_PROMPT)
+        self.ch._prompt_retval = self.prompt_retval
+        self.h.invalidate_facts()
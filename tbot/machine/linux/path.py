@@ -16,6 +16,7 @@
 
 import os
 import errno
+import stat
 import typing
 import pathlib
 from tbot.machine import linux  # noqa: F401
@@ -76,60 +77,58 @@ class Path(pathlib.PurePosixPath, typing.Generic[H]):
         Return the result of ``stat`` on this path.
 
         Tries to imitate the results of :meth:`pathlib.Path.stat`, returns a
-        :class:`os.stat_result`.
+        :class:`os.stat_result`.  Like the ``stat`` command, symlinks are not
+        followed.
+
+        The result is cached by the host, see
+        :attr:`~tbot.machine.linux.LinuxMachine.stat_cache_ttl`.
         """
-        ec, stat_str = self.host.exec("stat", "-t", self)
-        if ec != 0:
+        res = self.host._stat_lookup(self)
+        if res is None or res[0] is None:
             raise OSError(errno.ENOENT, f"Can't stat {self}")
 
-        stat_res = stat_str[len(self._local_str()) + 1 :].split(" ")
-
-        return os.stat_result(
-            (
-                int(stat_res[2], 16),
-                int(stat_res[6]),
-                0,
-                int(stat_res[7]),
-                int(stat_res[3]),
-                int(stat_res[4]),
-                int(stat_res[0]),
-                int(stat_res[10]),
-                int(stat_res[11]),
-                int(stat_res[12]),
-            )
-        )
+        return res[0]
+
+    def _check(self, flag: str, check: typing.Callable[[int], bool]) -> bool:
+        res = self.host._stat_lookup(self)
+        if res is None:
+            # No stat on the host, fall back to test
+            return self.host.test("test", flag, self)
+
+        st = res[0] if flag == "-h" else res[1]
+        return st is not None and check(st.st_mode)
 
     def exists(self) -> bool:
         """Whether this path exists."""
-        return self.host.test("test", "-e", self)
+        return self._check("-e", lambda _: True)
 
     def is_dir(self) -> bool:
         """Whether this path points to a directory."""
-        return self.host.test("test", "-d", self)
+        return self._check("-d", stat.S_ISDIR)
 
     def is_file(self) -> bool:
         """Whether this path points to a normal file."""
-        return self.host.test("test", "-f", self)
+        return self._check("-f", stat.S_ISREG)
 
     def is_symlink(self) -> bool:
         """Whether this path points to a symlink."""
-        return self.host.test("test", "-h", self)
+        return self._check("-h", stat.S_ISLNK)
 
     def is_block_device(self) -> bool:
         """Whether this path points to a block device."""
-        return self.host.test("test", "-b", self)
+        return self._check("-b", stat.S_ISBLK)
 
     def is_char_device(self) -> bool:
         """Whether this path points to a character device."""
-        return self.host.test("test", "-c", self)
+        return self._check("-c", stat.S_ISCHR)
 
     def is_fifo(self) -> bool:
         """Whether this path points to a pipe(fifo)."""
-        return self.host.test("test", "-p", self)
+        return self._check("-p", stat.S_ISFIFO)
 
     def is_socket(self) -> bool:
         """Whether this path points to a unix domain-socket."""
-        return self.host.test("test", "-S", self)
+        return self._check("-S", stat.S_ISSOCK)
 
     @property
     def parent(self) -> "Path[H]":
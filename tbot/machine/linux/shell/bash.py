@@ -13,7 +13,13 @@ class Bash(shell.Shell):
 
     @staticmethod
     def set_prompt(prompt: str) -> str:  # noqa: D102
-        return f"PROMPT_COMMAND=''\nPS1='{prompt}'"
+        return f"PROMPT_COMMAND=''; PS1='{prompt}'"
+
+    @staticmethod
+    def set_prompt_retval(
+        prompt: str, marker: str
+    ) -> typing.Optional[str]:  # noqa: D102
+        return f"PROMPT_COMMAND=''; PS1='{marker}$?{prompt}'"
 
     @staticmethod
     def disable_editing() -> typing.Optional[str]:  # noqa: D102
@@ -24,6 +24,21 @@ class Shell:
         """
         return f"PS1='{prompt}'"
 
+    @staticmethod
+    def set_prompt_retval(prompt: str, marker: str) -> typing.Optional[str]:
+        """
+        Set a prompt that also shows the exit code of the previous command.
+
+        The prompt must consist of ``marker``, the exit code, and ``prompt``,
+        in this order and without anything in between.
+
+        :param str prompt: The new ``PS1``, after the exit code
+        :param str marker: Marker that is printed before the exit code
+        :rtype: str, None
+        :returns: The command to set this prompt if this shell supports it.
+        """
+        pass
+
     @staticmethod
     def set_prompt2(prompt: str) -> typing.Optional[str]:
         """
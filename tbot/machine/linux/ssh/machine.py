@@ -15,8 +15,10 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import abc
+import hashlib
 import typing
 import pathlib
+import tbot
 from tbot import log_event
 from tbot.machine import channel
 from tbot.machine import linux
@@ -96,11 +98,72 @@ class SSHMachine(linux.LinuxMachine):
         """
         return []
 
+    @property
+    def multiplexing(self) -> bool:
+        """
+        Share one SSH connection for all shells and copies to this machine.
+
+        If enabled, the first connection becomes an OpenSSH ``ControlMaster``
+        with its socket in the lab-host's workdir.  Further connections to the
+        same host, eg. by other instances of this machine or by
+        :func:`tbot.tc.shell.copy`, reuse it instead of doing a new handshake.
+        The master is stopped once the last machine using it is destroyed.
+
+        :rtype: bool
+        """
+        return True
+
+    def _control_path(self) -> str:
+        # Connections with different credentials or options must not share a
+        # master.  Unix socket paths are limited to ~100 chars, so use a short
+        # hash of everything instead.
+        authenticator = self.authenticator
+        if isinstance(authenticator, auth.PasswordAuthenticator):
+            secret = authenticator.password
+        elif isinstance(authenticator, auth.PrivateKeyAuthenticator):
+            secret = str(authenticator.key)
+        else:
+            secret = ""
+        ident = "\n".join(
+            [
+                f"{self.username}@{self.hostname}:{self.port}",
+                authenticator.__class__.__name__,
+                secret,
+                str(self.ignore_hostkey),
+                *self.ssh_config,
+            ]
+        )
+        name = hashlib.sha1(ident.encode("utf-8")).hexdigest()[:16]
+        return (self.labhost.workdir / ".ssh-mux" / name)._local_str()
+
+    def _mux_config(self) -> typing.List[str]:
+        """Return ssh config options to use the shared connection, if enabled."""
+        if not self.multiplexing:
+            return []
+
+        return [
+            "ControlMaster=auto",
+            f"ControlPath={self._control_path()}",
+            # Safety net, in case tbot dies before stopping the master
+            "ControlPersist=60",
+        ]
+
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} {self.username}@{self.hostname}:{self.port} (Lab: {self.labhost!r}>"
 
     def _connect(self) -> channel.Channel:
+        if self.multiplexing:
+            self.labhost.exec0(
+                "mkdir", "-p", "-m", "700", self.labhost.workdir / ".ssh-mux"
+            )
+            # The lab-host counts the machines using each master
+            path = self._control_path()
+            users = self.labhost._mux_users
+            users[path] = users.get(path, 0) + 1
+
         chan = self.labhost.new_channel()
+        # The command is read back below, so the shell needs to be ready
+        chan._lazy_initialize()
 
         hk_disable = ["-o", "StrictHostKeyChecking=no"] if self.ignore_hostkey else []
 
@@ -118,6 +181,7 @@ class SSHMachine(linux.LinuxMachine):
             *hk_disable,
             *["-p", str(self.port)],
             *[arg for opt in self.ssh_config for arg in ["-o", opt]],
+            *[arg for opt in self._mux_config() for arg in ["-o", opt]],
             f"{self.username}@{self.hostname}",
         )
 
@@ -164,3 +228,27 @@ class SSHMachine(linux.LinuxMachine):
     def destroy(self) -> None:
         """Destory this SSHMachine instance."""
         self.channel.close()
+
+        if self.multiplexing:
+            path = self._control_path()
+            users = self.labhost._mux_users
+            users[path] -= 1
+            if users[path] == 0:
+                del users[path]
+                try:
+                    # Stop the master, the lab-host might already be gone
+                    ret, out = self.labhost.exec(
+                        "ssh",
+                        "-o",
+                        f"ControlPath={path}",
+                        "-O",
+                        "exit",
+                        f"{self.username}@{self.hostname}",
+                    )
+                    if ret != 0 and linux.Path(self.labhost, path).exists():
+                        tbot.log.warning(
+                            "Could not stop the SSH master for "
+                            f"{self.username}@{self.hostname}: {out.strip()}"
+                        )
+                except channel.ChannelClosedException:
+                    pass
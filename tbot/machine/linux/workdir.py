@@ -81,10 +81,8 @@ class Workdir:
         :rtype: linux.Path
         :returns: A tbot-path to the workdir
         """
-        home = host.exec0("echo", linux.Env("HOME")).strip("\n")
-        p = linux.Path(host, home) / subdir
-
         if not hasattr(host, "_wd_path"):
+            p = linux.Path(host, host.env("HOME")) / subdir
             if not p.is_dir():
                 host.exec0("mkdir", "-p", p)
 
@@ -14,12 +14,185 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import atexit
+import io
 import sys
+import time
+import typing
 import pathlib
 import argparse
 from tbot import __about__
 
 
+_LOG_SUFFIXES = {None: ".json", "gzip": ".json.gz", "zstd": ".json.zst"}
+_INDEX_SUFFIX = ".idx"
+
+
+def _default_logfile(
+    lab: typing.Optional[str],
+    board: typing.Optional[str],
+    compress: typing.Optional[str] = None,
+) -> str:
+    logdir = pathlib.Path.cwd() / "log"
+    logdir.mkdir(exist_ok=True)
+
+    lab_name = "none" if lab is None else pathlib.Path(lab).stem
+    board_name = "none" if board is None else pathlib.Path(board).stem
+    suffix = _LOG_SUFFIXES[compress]
+
+    prefix = f"{lab_name}-{board_name}"
+    new_num = (
+        sum(
+            1
+            for p in logdir.glob(f"{prefix}-*.json*")
+            if p.name.endswith(tuple(_LOG_SUFFIXES.values()))
+        )
+        + 1
+    )
+    logfile = logdir / f"{prefix}-{new_num:04}{suffix}"
+    # Ensure logfile will not overwrite another one
+    while logfile.exists():
+        new_num += 1
+        logfile = logdir / f"{prefix}-{new_num:04}{suffix}"
+
+    return str(logfile)
+
+
+def _split_logfile(filename: str) -> typing.Tuple[str, str]:
+    """Split the name of a log into its stem and log suffix (eg. ``.json.gz``)."""
+    for suffix in sorted(_LOG_SUFFIXES.values(), key=len, reverse=True):
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)], suffix
+    path = pathlib.Path(filename)
+    return str(path.with_suffix("")), path.suffix
+
+
+def _open_logfile(filename: str, compress: typing.Optional[str]) -> typing.TextIO:
+    """Open the json log for writing, optionally through a streaming compressor."""
+    if compress == "gzip":
+        import gzip
+
+        return gzip.open(filename, "wt", compresslevel=6, encoding="utf-8")
+    elif compress == "zstd":
+        import zstandard
+
+        writer = zstandard.ZstdCompressor().stream_writer(open(filename, "wb"))
+        return io.TextIOWrapper(writer, encoding="utf-8")
+
+    return open(filename, "w")
+
+
+def _close_logfile() -> None:
+    """Write outstanding events and close the log, finishing a compressed stream."""
+    from tbot import log
+
+    log.flush_logfile()
+    if log.LOGFILE is not None:
+        log.LOGFILE.close()
+    if log.LOGINDEX is not None:
+        log.LOGINDEX.close()
+
+
+def _run_board(args: argparse.Namespace) -> typing.Tuple[int, float]:
+    """Run the testcases for a single board, in a worker process."""
+    # Output of parallel runs would be interleaved, so each board gets its own
+    # file next to the json log
+    out = open(_split_logfile(args.log)[0] + ".txt", "w")
+    sys.stdout = sys.stderr = out
+    start = time.monotonic()
+    code = 0
+    try:
+        _main(args)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    finally:
+        _close_logfile()
+        out.flush()
+    return code, time.monotonic() - start
+
+
+def _board_process(args: argparse.Namespace, conn: typing.Any) -> None:
+    """Run a board in a fresh worker process and send back its result."""
+    conn.send(_run_board(args))
+    conn.close()
+
+
+def _run_parallel(args: argparse.Namespace) -> None:
+    """Run the testcases against multiple boards in parallel."""
+    import copy
+    import multiprocessing
+    import multiprocessing.connection
+    from tbot import log
+
+    runs = []
+    for board in args.board:
+        board_args = copy.copy(args)
+        board_args.board = [board]
+        if args.log:
+            stem, suffix = _split_logfile(args.log)
+            board_args.log = f"{stem}-{pathlib.Path(board).stem}{suffix}"
+        else:
+            board_args.log = _default_logfile(args.lab, board, args.log_compress)
+        # Reserve the logfile name before the next one is chosen
+        open(board_args.log, "w").close()
+        runs.append(board_args)
+
+    print(
+        log.c("tbot").yellow.bold + f" starting {len(runs)} board runs in parallel ..."
+    )
+
+    start = time.monotonic()
+    results: typing.Dict[str, typing.Tuple[int, float]] = {}
+    # Each board gets a fresh process, so no module state (like the selected
+    # machines) carries over from one board to the next
+    pending = list(runs)
+    running: typing.Dict[
+        typing.Any, typing.Tuple[typing.Any, typing.Any, argparse.Namespace]
+    ] = {}
+    while pending or running:
+        while pending and len(running) < (args.jobs or len(runs)):
+            run = pending.pop(0)
+            recv, send = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=_board_process, args=(run, send))
+            proc.start()
+            send.close()
+            running[proc.sentinel] = (proc, recv, run)
+
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            proc, recv, run = running.pop(sentinel)
+            try:
+                results[run.log] = recv.recv()
+            except EOFError:
+                # The worker process died
+                results[run.log] = (1, 0.0)
+            recv.close()
+            proc.join()
+
+            name = pathlib.Path(run.board[0]).stem
+            result = (
+                log.c("SUCCESS").green.bold
+                if results[run.log][0] == 0
+                else log.c("FAILURE").red.bold
+            )
+            print(f"{name}: {result} ({results[run.log][1]:.3f}s)", flush=True)
+
+    failed = [run for run in runs if results[run.log][0] != 0]
+    print(log.c("\nSummary").bold + ":")
+    width = max(len(pathlib.Path(run.board[0]).stem) for run in runs)
+    for run in runs:
+        code, duration = results[run.log]
+        result = log.c("SUCCESS").green if code == 0 else log.c("FAILURE").red
+        name = pathlib.Path(run.board[0]).stem.ljust(width)
+        print(f"  {name}  {result}  {duration:8.3f}s  {run.log}")
+
+    summary = f"{len(runs) - len(failed)}/{len(runs)} boards succeeded"
+    duration = time.monotonic() - start
+    if failed:
+        print(log.c(summary).red.bold + f" ({duration:.3f}s)")
+        sys.exit(1)
+    print(log.c(summary).green.bold + f" ({duration:.3f}s)")
+
+
 def main() -> None:  # noqa: C901
     """Tbot main entry point."""
     parser = argparse.ArgumentParser(
@@ -28,7 +201,14 @@ def main() -> None:  # noqa: C901
 
     parser.add_argument("testcase", nargs="*", help="testcase that should be run.")
 
-    parser.add_argument("-b", "--board", help="use this board instead of the default.")
+    parser.add_argument(
+        "-b",
+        "--board",
+        action="append",
+        default=[],
+        help="use this board instead of the default.  Can be given multiple times to "
+        "run the testcases against each board in parallel.",
+    )
 
     parser.add_argument("-l", "--lab", help="use this lab instead of the default.")
 
@@ -75,6 +255,38 @@ def main() -> None:  # noqa: C901
         "--log", metavar="LOGFILE", help="Alternative location for the json log file"
     )
 
+    parser.add_argument(
+        "--log-format",
+        choices=["json", "ndjson"],
+        default="json",
+        help="format of the log file.  ndjson writes one compact event per line "
+        "in the background (default: json).",
+    )
+
+    parser.add_argument(
+        "--log-compress",
+        choices=["gzip", "zstd"],
+        default=None,
+        help="compress the log file while writing it.  zstd needs the "
+        "'zstandard' package.  Works best with --log-format ndjson, which "
+        "flushes less often.",
+    )
+
+    parser.add_argument(
+        "--log-index",
+        action="store_true",
+        help="write an index next to the log file (<logfile>.idx) that allows "
+        "generators to read single testcases without parsing the whole log.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="maximum number of boards to run in parallel (default: all).",
+    )
+
     flags = [
         (["--list-testcases"], "list all testcases in the current search path."),
         (["--list-labs"], "list all available labs."),
@@ -90,28 +302,43 @@ def main() -> None:  # noqa: C901
 
     args = parser.parse_args()
 
-    from tbot import log
+    if args.log_compress == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            parser.error("--log-compress zstd needs the 'zstandard' package")
+
+    if len(args.board) > 1:
+        only_single = [
+            args.list_testcases,
+            args.list_labs,
+            args.list_boards,
+            args.list_files,
+            args.list_flags,
+            args.show,
+            args.interactive,
+        ]
+        if any(only_single):
+            parser.error("multiple boards can only be used to run testcases")
+        _run_parallel(args)
+        return
+
+    _main(args)
 
-    # Determine LogFile
-    if args.log:
-        log.LOGFILE = open(args.log, "w")
-    else:
-        logdir = pathlib.Path.cwd() / "log"
-        logdir.mkdir(exist_ok=True)
 
-        lab_name = "none" if args.lab is None else pathlib.Path(args.lab).stem
-        board_name = "none" if args.board is None else pathlib.Path(args.board).stem
+def _main(args: argparse.Namespace) -> None:  # noqa: C901
+    from tbot import log
 
-        prefix = f"{lab_name}-{board_name}"
-        glob_pattern = f"{prefix}-*.json"
-        new_num = sum(1 for _ in logdir.glob(glob_pattern)) + 1
-        logfile = logdir / f"{prefix}-{new_num:04}.json"
-        # Ensure logfile will not overwrite another one
-        while logfile.exists():
-            new_num += 1
-            logfile = logdir / f"{prefix}-{new_num:04}.json"
+    board_file = args.board[0] if args.board != [] else None
 
-        log.LOGFILE = open(logfile, "w")
+    # Determine LogFile
+    logfile = args.log or _default_logfile(args.lab, board_file, args.log_compress)
+    log.LOGFILE = _open_logfile(logfile, args.log_compress)
+    # Sidecar index for random access to testcases in the log
+    if args.log_index and pathlib.Path(logfile).is_file():
+        log.LOGINDEX = open(logfile + _INDEX_SUFFIX, "w")
+    atexit.register(_close_logfile)
+    log.NDJSON = args.log_format == "ndjson"
 
     log.VERBOSITY = log.Verbosity(1 + args.verbosity - args.quiet)
 
@@ -189,8 +416,8 @@ def main() -> None:  # noqa: C901
         pass
 
     board = None
-    if args.board is not None:
-        board = loader.load_module(pathlib.Path(args.board).resolve())
+    if board_file is not None:
+        board = loader.load_module(pathlib.Path(board_file).resolve())
         tbot.selectable.Board = board.BOARD  # type: ignore
         if hasattr(board, "UBOOT"):
             tbot.selectable.UBootMachine = board.UBOOT  # type: ignore
@@ -200,8 +427,6 @@ def main() -> None:  # noqa: C901
         pass
 
     if args.list_flags:
-        import typing
-
         all_flags: typing.Dict[str, str] = dict()
         if lab is not None and "FLAGS" in lab.__dict__:
             all_flags.update(lab.__dict__["FLAGS"])
@@ -209,7 +434,7 @@ def main() -> None:  # noqa: C901
         if board is not None and "FLAGS" in board.__dict__:
             all_flags.update(board.__dict__["FLAGS"])
 
-        width = max(map(len, flags))
+        width = max(map(len, all_flags), default=0)
         for name, description in all_flags.items():
             log.message(log.c(name.ljust(width)).blue + ": " + description)
 
@@ -1,17 +1,79 @@
+import concurrent.futures
+import threading
+import time
 import typing
 import tbot
 import traceback
+from tbot.machine import linux
+
+
+def _run_parallel(
+    tests: typing.Sequence[typing.Callable],
+    jobs: int,
+    kwargs: typing.Dict[str, typing.Any],
+) -> typing.List[typing.Tuple[typing.Optional[str], float]]:
+    lab = kwargs.get("lab")
+    local = threading.local()
+    workers: typing.List[linux.LabHost] = []
+
+    def run(test: typing.Callable) -> typing.Tuple[typing.Optional[str], float]:
+        test_kwargs = kwargs
+        if isinstance(lab, linux.LabHost):
+            # Each worker gets its own channel, so commands of different
+            # testcases don't interfere
+            if not hasattr(local, "lab"):
+                local.lab = lab.clone()
+                workers.append(local.lab)
+            test_kwargs = dict(kwargs, lab=local.lab)
+
+        error = None
+        with tbot.log.BufferedLog() as buf:
+            start = time.monotonic()
+            try:
+                test(**test_kwargs)
+            except Exception:
+                error = traceback.format_exc()
+            duration = time.monotonic() - start
+        buf.flush()
+        return error, duration
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(run, tests))
+    finally:
+        for worker in workers:
+            worker.destroy()
 
 
 @tbot.testcase
-def testsuite(*args: typing.Callable, **kwargs: typing.Any) -> None:
+def testsuite(*args: typing.Callable, jobs: int = 1, **kwargs: typing.Any) -> None:
+    """
+    Run multiple testcases and report how many of them failed.
+
+    :param args: Testcases to run.  Each is called with ``**kwargs``.
+    :param int jobs: Number of testcases to run concurrently.  Each worker gets
+        a clone of the ``lab`` argument (if any), which uses its own channel,
+        see :meth:`~tbot.machine.linux.LabHost.clone`.  The log
+        output of each testcase is written as one block once it is done.
+        Only use this for testcases that don't interfere with each other.
+    """
     errors: typing.List[typing.Tuple[str, str]] = []
 
-    for test in args:
-        try:
-            test(**kwargs)
-        except Exception:
-            errors.append((test.__name__, traceback.format_exc()))
+    start = time.monotonic()
+    if jobs > 1 and not tbot.log.INTERACTIVE:
+        results = _run_parallel(args, jobs, kwargs)
+        for test, (error, _) in zip(args, results):
+            if error is not None:
+                errors.append((test.__name__, error))
+        test_time: typing.Optional[float] = sum(duration for _, duration in results)
+    else:
+        for test in args:
+            try:
+                test(**kwargs)
+            except Exception:
+                errors.append((test.__name__, traceback.format_exc()))
+        test_time = None
+    total_time = time.monotonic() - start
 
     with tbot.log.message(
         tbot.log.c(
@@ -21,6 +83,11 @@ def testsuite(*args: typing.Callable, **kwargs: typing.Any) -> None:
             )
         ).dark
     ) as ev:
+        if test_time is not None:
+            ev.writeln(
+                f"Ran {len(args)} tests with {jobs} workers in {total_time:.3f}s "
+                f"({test_time:.3f}s of testcase time)"
+            )
         if errors != []:
             ev.writeln(
                 tbot.log.c("Failure").red.bold
@@ -97,8 +97,7 @@ class GitRepository(linux.Path[H]):
                 self.git0("fetch")
 
             if clean and already_cloned:
-                self.reset("origin", ResetMode.HARD)
-                self.clean(untracked=True, noignore=True)
+                self._reset_clean("origin")
 
             if clean or not already_cloned:
                 if rev:
@@ -108,12 +107,26 @@ class GitRepository(linux.Path[H]):
             if not (self / ".git").exists():
                 raise RuntimeError(f"{target} is not a git repository")
             if clean:
-                self.reset("HEAD", ResetMode.HARD)
-                self.clean(untracked=True, noignore=True)
+                self._reset_clean("HEAD")
 
                 if rev:
                     self.checkout(rev)
 
+    def _reset_clean(self, rev: str) -> None:
+        # Hard reset and remove all untracked files in one round trip.  The
+        # clean only runs if the reset succeeded.
+        self.git0(
+            "reset",
+            ResetMode.HARD.value,
+            rev,
+            linux.AndThen,
+            "git",
+            "-C",
+            self,
+            "clean",
+            "-fdx",
+        )
+
     def git(
         self, *args: typing.Union[str, linux.Path[H], linux.special.Special]
     ) -> typing.Tuple[int, str]:
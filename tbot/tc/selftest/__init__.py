@@ -4,9 +4,11 @@ from tbot.machine import linux
 
 from tbot import tc
 
+from .channel import *  # noqa: F403
 from .path import *  # noqa: F403
 from .machine import *  # noqa: F403
 from .board_machine import *  # noqa: F403
+from .log import *  # noqa: F403
 from .tc import *  # noqa: F403
 
 
@@ -50,7 +52,21 @@ def selftest(lab: typing.Optional[linux.LabHost] = None,) -> None:
             selftest_machine_labhost_shell,  # noqa: F405
             selftest_machine_ssh_shell,  # noqa: F405
             selftest_machine_sshlab_shell,  # noqa: F405
+            selftest_machine_sshlab_pool,  # noqa: F405
             selftest_path_stat,  # noqa: F405
+            selftest_path_stat_cache,  # noqa: F405
+            selftest_channel_prompt,  # noqa: F405
+            selftest_channel_prompt_scaling,  # noqa: F405
+            selftest_channel_decode,  # noqa: F405
+            selftest_channel_async,  # noqa: F405
+            selftest_channel_recv,  # noqa: F405
+            selftest_channel_retval,  # noqa: F405
+            selftest_channel_lazy_init,  # noqa: F405
+            selftest_channel_expect,  # noqa: F405
+            selftest_channel_interrupt,  # noqa: F405
+            selftest_log_event_stream,  # noqa: F405
+            selftest_log_ndjson,  # noqa: F405
+            selftest_log_index,  # noqa: F405
             selftest_path_integrity,  # noqa: F405
             selftest_board_power,  # noqa: F405
             selftest_board_uboot,  # noqa: F405
@@ -60,5 +76,6 @@ def selftest(lab: typing.Optional[linux.LabHost] = None,) -> None:
             selftest_board_linux_standalone,  # noqa: F405
             selftest_board_linux_nopw,  # noqa: F405
             selftest_board_linux_bad_console,  # noqa: F405
+            selftest_board_linux_boot_error,  # noqa: F405
             lab=lh,
         )
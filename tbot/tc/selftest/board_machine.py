@@ -348,3 +348,36 @@ read -p ""\
             with BadBoardLinux(b) as lnx:
                 name = lnx.env("UNAME")
                 assert name == "bad-board", repr(name)
+
+
+@tbot.testcase
+def selftest_board_linux_boot_error(
+    lab: typing.Optional[tbot.selectable.LabHost] = None
+) -> None:
+    """Test that a boot error is detected without waiting for a timeout."""
+
+    class PanicBoard(TestBoard):
+        def connect(self) -> channel.Channel:  # noqa: D102
+            return self.lh.new_channel(
+                linux.Raw(
+                    """\
+bash --norc --noediting; exit
+echo "[1.337] Kernel pa""nic - not syncing: VFS: Unable to mount root fs"; read -p ''"""
+                )
+            )
+
+    class PanicBoardLinux(board.LinuxStandaloneMachine[PanicBoard]):
+        username = "root"
+        password = None
+        shell = linux.shell.Bash
+
+    with lab or tbot.acquire_lab() as lh:
+        with PanicBoard(lh) as b:
+            raised = False
+            try:
+                with PanicBoardLinux(b):
+                    pass
+            except tbot.machine.BootException as e:
+                assert e.message == "Kernel panic - not syncing", repr(e.message)
+                raised = True
+            assert raised, "Kernel panic was not detected"
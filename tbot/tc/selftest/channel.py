@@ -0,0 +1,393 @@
+import asyncio
+import io
+import os
+import re
+import time
+import typing
+import tbot
+from tbot.machine import channel
+from tbot.machine.channel import channel as channel_impl
+from tbot.machine import linux
+
+__all__ = (
+    "selftest_channel_prompt",
+    "selftest_channel_prompt_scaling",
+    "selftest_channel_decode",
+    "selftest_channel_async",
+    "selftest_channel_recv",
+    "selftest_channel_retval",
+    "selftest_channel_lazy_init",
+    "selftest_channel_expect",
+    "selftest_channel_interrupt",
+)
+
+
+class ReplayChannel(channel.Channel):
+    """Channel that replays a fixed sequence of chunks."""
+
+    def __init__(self, chunks: typing.Iterable[bytes]) -> None:
+        """
+        Create a new ReplayChannel.
+
+        :param chunks: Data that will be returned by consecutive ``recv`` calls.
+        """
+        self.chunks = iter(chunks)
+        self.sent: typing.List[bytes] = []
+        self.recv_count = 0
+        self._pipe: typing.Optional[typing.Tuple[int, int]] = None
+        super().__init__()
+
+    def initialize(
+        self, *, sh: typing.Type[linux.shell.Shell] = linux.shell.Bash
+    ) -> None:  # noqa: D102
+        pass
+
+    def send(self, data: typing.Union[bytes, str]) -> None:  # noqa: D102
+        self.sent.append(data if isinstance(data, bytes) else data.encode("utf-8"))
+
+    def recv(
+        self, timeout: typing.Optional[float] = None, max: typing.Optional[int] = None
+    ) -> bytes:  # noqa: D102
+        self.recv_count += 1
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            raise TimeoutError()
+
+    def close(self) -> None:  # noqa: D102
+        if self._pipe is not None:
+            os.close(self._pipe[0])
+            os.close(self._pipe[1])
+            self._pipe = None
+
+    def fileno(self) -> int:  # noqa: D102
+        # A pipe nothing is written to, the replayed data is not available
+        # through the fd.
+        if self._pipe is None:
+            self._pipe = os.pipe()
+        return self._pipe[0]
+
+    def isopen(self) -> bool:  # noqa: D102
+        return True
+
+
+@tbot.testcase
+def selftest_channel_prompt(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test prompt detection across chunk boundaries."""
+    tbot.log.message("Testing literal prompt ...")
+    ch = ReplayChannel([b"Hello\nWor", b"ld\nPRO", b"MPT> "])
+    stream = io.StringIO()
+    out = ch.read_until_prompt("PROMPT> ", stream=stream)
+    assert out == "Hello\nWorld\nPROMPT> ", repr(out)
+    assert stream.getvalue() == "Hello\nWorld\n", repr(stream.getvalue())
+
+    tbot.log.message("Testing prompt that is not at the end ...")
+    ch = ReplayChannel([b"login", b": Last login\n"])
+    out = ch.read_until_prompt("login: ", must_end=False)
+    assert out == "login: Last login\n", repr(out)
+
+    tbot.log.message("Testing regex prompt ...")
+    ch = ReplayChannel([b"U-Boot\nHit any key to stop autoboot:", b"  3 "])
+    stream = io.StringIO()
+    out = ch.read_until_prompt(
+        r"Hit any key to stop autoboot:\s+\d+\s+", regex=True, stream=stream
+    )
+    assert out == "U-Boot\nHit any key to stop autoboot:  3 ", repr(out)
+    assert stream.getvalue() == "U-Boot\n", repr(stream.getvalue())
+
+    tbot.log.message("Testing timeout ...")
+    ch = ReplayChannel([b"No prompt here\n"])
+    raised = False
+    try:
+        ch.read_until_prompt("PROMPT> ", timeout=0.1)
+    except TimeoutError:
+        raised = True
+    assert raised
+
+
+@tbot.testcase
+def selftest_channel_prompt_scaling(
+    lab: typing.Optional[linux.LabHost] = None,
+) -> None:
+    """Test that ``read_until_prompt`` only rescans a bounded window per chunk."""
+    n = 4000
+    line = ("[ 1.234567] A line of boot log output ... " * 30)[:1023] + "\n"
+    chunk = line.encode("utf-8")
+
+    scanned: typing.List[int] = []
+    prompt_matcher = channel_impl._PromptMatcher
+
+    class CountingMatcher(channel_impl._PromptMatcher):
+        def feed(self, s: str) -> typing.Optional[typing.Tuple[int, int]]:
+            # The matcher searches the carried over tail and the new text
+            scanned.append(len(self.tail) + len(s))
+            return super().feed(s)
+
+    for regex in [False, True]:
+        scanned.clear()
+        ch = ReplayChannel([chunk] * n + [b"=> "])
+        setattr(channel_impl, "_PromptMatcher", CountingMatcher)
+        try:
+            if regex:
+                ch.read_until_prompt(r"=>\s", regex=True, stream=io.StringIO())
+            else:
+                ch.read_until_prompt("=> ", stream=io.StringIO())
+        finally:
+            setattr(channel_impl, "_PromptMatcher", prompt_matcher)
+
+        rescanned = max(scanned[:-1]) - len(line)
+        tbot.log.message(
+            f"{'Regex' if regex else 'Literal'} prompt, {n} KiB: "
+            f"{sum(scanned) // 1024} KiB scanned, at most {rescanned} chars "
+            "rescanned per chunk"
+        )
+
+        assert len(scanned) == n + 1, "Chunks were not fed one by one"
+        # A matcher that rescans the whole buffer would search n KiB at the end
+        assert rescanned <= (1024 if regex else len("=> ")), repr(rescanned)
+        assert sum(scanned) < (n + 1) * (len(line) + 1024), repr(sum(scanned))
+
+
+@tbot.testcase
+def selftest_channel_decode(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test decoding of multibyte sequences that are split between reads."""
+    tbot.log.message("Testing byte-at-a-time input ...")
+    data = "Grüße, 世界 🙂\r\nPROMPT> ".encode("utf-8")
+    ch = ReplayChannel(data[i : i + 1] for i in range(len(data)))
+    stream = io.StringIO()
+    out = ch.read_until_prompt("PROMPT> ", stream=stream)
+    assert out == "Grüße, 世界 🙂\nPROMPT> ", repr(out)
+    assert stream.getvalue() == "Grüße, 世界 🙂\n", repr(stream.getvalue())
+    assert ch.recv_count == len(data), "Data was read more than once"
+
+    tbot.log.message("Testing invalid input ...")
+    ch = ReplayChannel([b"\xffabc\xc3", b"\xa4\n=> "])
+    out = ch.read_until_prompt("=> ")
+    assert out == "\ufffdabcä\n=> ", repr(out)
+
+
+@tbot.testcase
+def selftest_channel_async(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test driving multiple channels concurrently using asyncio."""
+
+    async def run_all(lh: linux.LabHost) -> None:
+        tbot.log.message("Testing concurrent channels ...")
+        chans = await asyncio.gather(
+            *[channel.AsyncSubprocessChannel.create() for _ in range(4)]
+        )
+        try:
+            start = time.monotonic()
+            results = await asyncio.gather(
+                *[
+                    ch.raw_command_with_retval(f"sleep 0.5; echo {i}; false")
+                    for i, ch in enumerate(chans)
+                ]
+            )
+            duration = time.monotonic() - start
+        finally:
+            for ch in chans:
+                ch.close()
+
+        assert results == [(1, f"{i}\n") for i in range(4)], repr(results)
+        assert duration < 1.5, f"Commands did not run concurrently ({duration}s)"
+
+        tbot.log.message("Testing concurrent commands with a separate exit code ...")
+        ch = await channel.AsyncSubprocessChannel.create()
+        try:
+            # Ash does not put the exit code into the prompt
+            await ch.initialize(sh=linux.shell.Ash)
+            results = await asyncio.gather(
+                *[
+                    ch.raw_command_with_retval(f"sleep 0.1; sh -c 'exit {i}'")
+                    for i in range(4)
+                ]
+            )
+        finally:
+            ch.close()
+
+        assert results == [(i, "") for i in range(4)], repr(results)
+
+        tbot.log.message("Testing exec_async ...")
+        ret, out = await lh.exec_async("sh", "-c", "echo Hello; exit 3")
+        assert (ret, out) == (3, "Hello\n"), repr((ret, out))
+        outs = await asyncio.gather(
+            lh.exec0_async("echo", "foo"), lh.exec0_async("echo", "bar")
+        )
+        assert outs == ["foo\n", "bar\n"], repr(outs)
+
+        tbot.log.message("Testing recovery from a timeout ...")
+        ch = await channel.AsyncSubprocessChannel.create()
+        try:
+            raised = False
+            try:
+                await ch.raw_command("echo stuck; cat", timeout=0.5)
+            except TimeoutError:
+                raised = True
+            assert raised, "Command did not time out"
+            out = await ch.raw_command("echo alive")
+            assert out == "alive\n", repr(out)
+        finally:
+            ch.close()
+
+    with lab or tbot.acquire_lab() as lh:
+        if not isinstance(lh, linux.lab.LocalLabHost):
+            tbot.log.message("Skip async tests.")
+            return
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run_all(lh))
+        finally:
+            loop.close()
+
+
+@tbot.testcase
+def selftest_channel_recv(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test receiving data into a buffer."""
+    tbot.log.message("Testing recv_n across chunks ...")
+    ch = ReplayChannel([b"Hel", b"lo W", b"orld"])
+    data = ch.recv_n(11)
+    assert data == b"Hello World", repr(data)
+
+    with lab or tbot.acquire_lab() as lh:
+        tbot.log.message("Testing recv_into on the lab-host ...")
+        lh_ch = lh._obtain_channel()
+        # Make sure the shell is initialized before sending raw data
+        lh_ch.raw_command("true")
+        buf = bytearray(4)
+        lh_ch.send("echo Foo Bar\n")
+        n = lh_ch.recv_into(buf, timeout=1.0)
+        assert 0 < n <= 4 and buf[:n] == b"echo"[:n], repr(buf[:n])
+        lh_ch.read_until_prompt(channel.TBOT_PROMPT)
+
+        tbot.log.message("Testing large output ...")
+        start = time.monotonic()
+        out = lh.exec0("seq", "200000")
+        tbot.log.message(
+            f"Received {len(out) / 1024:.0f} KiB in {time.monotonic() - start:.2f}s"
+        )
+        assert out.count("\n") == 200000, "Lines went missing"
+        assert out.endswith("\n199999\n200000\n"), repr(out[-20:])
+
+
+@tbot.testcase
+def selftest_channel_retval(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test reading the exit code from the prompt."""
+    prompt = (channel.TBOT_RETVAL + "{}" + channel.TBOT_PROMPT).encode("utf-8")
+
+    tbot.log.message("Testing exit code in prompt ...")
+    ch = ReplayChannel([b"printf foo\n", b"foo", prompt.replace(b"{}", b"1")])
+    ch._prompt_retval = True
+    stream = io.StringIO()
+    ret, out = ch.raw_command_with_retval("printf foo", stream=stream)
+    assert (ret, out) == (1, "foo"), repr((ret, out))
+    assert stream.getvalue() == "foo", repr(stream.getvalue())
+    assert ch.sent == [b"printf foo\n"], "Exit code was queried separately"
+
+    tbot.log.message("Testing exit code with separate query ...")
+    ch = ReplayChannel([b"echo foo\nfoo\n=> ", b"echo $?\n", b"0\n=> "])
+    ret, out = ch.raw_command_with_retval("echo foo", prompt="=> ")
+    assert (ret, out) == (0, "foo\n"), repr((ret, out))
+    assert ch.sent == [b"echo foo\n", b"echo $?\n"], repr(ch.sent)
+
+    with lab or tbot.acquire_lab() as lh:
+        tbot.log.message("Testing exit code on the lab-host ...")
+        assert lh.exec("sh", "-c", "exit 42") == (42, "")
+        out = lh.exec0("echo", channel.TBOT_RETVAL)
+        assert out == channel.TBOT_RETVAL + "\n", repr(out)
+
+        with lh.subshell("sh"):
+            ret, _ = lh.exec("false")
+            assert ret == 1, repr(ret)
+        assert lh.test("true")
+
+
+@tbot.testcase
+def selftest_channel_lazy_init(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test that channels are initialized on demand, in a single round trip."""
+    from tbot.machine.channel import subprocess
+
+    class CountingChannel(subprocess.SubprocessChannel):
+        def __init__(self) -> None:
+            self.sent: typing.List[bytes] = []
+            super().__init__()
+
+        def send(self, data: typing.Union[bytes, str]) -> None:  # noqa: D102
+            self.sent.append(data if isinstance(data, bytes) else data.encode("utf-8"))
+            super().send(data)
+
+    ch = CountingChannel()
+    try:
+        assert ch.sent == [], "Channel was initialized eagerly"
+
+        out = ch.raw_command("echo Hello World", timeout=5.0)
+        assert out == "Hello World\n", repr(out)
+        assert len(ch.sent) == 2, f"Initialization took {len(ch.sent) - 1} commands"
+
+        ret, out = ch.raw_command_with_retval("false", timeout=5.0)
+        assert ret == 1, repr(ret)
+        assert len(ch.sent) == 3, "Channel was initialized twice"
+    finally:
+        ch.close()
+
+
+@tbot.testcase
+def selftest_channel_expect(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test waiting for one of multiple patterns."""
+    tbot.log.message("Testing literals across chunks ...")
+    ch = ReplayChannel([b"Booting ...\nKernel pa", b"nic - not syncing\nlogin: "])
+    stream = io.StringIO()
+    m = ch.expect(["login: ", "Kernel panic"], stream=stream)
+    assert m.i == 1 and m.pattern == "Kernel panic", repr(m)
+    assert m.text == "Kernel panic", repr(m.text)
+    assert m.before == "Booting ...\n", repr(m.before)
+    assert stream.getvalue().startswith("Booting ...\nKernel panic")
+
+    tbot.log.message("Testing the earliest match wins ...")
+    ch = ReplayChannel([b"abc: x login: "])
+    m = ch.expect(["login: ", re.compile(r"\w+: ")])
+    assert (m.i, m.start, m.end) == (1, 0, 5), repr(m)
+
+    tbot.log.message("Testing list order wins for the same position ...")
+    ch = ReplayChannel([b"xx login: "])
+    m = ch.expect(["login", "login: "])
+    assert (m.i, m.start) == (0, 3), repr(m)
+
+    tbot.log.message("Testing anchored regex ...")
+    ch = ReplayChannel([b"Autoboot: 3 \nmore\n", b"Autoboot: 2 "])
+    m = ch.expect([re.compile(r"Autoboot: \d $"), "Error"])
+    assert m.i == 0 and m.start == len("Autoboot: 3 \nmore\n"), repr(m)
+
+    tbot.log.message("Testing timeout ...")
+    ch = ReplayChannel([b"Nothing to see here\n"])
+    raised = False
+    try:
+        ch.expect(["login: ", "panic"], timeout=0.1)
+    except TimeoutError:
+        raised = True
+    assert raised
+
+
+@tbot.testcase
+def selftest_channel_interrupt(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test that a channel is usable again after a command timed out."""
+    with lab or tbot.acquire_lab() as lh:
+        ch = lh.new_channel()
+        try:
+            for cmd in ["sleep 30", "echo stuck; cat", "printf 'no newline'; sleep 30"]:
+                tbot.log.message(f"Testing {cmd!r} ...")
+                start = time.monotonic()
+                raised = False
+                try:
+                    ch.raw_command(cmd, timeout=0.5)
+                except TimeoutError:
+                    raised = True
+                assert raised, "Command did not time out"
+                assert time.monotonic() - start < 5, "Recovery took too long"
+
+                out = ch.raw_command("echo alive")
+                assert out == "alive\n", repr(out)
+                retval, out = ch.raw_command_with_retval("false")
+                assert (retval, out) == (1, ""), repr((retval, out))
+        finally:
+            ch.close()
@@ -0,0 +1,155 @@
+import contextlib
+import io
+import json
+import typing
+import tbot
+from tbot.machine import linux
+
+__all__ = ("selftest_log_event_stream", "selftest_log_ndjson", "selftest_log_index")
+
+
+@tbot.testcase
+def selftest_log_event_stream(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test streaming output into a log event."""
+    old_file = tbot.log.LOGFILE
+    tbot.log.flush_logfile()
+
+    # Keep the test events out of the real log, generators don't know them
+    f = io.StringIO()
+    try:
+        tbot.log.LOGFILE = f
+        tbot.log.message("Testing line splitting ...")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            with tbot.log.EventIO(
+                ["selftest", "stream"], "Header", verbosity=tbot.log.Verbosity.QUIET
+            ) as ev:
+                for i in range(100):
+                    ev.write(f"line {i}")
+                    ev.write("\nnext " if i % 2 == 0 else "\n")
+                ev.write("unterminated")
+                value = ev.getvalue()
+
+        lines = out.getvalue().split("\n")
+        assert lines[0].endswith("Header"), repr(lines[0])
+        assert lines[1].endswith("line 0"), repr(lines[1])
+        assert lines[2].endswith("next line 1"), repr(lines[2])
+        assert lines[-2].endswith("unterminated"), repr(lines[-2])
+        assert len(lines) == 103, repr(lines)
+        assert value.startswith("Header\nline 0\nnext line 1\n"), repr(value[:40])
+        assert value.endswith("line 99\nunterminated"), repr(value[-40:])
+
+        tbot.log.message("Testing spilling to a file ...")
+        with tbot.log.EventIO(
+            ["selftest", "stream"], verbosity=tbot.log.Verbosity.CHANNEL
+        ) as ev:
+            ev.spool_size = 1000
+            for i in range(1000):
+                ev.writeln(f"line {i}")
+            assert ev._spill is not None, "Event was not spilled"
+            assert ev.tell() == 0, "Event kept its text in memory"
+
+            value = ev.getvalue()
+            assert value == "".join(f"line {i}\n" for i in range(1000)), "Text differs"
+            # Writing continues after reading back the text
+            ev.write("more")
+            assert ev.getvalue() == value + "more"
+
+        tbot.log.message("Testing long lines ...")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            with tbot.log.EventIO(
+                ["selftest", "stream"], verbosity=tbot.log.Verbosity.QUIET
+            ) as ev:
+                for _ in range(10):
+                    ev.write("x" * (ev.max_line // 4))
+                assert len(ev._pending) <= ev.max_line, "Partial line grew unbounded"
+        assert out.getvalue().count("x") == 10 * (ev.max_line // 4), "Output was lost"
+
+        tbot.log.message("Testing nested buffers ...")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            with tbot.log.BufferedLog() as outer:
+                tbot.log.message("outer-1")
+                with tbot.log.BufferedLog() as inner:
+                    tbot.log.message("inner")
+                inner.flush()
+                tbot.log.message("outer-2")
+            assert out.getvalue() == "", "Output was not held back"
+            outer.flush()
+        lines = out.getvalue().split("\n")
+        assert len(lines) == 4, repr(lines)
+        assert lines[0].endswith("outer-1"), repr(lines)
+        assert lines[1].endswith("inner"), repr(lines)
+        assert lines[2].endswith("outer-2"), repr(lines)
+
+        tbot.log.flush_logfile()
+    finally:
+        tbot.log.LOGFILE = old_file
+
+    assert f.getvalue().count('"stream"') == 3, "Events were not logged"
+
+
+@tbot.testcase
+def selftest_log_ndjson(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test writing the logfile in the background as newline-delimited json."""
+    old_file, old_ndjson = tbot.log.LOGFILE, tbot.log.NDJSON
+    tbot.log.flush_logfile()
+
+    f = io.StringIO()
+    try:
+        tbot.log.LOGFILE, tbot.log.NDJSON = f, True
+        for i in range(100):
+            tbot.log.EventIO(
+                ["selftest", "ndjson"], verbosity=tbot.log.Verbosity.CHANNEL, num=i
+            ).close()
+        tbot.log.flush_logfile()
+    finally:
+        tbot.log.LOGFILE, tbot.log.NDJSON = old_file, old_ndjson
+
+    lines = f.getvalue().split("\n")
+    assert lines[-1] == "", "Last event is not terminated"
+    events = [json.loads(line) for line in lines[:-1]]
+    assert [ev["data"]["num"] for ev in events] == list(range(100)), "Events differ"
+    assert all(ev["type"] == ["selftest", "ndjson"] for ev in events)
+
+
+@tbot.testcase
+def selftest_log_index(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test the offsets in the log index."""
+    saved = (tbot.log.LOGFILE, tbot.log.LOGINDEX, tbot.log._INDEX)
+    tbot.log.flush_logfile()
+
+    f = io.StringIO()
+    index = io.StringIO()
+    try:
+        tbot.log.LOGFILE, tbot.log.LOGINDEX = f, index
+        tbot.log_event.testcase_begin("outer")
+        for i in range(5):
+            tbot.log.EventIO(
+                ["selftest", "index"], verbosity=tbot.log.Verbosity.CHANNEL, num=i
+            ).close()
+        tbot.log_event.testcase_begin("inner")
+        tbot.log_event.testcase_end("inner", 0.0)
+        tbot.log_event.testcase_end("outer", 0.0, False)
+        tbot.log.flush_logfile()
+    finally:
+        tbot.log.LOGFILE, tbot.log.LOGINDEX, tbot.log._INDEX = saved
+
+    text = f.getvalue()
+    entries = [json.loads(line) for line in index.getvalue().splitlines()]
+    decoder = json.JSONDecoder()
+
+    events = [e for e in entries if "event" in e]
+    assert [e["event"] for e in events] == [0, 6, 7, 8], repr(events)
+    for entry in events:
+        ev, _ = decoder.raw_decode(text, entry["offset"])
+        assert ev["type"] == entry["type"], f"Wrong offset for {entry!r}"
+        assert ev["data"]["name"] == entry["name"], f"Wrong offset for {entry!r}"
+
+    spans = {e["testcase"]: e for e in entries if "testcase" in e}
+    assert spans["outer"]["begin"] == 0 and spans["outer"]["end"] == len(text)
+    assert (spans["outer"]["first"], spans["outer"]["last"]) == (0, 8)
+    assert not spans["outer"]["success"] and spans["inner"]["success"]
+    ev, _ = decoder.raw_decode(text, spans["inner"]["begin"])
+    assert ev["type"] == ["tc", "begin"], repr(ev)
@@ -1,7 +1,9 @@
+import concurrent.futures
 import typing
 import time
 import re
 import tbot
+from tbot import machine
 from tbot.machine import channel
 from tbot.machine import linux
 from tbot.machine import board
@@ -11,6 +13,7 @@ __all__ = (
     "selftest_machine_labhost_shell",
     "selftest_machine_ssh_shell",
     "selftest_machine_sshlab_shell",
+    "selftest_machine_sshlab_pool",
 )
 
 
@@ -62,10 +65,91 @@ def selftest_machine_sshlab_shell(lab: typing.Optional[linux.LabHost] = None,) -
 
                 with minisshd.MiniSSHLabHost(ssh.port) as sl:
                     selftest_machine_shell(sl)
+
+                    tbot.log.message("Testing exec_fast ...")
+                    ret, out = sl.exec_fast("sh", "-c", "echo Hello; exit 3")
+                    assert (ret, out) == (3, "Hello\n"), repr((ret, out))
+                    out = sl.exec0_fast("cat")
+                    assert out == "", repr(out)
+
+                    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+                        outs = list(
+                            executor.map(
+                                lambda i: sl.exec0_fast("echo", str(i)), range(8)
+                            )
+                        )
+                    assert outs == [f"{i}\n" for i in range(8)], repr(outs)
+
+                    tbot.log.message("Testing stateless mode ...")
+                    sl.stateless = True
+                    with sl.subshell():
+                        sl.exec0("export", "TBOT_STATELESS=1")
+                        assert sl.env("TBOT_STATELESS") == "1"
+                    assert sl.env("TBOT_STATELESS") == ""
         else:
             tbot.log.message(tbot.log.c("Skip").yellow.bold + " ssh tests.")
 
 
+@tbot.testcase
+def selftest_machine_sshlab_pool(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test the SSH LabHost connection pool."""
+    from tbot.machine.linux.lab import ssh
+
+    class FakeTransport:
+        active = True
+
+        def is_active(self) -> bool:
+            return self.active
+
+        def send_ignore(self) -> None:
+            pass
+
+    class FakeClient:
+        def __init__(self) -> None:
+            self.transport = FakeTransport()
+            self.closed = False
+
+        def get_transport(self) -> FakeTransport:
+            return self.transport
+
+        def close(self) -> None:
+            self.closed = True
+
+    pool = ssh._ConnectionPool()
+    key = ("localhost", 22, "tbot", "PrivateKeyAuthenticator", "/id_rsa", False)
+    other_key = ("localhost", 22, "other", "PrivateKeyAuthenticator", "/id_rsa", False)
+    insecure_key = ("localhost", 22, "tbot", "PrivateKeyAuthenticator", "/id_rsa", True)
+
+    tbot.log.message("Testing leases ...")
+    assert pool.acquire(key) is None
+    c1: typing.Any = FakeClient()
+    pool.add(key, c1)
+    reused = pool.acquire(key)
+    assert reused is not None and reused == c1, "Connection was not reused"
+    assert pool.acquire(other_key) is None
+    assert pool.acquire(insecure_key) is None, "Host key checking was skipped"
+    pool.release(key, c1, 60.0)
+    pool.release(key, c1, 60.0)
+    assert not c1.closed, "Idle connection was closed too early"
+
+    tbot.log.message("Testing idle eviction ...")
+    reused = pool.acquire(key)
+    assert reused is not None and reused == c1, "Connection was not reused"
+    pool.release(key, c1, 0.0)
+    assert c1.closed, "Idle connection was not closed"
+    assert pool.acquire(key) is None
+
+    tbot.log.message("Testing health check ...")
+    c2: typing.Any = FakeClient()
+    pool.add(key, c2)
+    pool.release(key, c2, 60.0)
+    c2.transport.active = False
+    assert pool.acquire(key) is None
+    assert c2.closed, "Broken connection was not closed"
+
+    pool.close_all()
+
+
 @tbot.testcase
 def selftest_machine_shell(
     m: typing.Union[linux.LinuxMachine, board.UBootMachine]
@@ -110,6 +194,59 @@ def selftest_machine_shell(
         out = m.env("TBOT_TEST_ENV_VAR")
         assert out == value, repr(out)
 
+        tbot.log.message("Testing host facts ...")
+        facts = m.facts
+        assert facts.nproc is not None and facts.nproc > 0, repr(facts)
+        assert facts.disk_free is not None and facts.disk_free > 0, repr(facts)
+        assert facts.arch not in ["", None] and facts.home not in ["", None]
+        assert m.facts is facts, "Facts were gathered again"
+        assert m.env("HOME") == facts.home, repr(m.env("HOME"))
+
+        m.invalidate_facts()
+        exec_many = m.exec_many
+
+        def exec_many_no_nproc(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            # Act as if nproc did not exist on this machine
+            args = tuple(["false"] if cmd[0] == "nproc" else cmd for cmd in args)
+            return exec_many(*args, **kwargs)
+
+        setattr(m, "exec_many", exec_many_no_nproc)
+        try:
+            partial = m.facts
+        finally:
+            delattr(m, "exec_many")
+        assert partial.nproc is None, repr(partial)
+        assert partial.arch == facts.arch, "A failing fact affected the others"
+        m.invalidate_facts()
+
+        tbot.log.message("Testing cached env vars ...")
+        m.invalidate_facts()
+        ch = m._obtain_channel()
+        sent: typing.List[typing.Union[str, bytes]] = []
+        send = ch.send
+
+        def counting_send(data: typing.Union[str, bytes]) -> None:
+            sent.append(data)
+            send(data)
+
+        setattr(ch, "send", counting_send)
+        try:
+            m.env("HOME"), m.env("PATH")
+            misses = len(sent)
+            assert m.env("HOME") == facts.home, repr(m.env("HOME"))
+            m.env("PATH")
+            assert len(sent) == misses, "Env vars were queried again"
+            m.facts, m.env("SHELL")
+            misses = len(sent)
+            m.env("HOME"), m.env("SHELL"), m.env("PATH")
+            assert len(sent) == misses, "Env vars were queried again"
+        finally:
+            setattr(ch, "send", send)
+
+        m.exec0("export", "TBOT_TEST_ENV_VAR=changed")
+        out = m.env("TBOT_TEST_ENV_VAR")
+        assert out == "changed", repr(out)
+
         tbot.log.message("Testing redirection (and weird paths) ...")
         f = m.workdir / ".redir test.txt"
         if f.exists():
@@ -154,6 +291,73 @@ def selftest_machine_shell(
             ).strip()
             assert out == "FOO", repr(out)
 
+        tbot.log.message("Testing batched commands ...")
+        results = m.exec_many(
+            ["echo", "Hello World"],
+            ["false"],
+            ["echo", "$?", "!#", linux.Pipe, "cat"],
+            ["sh", "-c", "exit 3"],
+        )
+        assert results == [
+            (0, "Hello World\n"),
+            (1, ""),
+            (0, "$? !#\n"),
+            (3, ""),
+        ], repr(results)
+
+        if "printf" in cap:
+            outs = m.exec0_many(["printf", "Hello"], ["printf", "World"])
+            assert outs == ["Hello", "World"], repr(outs)
+
+        raised = False
+        try:
+            m.exec0_many(["true"], ["false"], ["true"])
+        except machine.CommandFailedException as e:
+            assert e.command == "false", repr(e.command)
+            raised = True
+        assert raised
+
+        tbot.log.message("Testing streamed output ...")
+        with m.exec_stream("sh", "-c", "seq 1 2000; printf end; exit 3") as lines:
+            seen = list(lines)
+        assert seen == [f"{i}\n" for i in range(1, 2001)] + ["end"], repr(seen[-3:])
+        assert lines.retcode == 3, repr(lines.retcode)
+
+        with m.exec_stream("sh", "-c", "echo start; sleep 30") as lines:
+            line = next(lines)
+            assert line == "start\n", repr(line)
+        # Closing the stream early interrupted the command
+        out = m.exec0("echo", "after")
+        assert out == "after\n", repr(out)
+
+        if isinstance(m, linux.LabHost):
+            marker = m.workdir / "exec-stream-started"
+            m.exec0("rm", "-f", marker)
+            with m.exec_stream("sh", "-c", f"touch {marker._local_str()}; sleep 30"):
+                # The command is running before any output was requested
+                ch = m.new_channel()
+                try:
+                    ret, _ = ch.raw_command_with_retval(
+                        f"for i in $(seq 50); do test -e {marker._local_str()}"
+                        " && break; sleep 0.1; done; test -e " + marker._local_str()
+                    )
+                finally:
+                    ch.close()
+                assert ret == 0, "Command was not started by exec_stream()"
+            m.exec0("rm", "-f", marker)
+
+        tbot.log.message("Testing background jobs ...")
+        with m.spawn("sh", "-c", "echo hi; sleep 0.5; exit 4") as job:
+            with m.spawn("sleep", "30") as sleeper:
+                assert job.poll() is None, "Job finished too early"
+                assert sleeper.poll() is None, "Job finished too early"
+                assert job.wait(timeout=10) == 4, repr(job.returncode)
+                assert job.output() == "hi\n", repr(job.output())
+
+                sleeper.kill()
+                assert sleeper.wait(timeout=10) == -1, repr(sleeper.returncode)
+        assert not job.out.exists(), "Job output was not removed"
+
         tbot.log.message("Testing subshell ...")
         out = m.env("SUBSHELL_TEST_VAR")
         assert out == "", repr(out)
@@ -4,7 +4,11 @@ import tbot
 from tbot import machine
 from tbot.machine import linux
 
-__all__ = ["selftest_path_integrity", "selftest_path_stat"]
+__all__ = [
+    "selftest_path_integrity",
+    "selftest_path_stat",
+    "selftest_path_stat_cache",
+]
 
 
 @tbot.testcase
@@ -84,3 +88,55 @@ def selftest_path_stat(lab: typing.Optional[linux.LabHost] = None,) -> None:
         tbot.log.message("Checking stat results ...")
         for p, check in stat_list:
             assert check(p.stat().st_mode)
+
+
+@tbot.testcase
+def selftest_path_stat_cache(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    with lab or tbot.acquire_lab() as lh:
+        tbot.log.message("Checking files created behind the host's back ...")
+        f = lh.workdir / "stat-cache-poll"
+        lh.exec0("rm", "-f", f)
+        assert not f.exists()
+        # Not run through exec(), like a file created by another machine
+        lh._obtain_channel().raw_command(f"touch {f._local_str()}")
+        assert f.exists(), "Stat result is cached by default"
+        lh.exec0("rm", f)
+
+        ttl = lh.stat_cache_ttl
+        lh.stat_cache_ttl = 60.0
+        try:
+            _stat_cache_checks(lh)
+        finally:
+            lh.stat_cache_ttl = ttl
+            lh.invalidate_stat_cache()
+
+
+def _stat_cache_checks(lh: linux.LabHost) -> None:
+    files = [lh.workdir / f"stat-cache-{i}" for i in range(200)]
+    lh.exec0("touch", *files[:100])
+    lh.exec0("rm", "-f", *files[100:])
+
+    tbot.log.message("Checking stat_many ...")
+    results = lh.stat_many(files)
+    assert all(st is not None for st in results[:100])
+    assert all(st is None for st in results[100:])
+
+    tbot.log.message("Checking cached predicates ...")
+    ch = lh._obtain_channel()
+    sent: typing.List[typing.Union[str, bytes]] = []
+    send = ch.send
+    setattr(ch, "send", sent.append)
+    try:
+        assert all(p.is_file() and not p.is_dir() for p in files[:100])
+        assert not any(p.exists() for p in files[100:])
+    finally:
+        setattr(ch, "send", send)
+    assert sent == [], "Predicates were not answered from the cache"
+
+    tbot.log.message("Checking cache invalidation ...")
+    lh.exec0("rm", files[0])
+    assert not files[0].exists()
+    lh.exec0("mkdir", files[100])
+    assert files[100].is_dir()
+
+    lh.exec0("rm", "-r", *files[1:101])
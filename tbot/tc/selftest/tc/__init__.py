@@ -5,6 +5,7 @@ from tbot.machine import linux
 
 from .git import *  # noqa: F403
 from .shell import *  # noqa: F403
+from .testsuite import *  # noqa: F403
 
 
 @tbot.testcase
@@ -16,5 +17,8 @@ def selftest_tc(lab: typing.Optional[linux.LabHost] = None,) -> None:
             selftest_tc_git_am,  # noqa: F405
             selftest_tc_git_bisect,  # noqa: F405
             selftest_tc_shell_copy,  # noqa: F405
+            selftest_tc_shell_copy_unchanged,  # noqa: F405
+            selftest_tc_shell_sync,  # noqa: F405
+            selftest_tc_testsuite_parallel,  # noqa: F405
             lab=lh,
         )
@@ -4,7 +4,11 @@ from tbot.machine import linux
 from tbot.tc import shell
 from tbot.tc.selftest import minisshd
 
-__all__ = ("selftest_tc_shell_copy",)
+__all__ = (
+    "selftest_tc_shell_copy",
+    "selftest_tc_shell_copy_unchanged",
+    "selftest_tc_shell_sync",
+)
 
 
 @tbot.testcase
@@ -17,6 +21,7 @@ def selftest_tc_shell_copy(lab: typing.Optional[linux.LabHost] = None,) -> None:
         a.host.exec0("echo", msg, stdout=a)
 
         shell.copy(a, b)
+        assert b.is_file(), "Stat cache of the target was not invalidated"
 
         out = b.host.exec0("cat", b).strip()
         assert out == msg, repr(out) + " != " + repr(msg)
@@ -50,14 +55,180 @@ def selftest_tc_shell_copy(lab: typing.Optional[linux.LabHost] = None,) -> None:
                     do_test(
                         sl.workdir / ".selftest-copy-ssh4",
                         lh.workdir / ".selftest-copy-ssh3",
-                        "Download via SCP Lab",
+                        "Download via SFTP Lab",
                     )
 
                     tbot.log.message("Test uploading a file to an ssh lab ...")
                     do_test(
                         lh.workdir / ".selftest-copy-ssh3",
                         sl.workdir / ".selftest-copy-ssh4",
-                        "Upload via SCP Lab",
+                        "Upload via SFTP Lab",
                     )
+
+                    tbot.log.message("Test resuming an upload to an ssh lab ...")
+                    a = lh.workdir / ".selftest-copy-ssh5"
+                    b = sl.workdir / ".selftest-copy-ssh6"
+                    lh.exec0("echo", "Resumed upload", stdout=a)
+                    sl.exec0(
+                        "printf",
+                        "Resumed",
+                        stdout=sl.workdir
+                        / f".selftest-copy-ssh6{shell._PARTIAL_SUFFIX}",
+                    )
+                    st = a.stat()
+                    sl.exec0(
+                        "printf",
+                        shell._source_id(st.st_size, st.st_mtime),
+                        stdout=sl.workdir
+                        / f".selftest-copy-ssh6{shell._PARTIAL_ID_SUFFIX}",
+                    )
+                    shell.copy(a, b)
+                    out = sl.exec0("cat", b)
+                    assert out == "Resumed upload\n", repr(out)
+
+                    tbot.log.message("Test ignoring a stale partial upload ...")
+                    sl.exec0(
+                        "printf",
+                        "Garbled",
+                        stdout=sl.workdir
+                        / f".selftest-copy-ssh6{shell._PARTIAL_SUFFIX}",
+                    )
+                    sl.exec0(
+                        "printf",
+                        shell._source_id(st.st_size, st.st_mtime - 10),
+                        stdout=sl.workdir
+                        / f".selftest-copy-ssh6{shell._PARTIAL_ID_SUFFIX}",
+                    )
+                    shell.copy(a, b)
+                    out = sl.exec0("cat", b)
+                    assert out == "Resumed upload\n", repr(out)
+
+                    tbot.log.message("Test copying into directories via SFTP ...")
+                    d = sl.workdir / ".selftest-copy-dir"
+                    sl.exec0("mkdir", "-p", d)
+                    shell.copy(a, d)
+                    out = sl.exec0("cat", d / a.name)
+                    assert out == "Resumed upload\n", repr(out)
+                    d2 = lh.workdir / ".selftest-copy-dir"
+                    lh.exec0("mkdir", "-p", d2)
+                    shell.copy(d / a.name, d2)
+                    out = lh.exec0("cat", d2 / a.name)
+                    assert out == "Resumed upload\n", repr(out)
+
+                    tbot.log.message("Test uploading multiple files to an ssh lab ...")
+                    files = [
+                        (
+                            lh.workdir / f".selftest-copy-many{i}",
+                            sl.workdir / f".selftest-copy-many{i}",
+                        )
+                        for i in range(4)
+                    ]
+                    for i, (a, _) in enumerate(files):
+                        lh.exec0("echo", f"File {i}", stdout=a)
+                    shell.copy_many(files, jobs=2)
+                    for i, (_, b) in enumerate(files):
+                        out = sl.exec0("cat", b)
+                        assert out == f"File {i}\n", repr(out)
+        else:
+            tbot.log.message(tbot.log.c("Skip").yellow.bold + " ssh tests.")
+
+
+@tbot.testcase
+def selftest_tc_shell_copy_unchanged(
+    lab: typing.Optional[linux.LabHost] = None,
+) -> None:
+    """Test ``shell.copy`` with ``skip_unchanged``."""
+    with lab or tbot.acquire_lab() as lh:
+        a = lh.workdir / ".selftest-copy-unchanged1"
+        b = lh.workdir / ".selftest-copy-unchanged2"
+        n = 0
+        copy = shell._copy
+
+        def counting_copy(p1: linux.Path, p2: linux.Path) -> None:
+            nonlocal n
+            n += 1
+            copy(p1, p2)
+
+        lh.exec0("rm", "-f", a, b)
+        lh.exec0("echo", "Version 1", stdout=a)
+
+        setattr(shell, "_copy", counting_copy)
+        try:
+            tbot.log.message("Test first copy ...")
+            shell.copy(a, b, skip_unchanged=True)
+            assert lh.exec0("cat", b) == "Version 1\n"
+            assert n == 1, "File was not copied"
+
+            tbot.log.message("Test copying an unchanged file ...")
+            shell.copy(a, b, skip_unchanged=True)
+            assert n == 1, "Unchanged file was copied again"
+
+            tbot.log.message("Test copying a changed file ...")
+            lh.exec0("echo", "Version 2", stdout=a)
+            shell.copy(a, b, skip_unchanged=True)
+            assert lh.exec0("cat", b) == "Version 2\n"
+            assert n == 2, "Changed file was not copied"
+
+            tbot.log.message("Test copying over a modified target ...")
+            lh.exec0("echo", "Modified target", stdout=b)
+            shell.copy_many([(a, b)], skip_unchanged=True)
+            assert lh.exec0("cat", b) == "Version 2\n"
+            assert n == 3, "Modified target was not replaced"
+        finally:
+            setattr(shell, "_copy", copy)
+
+        tbot.log.message("Test the manifest does not grow ...")
+        manifest = shell._Manifest(lh)
+        entry = manifest._entry_file(b)
+        out = lh.exec0("cat", entry)
+        assert out.count("\n") == 1, repr(out)
+
+
+@tbot.testcase
+def selftest_tc_shell_sync(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test ``shell.sync``."""
+
+    def do_test(a: linux.Path, b: linux.Path) -> None:
+        a.host.exec0("rm", "-rf", a)
+        b.host.exec0("rm", "-rf", b)
+        a.host.exec0("mkdir", "-p", a / "sub")
+        a.host.exec0("head", "-c", "65536", "/dev/urandom", stdout=a / "file1")
+        a.host.exec0("echo", "Hello World", stdout=a / "sub" / "file2")
+
+        sent, total = shell.sync(a, b)
+        assert total == 65536 + 12, repr(total)
+        assert sent >= total, f"Only {sent} bytes were sent"
+        out = b.host.exec0("cat", b / "sub" / "file2")
+        assert out == "Hello World\n", repr(out)
+
+        a.host.exec0("echo", "Changed", stdout=a / "sub" / "file2")
+        sent, total = shell.sync(a, b)
+        assert sent < 65536, f"Unchanged file was sent again ({sent} bytes)"
+        out = b.host.exec0("cat", b / "sub" / "file2")
+        assert out == "Changed\n", repr(out)
+
+    with lab or tbot.acquire_lab() as lh:
+        if not lh.test("which", "rsync"):
+            tbot.log.message(tbot.log.c("Skip").yellow.bold + " rsync tests.")
+            return
+
+        tbot.log.message("Test syncing a directory on the same host ...")
+        do_test(
+            lh.workdir / ".selftest-sync-local1", lh.workdir / ".selftest-sync-local2"
+        )
+
+        if minisshd.check_minisshd(lh):
+            with minisshd.minisshd(lh) as ssh:
+                tbot.log.message("Test syncing a directory to an ssh host ...")
+                do_test(
+                    lh.workdir / ".selftest-sync-ssh1",
+                    ssh.workdir / ".selftest-sync-ssh2",
+                )
+
+                tbot.log.message("Test syncing a directory from an ssh host ...")
+                do_test(
+                    ssh.workdir / ".selftest-sync-ssh3",
+                    lh.workdir / ".selftest-sync-ssh4",
+                )
         else:
             tbot.log.message(tbot.log.c("Skip").yellow.bold + " ssh tests.")
@@ -0,0 +1,67 @@
+import contextlib
+import io
+import time
+import typing
+import tbot
+from tbot import tc
+from tbot.machine import linux
+
+__all__ = ("selftest_tc_testsuite_parallel",)
+
+
+@tbot.testcase
+def selftest_tc_testsuite_parallel(lab: typing.Optional[linux.LabHost] = None,) -> None:
+    """Test running a testsuite with multiple workers."""
+    with lab or tbot.acquire_lab() as lh:
+        main_channel = lh._obtain_channel()
+        channels: typing.Set[int] = set()
+        caches: typing.Set[int] = set()
+
+        def make_test(name: str) -> typing.Callable:
+            @tbot.testcase
+            def test(lab: linux.LabHost) -> None:
+                channels.add(id(lab._obtain_channel()))
+                caches.add(id(lab._stat_entries))
+                for i in range(3):
+                    tbot.log.message(f"{name}-{i}")
+                    lab.exec0("sleep", "0.2")
+
+            test.__name__ = name
+            return test
+
+        tbot.log.message("Running testcases concurrently ...")
+        out = io.StringIO()
+        start = time.monotonic()
+        with contextlib.redirect_stdout(out):
+            tc.testsuite(*[make_test(f"par{i}") for i in range(3)], jobs=3, lab=lh)
+        duration = time.monotonic() - start
+        tbot.log.message(f"Took {duration:.3f}s")
+
+        assert duration < 1.5, f"Testcases did not run concurrently ({duration}s)"
+        assert len(channels) == 3, "Workers did not get their own channels"
+        assert id(main_channel) not in channels, "A worker used the main channel"
+        assert len(caches) == 3, "Workers shared their stat caches"
+        assert id(lh._stat_entries) not in caches, "A worker used the main caches"
+
+        lines = out.getvalue().split("\n")
+        for i in range(3):
+            idx = [n for n, line in enumerate(lines) if f"par{i}-" in line]
+            assert len(idx) == 3, repr(lines)
+            assert idx[-1] - idx[0] < 10, "Log output of testcases was interleaved"
+        assert "Ran 3 tests with 3 workers" in out.getvalue(), repr(lines)
+
+        tbot.log.message("Checking failure ...")
+
+        @tbot.testcase
+        def failing(lab: linux.LabHost) -> None:
+            raise RuntimeError("failing")
+
+        raised = False
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                tc.testsuite(make_test("ok"), failing, jobs=2, lab=lh)
+            except Exception as e:
+                raised = str(e) == "1/2 tests failed"
+        assert raised
+
+        assert lh.exec0("echo", "still working") == "still working\n"
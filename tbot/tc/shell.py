@@ -14,17 +14,61 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import concurrent.futures
+import errno
+import hashlib
+import json
+import os
+import pathlib
+import posixpath
+import re
+import shlex
+import stat
+import threading
+import time
 import typing
+import paramiko
 import tbot
 from tbot.machine import linux
 from tbot.machine.linux import auth
 
-__all__ = ("copy",)
+__all__ = ("copy", "copy_many", "sync")
 
 H1 = typing.TypeVar("H1", bound=linux.LinuxMachine)
 H2 = typing.TypeVar("H2", bound=linux.LinuxMachine)
 
 
+def _ssh_args(
+    *,
+    port_flag: str,
+    port: int,
+    ignore_hostkey: bool,
+    ssh_config: typing.List[str],
+    authenticator: auth.Authenticator,
+) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """
+    Return the arguments needed for ssh based tools.
+
+    The first list is a prefix for the whole command, the second one contains
+    the options for ``ssh``/``scp``.
+    """
+    hk_disable = ["-o", "StrictHostKeyChecking=no"] if ignore_hostkey else []
+
+    prefix: typing.List[str] = []
+    options = [
+        *[port_flag, str(port)],
+        *hk_disable,
+        *[arg for opt in ssh_config for arg in ["-o", opt]],
+    ]
+
+    if isinstance(authenticator, auth.PrivateKeyAuthenticator):
+        options += ["-o", "BatchMode=yes", "-i", str(authenticator.key)]
+    elif isinstance(authenticator, auth.PasswordAuthenticator):
+        prefix = ["sshpass", "-p", authenticator.password]
+
+    return prefix, options
+
+
 def _scp_copy(
     *,
     local_path: linux.Path[H1],
@@ -39,19 +83,14 @@ def _scp_copy(
 ) -> None:
     local_host = local_path.host
 
-    hk_disable = ["-o", "StrictHostKeyChecking=no"] if ignore_hostkey else []
-
-    scp_command = [
-        "scp",
-        *["-P", str(port)],
-        *hk_disable,
-        *[arg for opt in ssh_config for arg in ["-o", opt]],
-    ]
-
-    if isinstance(authenticator, auth.PrivateKeyAuthenticator):
-        scp_command += ["-o", "BatchMode=yes", "-i", str(authenticator.key)]
-    elif isinstance(authenticator, auth.PasswordAuthenticator):
-        scp_command = ["sshpass", "-p", authenticator.password] + scp_command
+    prefix, options = _ssh_args(
+        port_flag="-P",
+        port=port,
+        ignore_hostkey=ignore_hostkey,
+        ssh_config=ssh_config,
+        authenticator=authenticator,
+    )
+    scp_command = [*prefix, "scp", *options]
 
     if copy_to_remote:
         local_host.exec0(
@@ -67,22 +106,407 @@ def _scp_copy(
         )
 
 
+# Paramiko's default window of 2 MiB stalls fast links, as the sender has to
+# wait for the window to be adjusted much more often
+_SFTP_WINDOW_SIZE = 64 * 1024 * 1024
+_SFTP_MAX_PACKET_SIZE = 128 * 1024
+_SFTP_CHUNK_SIZE = 32 * 1024
+# Suffix of files which are being transferred.  Leftovers from an interrupted
+# transfer are used to resume it.
+_PARTIAL_SUFFIX = ".tbot-partial"
+# Suffix of the file next to a partial one, which records the size and mtime
+# of the source it belongs to
+_PARTIAL_ID_SUFFIX = ".tbot-partial-id"
+
+
+def _open_sftp(lab: linux.lab.SSHLabHost) -> paramiko.SFTPClient:
+    """Open an SFTP session on the existing connection of ``lab``."""
+    return paramiko.SFTPClient.from_transport(
+        lab.client.get_transport(),
+        window_size=_SFTP_WINDOW_SIZE,
+        max_packet_size=_SFTP_MAX_PACKET_SIZE,
+    )
+
+
+def _source_id(size: int, mtime: float) -> str:
+    """Return the identity of a source file, as stored next to partial files."""
+    # SFTP only transfers whole seconds
+    return f"{size} {int(mtime)}"
+
+
+def _resume_offset(
+    size: int,
+    partial_size: typing.Optional[int],
+    source_id: str,
+    partial_id: typing.Optional[str],
+    read_source: typing.Callable[[int, int], bytes],
+    read_partial: typing.Callable[[int, int], bytes],
+) -> int:
+    """
+    Return where an interrupted transfer can be resumed.
+
+    The partial file is only trusted if it was written from a source with the
+    same size and mtime, it is not larger than the source, and its last chunk
+    matches the source.
+    """
+    if partial_size is None or partial_size > size or partial_id != source_id:
+        return 0
+
+    check = min(partial_size, _SFTP_CHUNK_SIZE)
+    start = partial_size - check
+    if read_source(start, check) != read_partial(start, check):
+        return 0
+    return partial_size
+
+
+def _sftp_rename(sftp: paramiko.SFTPClient, old: str, new: str) -> None:
+    try:
+        sftp.posix_rename(old, new)
+    except IOError:
+        # Server does not support the posix-rename extension, which is the
+        # only way to replace an existing file
+        try:
+            sftp.remove(new)
+        except IOError:
+            pass
+        sftp.rename(old, new)
+
+
+def _sftp_put(sftp: paramiko.SFTPClient, local: str, remote: str) -> None:
+    try:
+        if stat.S_ISDIR(sftp.stat(remote).st_mode):
+            # Like scp, copy into the directory
+            remote = posixpath.join(remote, os.path.basename(local))
+    except IOError:
+        pass
+
+    partial = remote + _PARTIAL_SUFFIX
+    partial_id_file = remote + _PARTIAL_ID_SUFFIX
+    st = os.stat(local)
+    size = st.st_size
+    source_id = _source_id(size, st.st_mtime)
+
+    with open(local, "rb") as src:
+        try:
+            partial_size: typing.Optional[int] = sftp.stat(partial).st_size
+            with sftp.open(partial_id_file, "r") as f:
+                partial_id: typing.Optional[str] = f.read().decode()
+        except IOError:
+            partial_size, partial_id = None, None
+
+        def read_source(offset: int, length: int) -> bytes:
+            src.seek(offset)
+            return src.read(length)
+
+        def read_partial(offset: int, length: int) -> bytes:
+            with sftp.open(partial, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        offset = _resume_offset(
+            size, partial_size, source_id, partial_id, read_source, read_partial
+        )
+        if offset > 0:
+            tbot.log.message(f"Resuming upload at {offset} of {size} bytes ...")
+        else:
+            with sftp.open(partial_id_file, "w") as f:
+                f.write(source_id.encode())
+
+        with sftp.open(partial, "r+b" if offset > 0 else "wb") as dst:
+            # Don't wait for each write to be acknowledged
+            dst.set_pipelined(True)
+            dst.seek(offset)
+            src.seek(offset)
+            while True:
+                data = src.read(_SFTP_CHUNK_SIZE * 32)
+                if data == b"":
+                    break
+                dst.write(data)
+
+    _sftp_rename(sftp, partial, remote)
+    sftp.remove(partial_id_file)
+
+
+def _sftp_get(sftp: paramiko.SFTPClient, remote: str, local: str) -> None:
+    if os.path.isdir(local):
+        # Like scp, copy into the directory
+        local = os.path.join(local, posixpath.basename(remote))
+
+    partial = local + _PARTIAL_SUFFIX
+    partial_id_file = local + _PARTIAL_ID_SUFFIX
+
+    with sftp.open(remote, "rb") as src:
+        st = src.stat()
+        size = st.st_size
+        source_id = _source_id(size, st.st_mtime)
+        try:
+            partial_size: typing.Optional[int] = os.stat(partial).st_size
+            with open(partial_id_file) as f:
+                partial_id: typing.Optional[str] = f.read()
+        except FileNotFoundError:
+            partial_size, partial_id = None, None
+
+        def read_source(offset: int, length: int) -> bytes:
+            src.seek(offset)
+            return src.read(length)
+
+        def read_partial(offset: int, length: int) -> bytes:
+            with open(partial, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        offset = _resume_offset(
+            size, partial_size, source_id, partial_id, read_source, read_partial
+        )
+        if offset > 0:
+            tbot.log.message(f"Resuming download at {offset} of {size} bytes ...")
+        else:
+            with open(partial_id_file, "w") as f:
+                f.write(source_id)
+
+        with open(partial, "r+b" if offset > 0 else "wb") as dst:
+            dst.seek(offset)
+            # readv() sends all read requests up front instead of waiting for
+            # each chunk before requesting the next one
+            chunks = [
+                (o, min(_SFTP_CHUNK_SIZE, size - o))
+                for o in range(offset, size, _SFTP_CHUNK_SIZE)
+            ]
+            for data in src.readv(chunks):
+                dst.write(data)
+
+    os.replace(partial, local)
+    os.remove(partial_id_file)
+
+
+def _sftp_lab(
+    p1: linux.Path[H1], p2: linux.Path[H2]
+) -> typing.Optional[linux.lab.SSHLabHost]:
+    """Return the SSHLabHost if copying from ``p1`` to ``p2`` can use SFTP."""
+    if isinstance(p1.host, linux.lab.LocalLabHost) and isinstance(
+        p2.host, linux.lab.SSHLabHost
+    ):
+        return p2.host
+    if isinstance(p2.host, linux.lab.LocalLabHost) and isinstance(
+        p1.host, linux.lab.SSHLabHost
+    ):
+        return p1.host
+    return None
+
+
+def _sftp_copy(
+    sftp: paramiko.SFTPClient, p1: linux.Path[H1], p2: linux.Path[H2]
+) -> None:
+    host: linux.LinuxMachine = p2.host
+    if isinstance(host, linux.lab.SSHLabHost):
+        _sftp_put(sftp, p1._local_str(), p2._local_str())
+    else:
+        _sftp_get(sftp, p1._local_str(), p2._local_str())
+    # The transfer did not go through exec(), so cached stat results of the
+    # target are stale
+    host.invalidate_stat_cache()
+
+
+class _HashCache:
+    """
+    Persistent cache of file hashes on the local host.
+
+    Entries are keyed by host and path and are only valid as long as the
+    file's size and mtime did not change.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: typing.Optional[typing.Dict[str, typing.List]] = None
+
+    def _load(self) -> typing.Dict[str, typing.List]:
+        if self.entries is None:
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return typing.cast(typing.Dict[str, typing.List], self.entries)
+
+    def lookup(self, key: str, st: os.stat_result) -> typing.Optional[str]:
+        with self.lock:
+            entry = self._load().get(key)
+        if entry is not None and entry[:2] == [st.st_size, st.st_mtime]:
+            return typing.cast(str, entry[2])
+        return None
+
+    def store(self, key: str, st: os.stat_result, digest: str) -> None:
+        with self.lock:
+            self._load()[key] = [st.st_size, st.st_mtime, digest]
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}")
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.path)
+
+
+_HASH_CACHE = _HashCache(
+    pathlib.Path(os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache"))
+    / "tbot"
+    / "sha256.json"
+)
+
+
+def _stat(p: linux.Path[H1]) -> os.stat_result:
+    """Return the stat result of ``p``, following symlinks."""
+    res = p.host._stat_lookup(p)
+    if res is None or res[1] is None:
+        raise OSError(errno.ENOENT, f"Can't stat {p}")
+    return res[1]
+
+
+def _digest(p: linux.Path[H1]) -> str:
+    """Return the sha256 of a file, using the hash cache."""
+    st = _stat(p)
+    key = f"{p.host.name}:{p._local_str()}"
+    digest = _HASH_CACHE.lookup(key, st)
+    if digest is None:
+        if isinstance(p.host, linux.lab.LocalLabHost):
+            h = hashlib.sha256()
+            with open(p._local_str(), "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+        else:
+            digest = p.host.exec0("sha256sum", p).split(" ", 1)[0]
+        # mtime only has a resolution of one second, so the file could still
+        # change without this being noticed if it was modified just now
+        if time.time() - st.st_mtime > 2:
+            _HASH_CACHE.store(key, st, digest)
+    return digest
+
+
+class _Manifest:
+    """
+    Hashes of the files that were copied to a host.
+
+    The manifest is a directory in the host's workdir with one file per
+    target, named after the sha256 of the target's path.  It contains the
+    hash, size and mtime of the target right after it was copied and is
+    replaced on every copy, so the manifest does not grow over time.
+    """
+
+    def __init__(self, host: linux.LinuxMachine) -> None:
+        self.host = host
+        self.path = host.workdir / ".tbot-manifest.d"
+        self.entries: typing.Dict[str, typing.Optional[typing.Tuple[str, int, int]]]
+        self.entries = {}
+
+    def _entry_file(self, p: linux.Path) -> linux.Path:
+        return self.path / hashlib.sha256(p._local_str().encode()).hexdigest()
+
+    def load(self, paths: typing.Iterable[linux.Path]) -> None:
+        """Read the entries of ``paths`` in a single round trip."""
+        missing = [p for p in paths if p._local_str() not in self.entries]
+        if missing == []:
+            return
+
+        commands: typing.List[typing.List[typing.Union[str, linux.Path]]] = [
+            ["cat", self._entry_file(p)] for p in missing
+        ]
+        results = self.host.exec_many(*commands)
+        for p, (ret, out) in zip(missing, results):
+            fields = out.split()
+            if ret == 0 and len(fields) == 3:
+                self.entries[p._local_str()] = (
+                    fields[0],
+                    int(fields[1]),
+                    int(fields[2]),
+                )
+            else:
+                self.entries[p._local_str()] = None
+
+    def unchanged(self, p: linux.Path, digest: str) -> bool:
+        """Whether ``p`` still has the contents it was last copied with."""
+        self.load([p])
+        entry = self.entries[p._local_str()]
+        if entry is None or entry[0] != digest:
+            return False
+        try:
+            st = _stat(p)
+        except OSError:
+            return False
+        return entry[1:] == (st.st_size, int(st.st_mtime))
+
+    def update(self, p: linux.Path, digest: str) -> None:
+        st = _stat(p)
+        entry = (digest, st.st_size, int(st.st_mtime))
+        self.entries[p._local_str()] = entry
+        self.host.exec0(
+            "mkdir",
+            "-p",
+            self.path,
+            linux.AndThen,
+            "printf",
+            "%s %d %d\n",
+            *map(str, entry),
+            stdout=self._entry_file(p),
+        )
+
+
 @tbot.testcase
-def copy(p1: linux.Path[H1], p2: linux.Path[H2]) -> None:
+def copy(
+    p1: linux.Path[H1], p2: linux.Path[H2], *, skip_unchanged: bool = False
+) -> None:
     """
     Copy a file, possibly from one host to another.
 
     If one of the paths is associated with an SSHMachine,
-    ``scp`` will be used to do the transfer.
+    ``scp`` will be used to do the transfer.  It reuses the machine's
+    connection if :attr:`~tbot.machine.linux.SSHMachine.multiplexing`
+    is enabled.
+
+    Between the local host and an :class:`~tbot.machine.linux.lab.SSHLabHost`,
+    files are transferred using SFTP over the lab-host's existing connection.
+    The file is written to a temporary name next to the target first and
+    renamed once it is complete.  If a previous transfer was interrupted,
+    it is resumed.  Use :func:`copy_many` to transfer multiple files
+    concurrently.
+
+    If ``skip_unchanged`` is set, the sha256 of ``p1`` is compared to the one
+    it had when it was last copied to ``p2``, which is recorded in a manifest
+    in the workdir of ``p2``'s host.  Only if they differ, or ``p2`` was
+    modified in the meantime, the file is copied.  Hashes are cached on the
+    local host as long as size and mtime of ``p1`` don't change, so unchanged
+    files are not even read again.
+
+    **Example**::
+
+        # Only transfers the image if it was rebuilt
+        shell.copy(build / "uImage", tftpdir / "uImage", skip_unchanged=True)
 
     :param linux.Path p1: Exisiting path to be copied
-    :param linux.Path p2: Target where ``p1`` should be copied
+    :param linux.Path p2: Target where ``p1`` should be copied.  With
+        ``skip_unchanged``, this must be the path of the file, not
+        a directory.
+    :param bool skip_unchanged: Don't copy ``p1`` if ``p2`` already has the
+        same contents.
     """
+    if not skip_unchanged:
+        _copy(p1, p2)
+        return
+
+    digest = _digest(p1)
+    manifest = _Manifest(p2.host)
+    if manifest.unchanged(p2, digest):
+        tbot.log.message(f"{tbot.log.c(str(p2)).dark} is up to date.")
+        return
+
+    _copy(p1, p2)
+    manifest.update(p2, digest)
+
+
+def _copy(p1: linux.Path[H1], p2: linux.Path[H2]) -> None:
     if isinstance(p1.host, p2.host.__class__) or isinstance(p2.host, p1.host.__class__):
         # Both paths are on the same host
         p2_w1 = linux.Path(p1.host, p2)
         p1.host.exec0("cp", p1, p2_w1)
-        return
     elif isinstance(p1.host, linux.SSHMachine) and p1.host.labhost is p2.host:
         # Copy from an SSH machine
         _scp_copy(
@@ -93,7 +517,7 @@ def copy(p1: linux.Path[H1], p2: linux.Path[H2]) -> None:
             hostname=p1.host.hostname,
             ignore_hostkey=p1.host.ignore_hostkey,
             port=p1.host.port,
-            ssh_config=p1.host.ssh_config,
+            ssh_config=[*p1.host.ssh_config, *p1.host._mux_config()],
             authenticator=p1.host.authenticator,
         )
     elif isinstance(p2.host, linux.SSHMachine) and p2.host.labhost is p1.host:
@@ -106,38 +530,229 @@ def copy(p1: linux.Path[H1], p2: linux.Path[H2]) -> None:
             hostname=p2.host.hostname,
             ignore_hostkey=p2.host.ignore_hostkey,
             port=p2.host.port,
-            ssh_config=p2.host.ssh_config,
+            ssh_config=[*p2.host.ssh_config, *p2.host._mux_config()],
             authenticator=p2.host.authenticator,
         )
-    elif isinstance(p1.host, linux.lab.LocalLabHost) and isinstance(
-        p2.host, linux.lab.SSHLabHost
-    ):
-        # Copy from local to ssh labhost
-        _scp_copy(
-            local_path=p1,
-            remote_path=p2,
-            copy_to_remote=True,
-            username=p2.host.username,
-            hostname=p2.host.hostname,
-            ignore_hostkey=p2.host.ignore_hostkey,
-            port=p2.host.port,
-            ssh_config=[],
-            authenticator=p2.host.authenticator,
+    elif _sftp_lab(p1, p2) is not None:
+        # Copy between local and ssh labhost, using the existing connection
+        lab = typing.cast(linux.lab.SSHLabHost, _sftp_lab(p1, p2))
+        tbot.log.message(
+            f"Copying {tbot.log.c(str(p1)).dark} to {tbot.log.c(str(p2)).dark} via SFTP ...",
+            verbosity=tbot.log.Verbosity.COMMAND,
         )
-    elif isinstance(p2.host, linux.lab.LocalLabHost) and isinstance(
-        p1.host, linux.lab.SSHLabHost
+        sftp = _open_sftp(lab)
+        try:
+            _sftp_copy(sftp, p1, p2)
+        finally:
+            sftp.close()
+    else:
+        raise NotImplementedError(f"Can't copy from {p1.host} to {p2.host}!")
+
+    # The copy did not necessarily run on p2's host (scp runs on the lab-host),
+    # so cached stat results of the target are stale
+    p2.host.invalidate_stat_cache()
+
+
+@tbot.testcase
+def copy_many(
+    pairs: typing.Iterable[typing.Tuple[linux.Path, linux.Path]],
+    jobs: int = 4,
+    *,
+    skip_unchanged: bool = False,
+) -> None:
+    """
+    Copy multiple files, possibly from one host to another.
+
+    Transfers between the local host and an
+    :class:`~tbot.machine.linux.lab.SSHLabHost` are run ``jobs`` at a time,
+    each on its own SFTP session of the existing connection.  All other
+    pairs are copied one after the other, using :func:`copy`.
+
+    **Example**::
+
+        shell.copy_many(
+            [
+                (build / "u-boot.bin", tftpdir / "u-boot.bin"),
+                (build / "uImage", tftpdir / "uImage"),
+            ],
+            skip_unchanged=True,
+        )
+
+    :param pairs: Pairs of an exisiting path and the target it should be
+        copied to.
+    :param int jobs: Maximum number of concurrent SFTP transfers.
+    :param bool skip_unchanged: Don't copy files whose target already has the
+        same contents, see :func:`copy`.
+    """
+    pairs = list(pairs)
+    manifests: typing.Dict[int, _Manifest] = {}
+    if skip_unchanged:
+        for _, p2 in pairs:
+            if id(p2.host) not in manifests:
+                manifests[id(p2.host)] = _Manifest(p2.host)
+        # Read the manifest entries of all targets on a host at once
+        for manifest in manifests.values():
+            manifest.load(p2 for _, p2 in pairs if p2.host is manifest.host)
+
+    parallel = []
+    for p1, p2 in pairs:
+        digest = None
+        if skip_unchanged:
+            digest = _digest(p1)
+            if manifests[id(p2.host)].unchanged(p2, digest):
+                tbot.log.message(f"{tbot.log.c(str(p2)).dark} is up to date.")
+                continue
+
+        lab = _sftp_lab(p1, p2)
+        if lab is None:
+            _copy(p1, p2)
+            if digest is not None:
+                manifests[id(p2.host)].update(p2, digest)
+        else:
+            tbot.log.message(
+                f"Copying {tbot.log.c(str(p1)).dark} to {tbot.log.c(str(p2)).dark} via SFTP ...",
+                verbosity=tbot.log.Verbosity.COMMAND,
+            )
+            parallel.append((lab, p1, p2, digest))
+
+    local = threading.local()
+    sessions: typing.List[paramiko.SFTPClient] = []
+
+    def transfer(lab: linux.lab.SSHLabHost, p1: linux.Path, p2: linux.Path) -> None:
+        # SFTP sessions are reused by each worker, one per lab-host
+        if not hasattr(local, "sessions"):
+            local.sessions = {}
+        if id(lab) not in local.sessions:
+            local.sessions[id(lab)] = _open_sftp(lab)
+            sessions.append(local.sessions[id(lab)])
+        _sftp_copy(local.sessions[id(lab)], p1, p2)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(transfer, lab, p1, p2) for lab, p1, p2, _ in parallel
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        for sftp in sessions:
+            sftp.close()
+
+    # Machines are not thread-safe, so the manifests are only updated once
+    # all transfers are done
+    for _, _, p2, digest in parallel:
+        if digest is not None:
+            manifests[id(p2.host)].update(p2, digest)
+
+
+def _rsync_stat(out: str, name: str) -> int:
+    match = re.search(f"^{name}: ([0-9,.]+)", out, re.MULTILINE)
+    if match is None:
+        raise RuntimeError(f"rsync did not report {name!r}")
+    # Numbers contain thousands separators depending on the locale
+    return int(re.sub(r"[,.]", "", match.group(1)))
+
+
+@tbot.testcase
+def sync(
+    src: linux.Path[H1], dst: linux.Path[H2], *, delete: bool = False
+) -> typing.Tuple[int, int]:
+    """
+    Synchronize a file or directory tree, possibly from one host to another.
+
+    Uses ``rsync``, so only the parts of files that changed are transferred.
+    Supports the same pairs of hosts as :func:`copy` and reuses the ssh
+    settings (port, authenticator, ``ssh_config``) of the remote host.
+    ``rsync`` has to be installed on both hosts.
+
+    If ``src`` is a directory, ``dst`` will be a directory with the same
+    contents afterwards (not a subdirectory of it).
+
+    **Example**::
+
+        build_dir = uboot.build()
+        sent, total = shell.sync(build_dir, lh.workdir / "u-boot-build")
+
+    :param linux.Path src: Exisiting file or directory to be synchronized
+    :param linux.Path dst: Target which should be updated
+    :param bool delete: Delete files in ``dst`` that don't exist in ``src``
+    :rtype: (int, int)
+    :returns: The number of bytes that were transferred and the total size of
+        all files in ``src``.
+    """
+    rsync_command = ["rsync", "--archive", "--protect-args", "--stats"]
+    if delete:
+        rsync_command.append("--delete")
+
+    # A trailing slash makes rsync copy the contents of a directory
+    src_spec = src._local_str() + ("/" if src.is_dir() else "")
+    dst_spec = dst._local_str()
+
+    local: linux.LinuxMachine
+    prefix: typing.List[str] = []
+    ssh_options: typing.Optional[typing.List[str]] = None
+    if isinstance(src.host, dst.host.__class__) or isinstance(
+        dst.host, src.host.__class__
     ):
-        # Copy to local from ssh labhost
-        _scp_copy(
-            local_path=p2,
-            remote_path=p1,
-            copy_to_remote=False,
-            username=p1.host.username,
-            hostname=p1.host.hostname,
-            ignore_hostkey=p1.host.ignore_hostkey,
-            port=p1.host.port,
+        # Both paths are on the same host
+        local = src.host
+    elif isinstance(src.host, linux.SSHMachine) and src.host.labhost is dst.host:
+        # Sync from an SSH machine
+        local = dst.host
+        src_spec = f"{src.host.username}@{src.host.hostname}:{src_spec}"
+        prefix, ssh_options = _ssh_args(
+            port_flag="-p",
+            port=src.host.port,
+            ignore_hostkey=src.host.ignore_hostkey,
+            ssh_config=[*src.host.ssh_config, *src.host._mux_config()],
+            authenticator=src.host.authenticator,
+        )
+    elif isinstance(dst.host, linux.SSHMachine) and dst.host.labhost is src.host:
+        # Sync to an SSH machine
+        local = src.host
+        dst_spec = f"{dst.host.username}@{dst.host.hostname}:{dst_spec}"
+        prefix, ssh_options = _ssh_args(
+            port_flag="-p",
+            port=dst.host.port,
+            ignore_hostkey=dst.host.ignore_hostkey,
+            ssh_config=[*dst.host.ssh_config, *dst.host._mux_config()],
+            authenticator=dst.host.authenticator,
+        )
+    elif _sftp_lab(src, dst) is not None:
+        # Sync between local and ssh labhost
+        lab = typing.cast(linux.lab.SSHLabHost, _sftp_lab(src, dst))
+        if lab is src.host:
+            local = dst.host
+            src_spec = f"{lab.username}@{lab.hostname}:{src_spec}"
+        else:
+            local = src.host
+            dst_spec = f"{lab.username}@{lab.hostname}:{dst_spec}"
+        prefix, ssh_options = _ssh_args(
+            port_flag="-p",
+            port=lab.port,
+            ignore_hostkey=lab.ignore_hostkey,
             ssh_config=[],
-            authenticator=p1.host.authenticator,
+            authenticator=lab.authenticator,
         )
     else:
-        raise NotImplementedError(f"Can't copy from {p1.host} to {p2.host}!")
+        raise NotImplementedError(f"Can't sync from {src.host} to {dst.host}!")
+
+    if ssh_options is not None:
+        ssh_command = " ".join(map(shlex.quote, ["ssh", *ssh_options]))
+        rsync_command = [*prefix, *rsync_command, "--rsh", ssh_command]
+
+    out = local.exec0(*rsync_command, src_spec, dst_spec)
+    dst.host.invalidate_stat_cache()
+
+    # The stats are reported by the local rsync, which receives the data if
+    # the source is remote
+    if local is src.host:
+        sent = _rsync_stat(out, "Total bytes sent")
+    else:
+        sent = _rsync_stat(out, "Total bytes received")
+    total = _rsync_stat(out, "Total file size")
+    saved = 100 - sent * 100 // total if total > 0 else 0
+    tbot.log.message(
+        f"Transferred {tbot.log.c(str(sent)).bold} of {total} bytes ({saved}% saved)."
+    )
+    return sent, total
@@ -67,7 +67,9 @@ def build(
                 bh.exec0("make", "mrproper")
                 bh.exec0("make", bi.defconfig)
 
-            nproc = bh.exec0("nproc", "--all").strip()
-            bh.exec0("make", "-j", nproc, "all")
+            nproc = bh.facts.nproc
+            if nproc is None:
+                nproc = int(bh.exec0("nproc", "--all"))
+            bh.exec0("make", "-j", str(nproc), "all")
 
         return repo